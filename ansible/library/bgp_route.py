@@ -29,6 +29,14 @@ Options:
       required: False (if neighbor is presented, then direction is required)
       description: to restict retrieving bgp neighbor advertise or received routes
       Choice:  [adv | rec]
+
+    - option-name: prefixes
+      description: list of prefixes to be retrieved from the neighbor advertised routes,
+                   the routes are filtered on the DUT, so only these routes are returned
+      required: False
+      Default: None (all advertised routes)
+    - The neighbor advertised routes are read from the json output of vtysh if it's supported,
+      otherwise the text output is parsed
 '''
 
 EXAMPLES = '''
@@ -37,6 +45,12 @@ EXAMPLES = '''
 
 - name: Get neighbor BGP advertise route information
   bgp_route: neighbor='10.0.0.1' direction='adv'
+
+- name: Get neighbor BGP advertise route information of the specific prefixes
+  bgp_route:
+    neighbor: '10.0.0.1'
+    direction: 'adv'
+    prefixes: ['192.168.10.112/32', '192.168.10.113/32']
 '''
 
 RETURN = '''
@@ -143,62 +157,97 @@ SAMPLE_COMMAND_DATA = '''
 
 ### TODO: Not fully tested ipv6 route entries parsing option, need continue working on ipv6 specific commands###
 
+# origin codes of the vtysh text output by the origin names of the json output
+ORIGIN_CODES = {'IGP': 'i', 'EGP': 'e', 'incomplete': '?'}
+
 class BgpRoutes(object):
     '''
         parsing bgp routing information
     '''
-    def __init__(self, neighbor=None, direction=None, prefix=None):
+    def __init__(self, neighbor=None, direction=None, prefix=None, prefixes=None):
         self.facts = defaultdict(dict)
         self.neighbor = neighbor
         self.direction = direction
         self.prefix = prefix
+        self.prefixes = set(prefixes) if prefixes else None
         return
 
     def get_facts(self):
         return self.facts
 
+    def parse_adv_path(self, line):
+        '''
+        parse weight, aspath and origin at the end of the advertised route entry line
+        "<prefix> <nexthop>  <metric>  <locprf>  <weight> [<asn> ...] <i|e|?>"
+        weight is the first field after the last run of two or more spaces
+        '''
+        _, sep, tail = line.rstrip().rpartition('  ')
+        if not sep:
+            return None
+        fields = tail.split()
+        if len(fields) < 2 or fields[-1] not in ('i', 'e', '?'):
+            return None
+        for field in fields[:-1]:
+            if not field.isdigit():
+                return None
+        return {'weight': fields[0], 'aspath': fields[1:-1], 'origin': fields[-1]}
+
     def parse_bgp_route_adv(self, cmd_result):
         '''
         parse BGP routing facts of neighbor advertised routes
+        the output is walked once, only the routes of self.prefixes are kept if prefixes are given
         '''
         self.facts['bgp_route_neiadv']['neighbor'] = self.neighbor
         ### so far parsing prefix, nexthop and aspath, origin and weight 
         header = 'Metric LocPrf Weight Path'
-        result_lines = cmd_result.split('\n')
-        table_start = False
-        re_aspath = re.compile('.*\s{2,}(\d+)\s((\d+\s)+)?([ie\?])$')
-        while len(result_lines) != 0:
-            line = result_lines.pop(0)
-            if not table_start:
-                if header in line:
-                    table_start = True
-                    continue
-            else:
-                ## only parse valid route entry, ignore if it's not marked as valid
-                if not re.match('^\*', line):
-                    continue
-                entry = dict()
-                fields = line.strip().split()
-                prefix = fields[1]
-                if len(fields) > 2:    ### route entry in one line
-                    nexthop = fields[2]
-                else:                  ### route entry in two lines
-                    line = result_lines.pop(0)
-                    nexthop = line.strip().split()[0]
-                m = re_aspath.match(line)
-                if m:
-                    weight = m.group(1)
-                    aspath = m.group(2)
-                    origin = m.group(4)
-                    if aspath:
-                        entry['aspath'] = aspath.split()
-                    else:
-                        entry['aspath'] = []
-                    entry['nexthop'] = nexthop
-                    entry['origin'] = origin
-                    entry['weight'] = weight
-                self.facts['bgp_route_neiadv'][prefix] = entry
+        result_lines = iter(cmd_result.split('\n'))
+        for line in result_lines:
+            if header in line:
+                break
+        for line in result_lines:
+            ## only parse valid route entry, ignore if it's not marked as valid
+            if not line.startswith('*'):
+                continue
+            fields = line.split()
+            prefix = fields[1]
+            if len(fields) > 2:    ### route entry in one line
+                nexthop = fields[2]
+            else:                  ### route entry in two lines
+                line = next(result_lines)
+                nexthop = line.split()[0]
+            if self.prefixes is not None and prefix not in self.prefixes:
+                continue
+            entry = dict()
+            path = self.parse_adv_path(line)
+            if path:
+                entry.update(path)
+                entry['nexthop'] = nexthop
+            self.facts['bgp_route_neiadv'][prefix] = entry
+
+    def parse_bgp_route_adv_json(self, cmd_result):
+        '''
+        parse BGP routing facts of neighbor advertised routes from the json output of vtysh
+        return False if the output is not json, e.g. vtysh doesn't support json for the command
+        '''
+        try:
+            routes = json.loads(cmd_result)['advertisedRoutes']
+        except (ValueError, KeyError, TypeError):
+            return False
 
+        self.facts['bgp_route_neiadv']['neighbor'] = self.neighbor
+        for prefix, route in routes.iteritems():
+            if '/' not in prefix:
+                prefix = "%s/%s" % (route.get('addrPrefix', prefix), route.get('prefixLen'))
+            if self.prefixes is not None and prefix not in self.prefixes:
+                continue
+            origin = route.get('origin', '')
+            self.facts['bgp_route_neiadv'][prefix] = {
+                'nexthop': route.get('nextHop', route.get('nextHopGlobal')),
+                'weight': str(route.get('weight', 0)),
+                'aspath': route.get('path', '').split(),
+                'origin': ORIGIN_CODES.get(origin, origin),
+            }
+        return True
 
     def parse_bgp_route_prefix(self, cmd_result):
         '''
@@ -233,11 +282,9 @@ class BgpRoutes(object):
             self.facts['bgp_route'][prefix]['found'] = False
             return
 
-        result_lines = cmd_result.split('\n')
         state = HEADER
         self.facts['bgp_route'][prefix]['aspath'] = []
-        while len(result_lines) != 0:
-            line = result_lines.pop(0)
+        for line in cmd_result.split('\n'):
             if line == '':
                 continue
             if state == HEADER:
@@ -290,12 +337,38 @@ class BgpRoutes(object):
                 raise Exception("cannot parse bgp prefix info correctly " + str(state) + str(self.facts))
 
 
+def get_neighbor_routes(module, bgproute, neighbor, direction):
+    '''
+    run "show ip(v6) bgp neighbor <neighbor> <direction>" and parse the routes into bgproute
+    the advertised routes are read from the json output first, vtysh without json support of the
+    command falls back to the text output
+    '''
+    if netaddr.valid_ipv4(neighbor):
+        command = "docker exec -i bgp vtysh -c 'show ip bgp neighbor " + str(neighbor)
+    else:
+        command = "docker exec -i bgp vtysh -c 'show ipv6 bgp neighbor " + str(neighbor)
+
+    if direction == 'adv':
+        rc, out, err = module.run_command(command + " advertised-routes json'")
+        if rc == 0 and bgproute.parse_bgp_route_adv_json(out):
+            return
+
+    command += " " + str(direction) + "'"
+    rc, out, err = module.run_command(command)
+    if rc !=  0:
+        err_message = "command %s failed rc=%d, out=%s, err=%s" %(command, rc, out, err)
+        module.fail_json(msg=err_message)
+        return
+    bgproute.parse_bgp_route_adv(out)
+
+
 def main():
     module = AnsibleModule(
             argument_spec=dict(
                 neighbor=dict(required=False, default=None),
                 direction=dict(required=False, choices=['adv', 'rec']),
-                prefix=dict(required=False, default=None)
+                prefix=dict(required=False, default=None),
+                prefixes=dict(required=False, default=None, type='list')
                 ),
             supports_check_mode=False
             )
@@ -303,6 +376,7 @@ def main():
     neighbor = m_args['neighbor']
     direction = m_args['direction']
     prefix = m_args['prefix']
+    prefixes = m_args['prefixes']
     regex_ip = re.compile('[0-9a-fA-F.:]+')
     regex_iprange = re.compile('[0-9a-fA-F.:]+\/\d+')
     regex_ipv4 = re.compile('[12][0-9]{0,2}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\/?\d+?')
@@ -318,7 +392,7 @@ def main():
         module.fail_json(msg=err_message)
         return
     try:
-        bgproute = BgpRoutes(neighbor, direction, prefix)
+        bgproute = BgpRoutes(neighbor, direction, prefix, prefixes)
 
         if prefix:
             if regex_ipv4.match(prefix):
@@ -327,22 +401,13 @@ def main():
                 command = "docker exec -i bgp vtysh -c 'show ipv6 bgp " + str(prefix) +  "'"
             rc, out, err = module.run_command(command)
             if rc != 0:
-                err_message = "command %s failed rc=%d, out=%s, err=%s" %(command, rt, out, err)
+                err_message = "command %s failed rc=%d, out=%s, err=%s" %(command, rc, out, err)
                 module.fail_json(msg=err_message)
                 return
             bgproute.parse_bgp_route_prefix(out)
 
         elif neighbor:
-            if netaddr.valid_ipv4(neighbor):
-                command = "docker exec -i bgp vtysh -c 'show ip bgp neighbor " + str(neighbor) + " " + str(direction) + "'"
-            else:
-                command = "docker exec -i bgp vtysh -c 'show ipv6 bgp neighbor " + str(neighbor) + " " + str(direction) + "'"
-            rc, out, err = module.run_command(command)
-            if rc !=  0:
-                err_message = "command %s failed rc=%d, out=%s, err=%s" %(command, rt, out, err)
-                module.fail_json(msg=err_message)
-                return
-            bgproute.parse_bgp_route_adv(out)
+            get_neighbor_routes(module, bgproute, neighbor, direction)
 
         results = bgproute.get_facts()
         module.exit_json(ansible_facts=results)
@@ -355,6 +420,7 @@ def main():
 
 from ansible.module_utils.basic import *
 from collections  import defaultdict
+import json
 import netaddr
 if __name__ == "__main__":
     main()
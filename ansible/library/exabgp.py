@@ -61,11 +61,27 @@ while True:
 '''
 
 http_api_py = '''\
-from flask import Flask, request
+from flask import Flask, Response, request, stream_with_context
+import json
 import sys
+import time
 
 app = Flask(__name__)
 
+# Prefixes announced through this api, used to report the number of announced routes
+routes = set()
+
+def write_commands(cmds):
+    for cmd in cmds:
+        sys.stdout.write("%s\\n" % cmd)
+        terms = cmd.split()
+        if len(terms) > 2 and terms[1] == 'route':
+            if terms[0] == 'announce':
+                routes.add(terms[2])
+            elif terms[0] == 'withdraw':
+                routes.discard(terms[2])
+    sys.stdout.flush()
+
 # Setup a command route to listen for prefix advertisements
 @app.route('/', methods=['POST'])
 def run_command():
@@ -73,11 +89,70 @@ def run_command():
         cmds = request.form['commands'].split(';')
     else:
         cmds = [ request.form['command'] ]
-    for cmd in cmds:
-        sys.stdout.write("%s\\n" % cmd)
-    sys.stdout.flush()
+    write_commands(cmds)
     return "OK\\n"
 
+def chunked_lines(stream):
+    # werkzeug before 0.15 doesn't decode the request body with chunked transfer encoding
+    rest = ''
+    while True:
+        size = int(stream.readline().split(';')[0], 16)
+        if size == 0:
+            break
+        lines = (rest + stream.read(size)).split('\\n')
+        stream.readline()
+        rest = lines.pop()
+        for line in lines:
+            yield line
+    if rest:
+        yield rest
+
+# Bulk announce/withdraw: the body is read as a stream of line-delimited commands,
+# which are written to exabgp in batches at most 'rate' commands per second (0 - no limit).
+# Every batch is acknowledged by a json line in the streamed response.
+@app.route('/bulk', methods=['POST'])
+def run_bulk_commands():
+    batch_size = max(1, int(request.args.get('batch', 1000)))
+    rate = float(request.args.get('rate', 0))
+    if request.headers.get('Transfer-Encoding', '').lower() == 'chunked' and \\
+            not request.environ.get('wsgi.input_terminated'):
+        stream = chunked_lines(request.environ['wsgi.input'])
+    else:
+        stream = request.stream
+
+    def generate():
+        state = {'batches': 0, 'commands': 0}
+        start = time.time()
+
+        def flush(batch):
+            write_commands(batch)
+            state['batches'] += 1
+            state['commands'] += len(batch)
+            del batch[:]
+            if rate > 0:
+                delay = state['commands'] / rate - (time.time() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            return json.dumps({'batch': state['batches'], 'commands': state['commands'], 'routes': len(routes)}) + "\\n"
+
+        batch = []
+        for line in stream:
+            cmd = line.strip()
+            if not cmd:
+                continue
+            batch.append(cmd)
+            if len(batch) >= batch_size:
+                yield flush(batch)
+        if batch:
+            yield flush(batch)
+        yield json.dumps({'done': True, 'batches': state['batches'], 'commands': state['commands'], 'routes': len(routes)}) + "\\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/plain')
+
+@app.route('/routes', methods=['GET'])
+def get_routes():
+    return json.dumps({'routes': len(routes)}) + "\\n"
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=sys.argv[1])
 '''
@@ -77,27 +77,11 @@ import os
 import gzip
 import re
 import sys
-from datetime import datetime
 from ansible.module_utils.basic import *
 
 
-def extract_lines(directory, filename, target_string):
-    path = os.path.join(directory, filename)
-    file = None
-    if 'gz' in path:
-        file = gzip.GzipFile(path)
-    else:
-        file = open(path)
-    result = None
-    with file:
-        # This might be a gunzip file or logrotate issue, there has
-        # been '\x00's in front of the log entry timestamp which
-        # messes up with the comparator.
-        # Prehandle lines to remove these sub-strings
-        dt = datetime.datetime.fromtimestamp(os.path.getctime(path))
-        result = [(filename, dt, line.replace('\x00', '')) for line in file if target_string in line and 'nsible' not in line]
-
-    return result
+# Size of the chunk read from the log files at once
+READ_BLOCK_SIZE = 1024 * 1024
 
 
 def extract_number(s):
@@ -109,130 +93,132 @@ def extract_number(s):
         return int(ns[0])
 
 
-def convert_date(fct, s):
-    dt = None
-    re_result = re.findall(r'^\S{3}\s{1,2}\d{1,2} \d{2}:\d{2}:\d{2}\.?\d*', s)
-    # Workaround for pytest-ansible
-    loc = locale.getlocale()
-    locale.setlocale(locale.LC_ALL, (None, None))
-
-    if len(re_result) > 0:
-        str_date = '{:04d} '.format(fct.year) + re_result[0]
-        try:
-            dt = datetime.datetime.strptime(str_date, '%Y %b %d %X.%f')
-        except ValueError:
-            dt = datetime.datetime.strptime(str_date, '%Y %b %d %X')
-        # Handle the wrap around of year (Dec 31 to Jan 1)
-        # Generally, last metadata change time should be larger than generated log message timestamp
-        # but we still perform some wrap around test to avoid the race condition
-        # 183 is the number of days in half year, just a reasonable choice
-        if (dt - fct).days > 183:
-            dt.replace(year = dt.year - 1)
-    else:
-        re_result = re.findall(r'^\d{4}-\d{2}-\d{2}\.\d{2}:\d{2}:\d{2}\.\d{6}', s)
-        str_date = re_result[0]
-        dt = datetime.datetime.strptime(str_date, '%Y-%m-%d.%X.%f')
-    locale.setlocale(locale.LC_ALL, loc)
-
-    return dt
-
-
-def comparator(l, r):
-    nl = extract_number(l[0])
-    nr = extract_number(r[0])
-    if nl == nr:
-        dl = convert_date(l[1], l[2])
-        dr = convert_date(r[1], r[2])
-        if dl == dr:
-            return 0
-        elif dl < dr:
-            return -1
-        else:
-            return 1
-    elif nl > nr:
-        return -1
-    else:
-        return 1
-
-
-def filename_comparator(l, r):
-    """Compares log filenames, assumes file with greater number is
-    older, e.g syslog.2 is older than syslog.1. This is how logrotate is currently configured.
-    Returns 0 if log files l and r are the same,
-    1 if log file l is older then r and -1 if l is newer then r"""
-
-    nl = extract_number(l)
-    nr = extract_number(r)
-    if nl == nr:
-        return 0
-    elif nl > nr:
-        return 1
-    else:
-        return -1
-
-
 def list_files(directory, prefixname):
     """Returns a sorted list(sort order is from newer to older)
-    of files in @directory starting with @prefixname
-    (Comparator used is @filename_comparator)"""
+    of files in @directory starting with @prefixname.
+    Assumes file with greater number is older, e.g syslog.2 is older than syslog.1.
+    This is how logrotate is currently configured."""
 
     return sorted([filename for filename in os.listdir(directory)
-        if filename.startswith(prefixname)], cmp=filename_comparator)
+        if filename.startswith(prefixname)], key=extract_number)
 
 
-def extract_latest_line_with_string(directory, filenames, start_string):
-    """Extracts latest line with string @start_string. Assumes @filenames are sorted
-    and first file in @filenames is the newest log file"""
+def open_log(path):
+    if 'gz' in os.path.basename(path):
+        return gzip.GzipFile(path)
+    return open(path)
 
-    target_lines = []
-    for filename in filenames:
-        extracted_lines = extract_lines(directory, filename, start_string)
-        if extracted_lines:
-            # found lines are the lates since we start from the newest file
-            # assignt to target_lines and break the loop
-            target_lines = extracted_lines
-            break
-
-    # find the latest line from traget_lines comparing by date in line
-    target = target_lines[0] if len(target_lines) > 0 else None
-    for line in target_lines:
-        if comparator(line, target) > 0:
-            target = line
-
-    if target is None:
-        raise Exception("{} was not found in {}".format(start_string, directory))
 
-    return target
+def read_lines_blocks(file):
+    """Reads @file by big blocks and yields chunks which consist of complete lines only"""
 
+    rest = ''
+    while True:
+        block = file.read(READ_BLOCK_SIZE)
+        if not block:
+            break
+        block = rest + block
+        end = block.rfind('\n') + 1
+        if end == 0:
+            rest = block
+            continue
+        rest = block[end:]
+        yield block[:end]
+
+    if rest:
+        yield rest
+
+
+def find_last_start_line(chunk, start_string):
+    """Returns offset of the last line in @chunk which contains @start_string
+    or -1 if there is no such line. Lines with 'nsible' in it aren't considered
+    to avoid clashing with ansible output."""
+
+    end = len(chunk)
+    while True:
+        pos = chunk.rfind(start_string, 0, end)
+        if pos == -1:
+            return -1
+        line_start = chunk.rfind('\n', 0, pos) + 1
+        line_end = chunk.find('\n', pos)
+        if line_end == -1:
+            line_end = len(chunk)
+        if 'nsible' not in chunk[line_start:line_end]:
+            return line_start
+        end = line_start
+
+
+def copy_log(path, out):
+    """Copies the whole (ungzipped) content of the log file @path into @out"""
+
+    with open_log(path) as file:
+        for chunk in read_lines_blocks(file):
+            # This might be a gunzip file or logrotate issue, there has
+            # been '\x00's in front of the log entry timestamp.
+            # Remove these sub-strings
+            out.write(chunk.replace('\x00', ''))
+
+
+def extract_tail(path, start_string, out, spool=None):
+    """Scans the log file @path once. Writes all lines starting from the last line
+    with @start_string into @out. If @spool is given the whole content of the file
+    is written into it too, so the file needn't be read again when it turns out
+    to be newer than the file with @start_string.
+    Returns True if @start_string was found"""
+
+    found = False
+    with open_log(path) as file:
+        for chunk in read_lines_blocks(file):
+            chunk = chunk.replace('\x00', '')
+            if spool is not None:
+                spool.write(chunk)
+            pos = find_last_start_line(chunk, start_string) if start_string in chunk else -1
+            if pos != -1:
+                # Newer start line overrides everything collected before
+                out.seek(0)
+                out.truncate()
+                found = True
+                out.write(chunk[pos:])
+            elif found:
+                out.write(chunk)
+
+    return found
 
-def calculate_files_to_copy(filenames, file_with_latest_line):
-    files_to_copy = filenames[:filenames.index(file_with_latest_line) + 1]
-    return files_to_copy
 
+def extract_log(directory, prefixname, target_string, target_filename):
+    """Extracts lines starting from the latest line with @target_string from the
+    log files in @directory. Files are scanned once from the newest to the older ones,
+    the scan stops on the first (newest) file which contains @target_string,
+    so older files are never opened"""
 
-def combine_logs_and_save(directory, filenames, start_string, target_filename):
-    do_copy = False
-    with open(target_filename, 'w') as fp:
-        for filename in reversed(filenames):
-            path = os.path.join(directory, filename)
-            file = None
-            if 'gz' in path:
-                file = gzip.GzipFile(path)
+    filenames = list_files(directory, prefixname)
+    # Files newer than the file with target_string. Content of gzipped files
+    # is saved into spool files during the scan to not ungzip them twice
+    newer_files = []
+    spool_files = []
+    try:
+        with open(target_filename, 'w') as fp:
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                if 'gz' in path:
+                    spool_filename = '{}.spool{}'.format(target_filename, len(spool_files))
+                    spool_files.append(spool_filename)
+                    with open(spool_filename, 'w') as spool:
+                        found = extract_tail(path, target_string, fp, spool)
+                    path = spool_filename
+                else:
+                    found = extract_tail(path, target_string, fp)
+                if found:
+                    break
+                newer_files.append(path)
             else:
-                file = open(path)
-            with file:
-                for line in file:
-                    if line == start_string:
-                        do_copy = True
-                    if do_copy:
-                        fp.write(line)
-
+                raise Exception("{} was not found in {}".format(target_string, directory))
 
-def extract_log(directory, prefixname, target_string, target_filename):
-    filenames = list_files(directory, prefixname)
-    file_with_latest_line, file_create_time, latest_line = extract_latest_line_with_string(directory, filenames, target_string)
-    files_to_copy = calculate_files_to_copy(filenames, file_with_latest_line)
-    combine_logs_and_save(directory, files_to_copy, latest_line, target_filename)
+            for path in reversed(newer_files):
+                copy_log(path, fp)
+    finally:
+        for spool_filename in spool_files:
+            os.remove(spool_filename)
 
 
 def main():
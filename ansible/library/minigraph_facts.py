@@ -6,6 +6,8 @@ import socket
 import struct
 import json
 import copy
+import hashlib
+import tempfile
 import ipaddr as ipaddress
 from collections import defaultdict
 from natsort import natsorted
@@ -23,11 +25,22 @@ short_description: Retrive minigraph facts for a device.
 description:
     - Retrieve minigraph facts for a device, the facts will be
       inserted to the ansible_facts key.
+    - The parsed facts are cached in ~/.ansible/minigraph keyed by the minigraph file path, mtime and content hash,
+      so gathering the facts of the same minigraph again costs a file stat instead of a full XML parse.
 options:
     host:
         description:
             - Set to target snmp server (normally {{inventory_hostname}})
         required: true
+    filename:
+        description:
+            - Minigraph file to parse
+        required: false
+    cache:
+        description:
+            - Use the cache of the parsed facts
+        required: false
+        default: true
 '''
 
 EXAMPLES = '''
@@ -44,6 +57,12 @@ ns3 = "http://www.w3.org/2001/XMLSchema-instance"
 ANSIBLE_USER_MINIGRAPH_PATH = os.path.expanduser('~/.ansible/minigraph')
 ANSIBLE_LOCAL_MINIGRAPH_PATH = '{}.xml'
 ANSIBLE_USER_MINIGRAPH_MAX_AGE = 86400  # 24-hours (in seconds)
+ANSIBLE_USER_MINIGRAPH_FACTS_CACHE = 'minigraph_facts_{}.json'
+# Bump the version when the parsing changes the facts, so the facts cached by the old version are not used
+MINIGRAPH_FACTS_CACHE_VERSION = 1
+
+# Top level minigraph sections used by parse_xml, the others are dropped while parsing
+MINIGRAPH_SECTIONS = ["DpgDec", "CpgDec", "PngDec", "UngDec", "MetadataDeclaration", "Hostname", "HwSku"]
 
 class minigraph_encoder(json.JSONEncoder):
     def default(self, obj):
@@ -389,15 +408,122 @@ def reconcile_mini_graph_locations(filename, hostname):
     :param hostname: the hostname to load (required)
     :return: tuple(the absolute filepath of the {cached,loaded} mini-graph, the root node of the loaded graph)
     """
+    mini_graph_path = get_mini_graph_path(filename)
+    root = iterparse_mini_graph(mini_graph_path)
+    return mini_graph_path, root
+
+
+def get_mini_graph_path(filename):
+    """
+    :param filename: the filename to load (may be None)
+    :return: the path of the mini-graph to load
+    """
     if filename is not None:
         # literal filename specified. read directly from the file.
-        mini_graph_path = filename
-    else:
-        # only the hostname was specified, determine the output path
-        mini_graph_path = '/etc/sonic/minigraph.xml'
+        return filename
+    # only the hostname was specified, determine the output path
+    return '/etc/sonic/minigraph.xml'
 
-    root = ET.parse(mini_graph_path).getroot()
-    return mini_graph_path, root
+
+def iterparse_mini_graph(mini_graph_path):
+    """
+    Parse the mini-graph incrementally. Top level sections which are not used by the facts
+    (DeviceInfos, LinkMetadataDeclaration, etc.) are dropped as soon as they are parsed,
+    so only the used sections of a large mini-graph are kept in memory.
+
+    :param mini_graph_path: the mini-graph file
+    :return: the root node of the mini-graph with the used sections only
+    """
+    sections = set(str(QName(ns, section)) for section in MINIGRAPH_SECTIONS)
+    root = None
+    depth = 0
+    for event, elem in ET.iterparse(mini_graph_path, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1 and elem.tag not in sections:
+            elem.clear()
+            root.remove(elem)
+    return root
+
+
+def file_sha1(filename):
+    """
+    :param filename: the file to hash
+    :return: SHA1 hex digest of the file content
+    """
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def get_facts_cache_path(mini_graph_path, hostname):
+    """
+    :return: the path of the facts cache of the mini-graph in the user folder
+    """
+    key = hashlib.md5("{}:{}".format(os.path.abspath(mini_graph_path), hostname)).hexdigest()
+    return os.path.join(ANSIBLE_USER_MINIGRAPH_PATH, ANSIBLE_USER_MINIGRAPH_FACTS_CACHE.format(key))
+
+
+def load_cached_facts(mini_graph_path, hostname):
+    """
+    Load the facts cached for the mini-graph. The cache is valid if the mtime and the size of the mini-graph
+    are the same as when the facts were cached. If only the mtime was changed (file copied again, etc.)
+    the cache is still valid if the content hash is the same.
+
+    :param mini_graph_path: the mini-graph file
+    :param hostname: the hostname the facts were gathered for
+    :return: the cached facts, None if there are no valid cached facts
+    """
+    try:
+        with open(get_facts_cache_path(mini_graph_path, hostname)) as f:
+            cache = json.load(f)
+        stat = os.stat(mini_graph_path)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if cache.get('version') != MINIGRAPH_FACTS_CACHE_VERSION or cache.get('path') != os.path.abspath(mini_graph_path):
+        return None
+    if cache.get('size') != stat.st_size:
+        return None
+    if cache.get('mtime') != stat.st_mtime:
+        if cache.get('sha1') != file_sha1(mini_graph_path):
+            return None
+        store_cached_facts(mini_graph_path, hostname, json.dumps(cache['facts']), cache['sha1'])
+    return cache['facts']
+
+
+def store_cached_facts(mini_graph_path, hostname, facts_json, sha1=None):
+    """
+    Cache the facts of the mini-graph in the user folder. Failure to cache the facts is ignored.
+
+    :param mini_graph_path: the mini-graph file
+    :param hostname: the hostname the facts were gathered for
+    :param facts_json: the facts encoded to json
+    :param sha1: SHA1 of the mini-graph content, calculated if not specified
+    """
+    cache_path = get_facts_cache_path(mini_graph_path, hostname)
+    try:
+        stat = os.stat(mini_graph_path)
+        header = json.dumps({
+            'version': MINIGRAPH_FACTS_CACHE_VERSION,
+            'path': os.path.abspath(mini_graph_path),
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'sha1': sha1 or file_sha1(mini_graph_path),
+        })
+        # write to a temporary file and rename it, so concurrent readers never see a partially written cache
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path))
+        with os.fdopen(fd, 'w') as f:
+            f.write(header[:-1] + ', "facts": ' + facts_json + '}')
+        os.rename(tmp_path, cache_path)
+    except (IOError, OSError):
+        pass
 
 def port_alias_to_name_map_50G(all_ports, s100G_ports):
     # 50G ports
@@ -634,6 +760,7 @@ def main():
         argument_spec=dict(
             host=dict(required=True),
             filename=dict(),
+            cache=dict(required=False, type='bool', default=True),
         ),
         supports_check_mode=True
     )
@@ -659,8 +786,16 @@ def main():
         filename = None
 
     try:
-        results = parse_xml(filename, m_args['host'])
-        results_clean = json.loads(json.dumps(results, cls=minigraph_encoder))
+        mini_graph_path = get_mini_graph_path(filename)
+        results_clean = None
+        if m_args['cache']:
+            results_clean = load_cached_facts(mini_graph_path, m_args['host'])
+        if results_clean is None:
+            results = parse_xml(filename, m_args['host'])
+            results_json = json.dumps(results, cls=minigraph_encoder)
+            if m_args['cache']:
+                store_cached_facts(mini_graph_path, m_args['host'], results_json)
+            results_clean = json.loads(results_json)
         module.exit_json(ansible_facts=results_clean)
     except Exception as e:
         # all attempts to find a minigraph failed.
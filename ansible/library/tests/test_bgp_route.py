@@ -0,0 +1,62 @@
+'''
+Unit checks of the bgp_route module which don't need a DUT.
+Run with "pytest ansible/library/tests" from the repository root.
+'''
+import imp
+import json
+import os
+
+import pytest
+
+bgp_route = imp.load_source('bgp_route', os.path.join(os.path.dirname(__file__), '..', 'bgp_route.py'))
+
+NEIGHBOR = '10.0.0.57'
+
+ADV_JSON = json.dumps({'advertisedRoutes': {
+    '192.168.0.0/25': {'nextHop': '10.0.0.56', 'weight': 0, 'path': '65100 64600', 'origin': 'IGP'}}})
+
+TEXT = '''BGP table version is 0, local router ID is 10.1.0.32
+   Network          Next Hop            Metric LocPrf Weight Path
+*> 192.168.1.0/25   10.0.0.56                0             0 65100 64601 i
+'''
+
+
+class FakeModule(object):
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.commands = []
+
+    def run_command(self, command):
+        self.commands.append(command)
+        for key, out in self.outputs.items():
+            if command.endswith(key):
+                return 0, out, ''
+        return 1, '', '% Unknown command'
+
+    def fail_json(self, msg):
+        raise AssertionError(msg)
+
+
+@pytest.mark.parametrize('direction, expected_command, expected_prefix', [
+    ('adv', "show ip bgp neighbor %s advertised-routes json'" % NEIGHBOR, '192.168.0.0/25'),
+    ('rec', "show ip bgp neighbor %s rec'" % NEIGHBOR, '192.168.1.0/25'),
+])
+def test_neighbor_routes_direction(direction, expected_command, expected_prefix):
+    module = FakeModule({"advertised-routes json'": ADV_JSON, " rec'": TEXT})
+    bgproute = bgp_route.BgpRoutes(NEIGHBOR, direction)
+    bgp_route.get_neighbor_routes(module, bgproute, NEIGHBOR, direction)
+
+    assert module.commands[-1].endswith(expected_command)
+    assert [prefix for prefix in bgproute.get_facts()['bgp_route_neiadv'] if prefix != 'neighbor'] == [expected_prefix]
+    if direction != 'adv':
+        assert not any('json' in command for command in module.commands)
+
+
+def test_neighbor_adv_routes_text_fallback():
+    module = FakeModule({" adv'": TEXT})
+    bgproute = bgp_route.BgpRoutes(NEIGHBOR, 'adv')
+    bgp_route.get_neighbor_routes(module, bgproute, NEIGHBOR, 'adv')
+
+    assert len(module.commands) == 2
+    assert module.commands[-1].endswith("show ip bgp neighbor %s adv'" % NEIGHBOR)
+    assert bgproute.get_facts()['bgp_route_neiadv']['192.168.1.0/25']['aspath'] == ['65100', '64601']
@@ -1,18 +1,80 @@
+"""
+ARP and IPv6 NDP responder.
+
+Every interface has one raw packet socket with BPF filter passing ARP and, if IPv6 addresses are configured,
+ICMPv6 Neighbor Solicitation frames. All sockets are polled by one epoll and drained in batches.
+Replies are built from templates precomputed per (interface, IP) and looked up by the packed target address.
+
+The kernel strips VLAN tags from the received frames, the tag is read from PACKET_AUXDATA of recvmsg().
+recvmsg() is called through ctypes, as python 2 socket has no recvmsg().
+
+Counters of requests seen and replied are printed on SIGUSR1 and on exit.
+"""
 import binascii
 import socket
 import struct
 import select
 import json
 import argparse
+import errno
 import os.path
+import signal
+import sys
+import ctypes
+import ctypes.util
+from collections import defaultdict
 from fcntl import ioctl
-from pprint import pprint
-import logging
-logging.getLogger("scapy.runtime").setLevel(logging.ERROR)
-import ptf.packet as scapy
-import scapy.all as scapy2
-scapy2.conf.use_pcap=True
-import scapy.arch.pcapdnet
+
+ETH_P_ALL = 0x0003
+ETH_TYPE_VLAN = '\x81\x00'
+ETH_TYPE_ARP = '\x08\x06'
+ETH_TYPE_IPV6 = '\x86\xdd'
+ETH_HDR_LEN = 14
+VLAN_HDR_LEN = 4
+IPV6_HDR_LEN = 40
+IPPROTO_ICMPV6 = 58
+ICMPV6_NS = 135
+ICMPV6_NA = 136
+NA_FLAG_SOLICITED = 0x40000000
+NA_FLAG_OVERRIDE = 0x20000000
+NDP_OPT_TARGET_LL_ADDR = 2
+IPV6_ALL_NODES = socket.inet_pton(socket.AF_INET6, 'ff02::1')
+IPV6_UNSPECIFIED = '\x00' * 16
+
+SO_ATTACH_FILTER = 26
+SOL_PACKET = 263
+PACKET_AUXDATA = 8
+PACKET_OUTGOING = 4
+TP_STATUS_VLAN_VALID = 0x10
+MSG_DONTWAIT = 0x40
+
+# tcpdump -dd "arp or vlan"
+BPF_ARP = [
+    (0x28, 0, 0, 0x0000000c),
+    (0x15, 1, 0, 0x00000806),
+    (0x15, 0, 1, 0x00008100),
+    (0x06, 0, 0, 0x0000ffff),
+    (0x06, 0, 0, 0x00000000),
+]
+# tcpdump -dd "arp or vlan or (icmp6 and ip6[40] == 135)", IPv6 extension headers are not expected
+BPF_ARP_NDP = [
+    (0x28, 0, 0, 0x0000000c),
+    (0x15, 6, 0, 0x00000806),
+    (0x15, 5, 0, 0x00008100),
+    (0x15, 0, 5, 0x000086dd),
+    (0x30, 0, 0, 0x00000014),
+    (0x15, 0, 3, 0x0000003a),
+    (0x30, 0, 0, 0x00000036),
+    (0x15, 0, 1, 0x00000087),
+    (0x06, 0, 0, 0x0000ffff),
+    (0x06, 0, 0, 0x00000000),
+]
+
+# Only the headers are parsed, longer frames are truncated
+RCV_SIZE = 256
+# Max frames received from one socket in a row, so a busy interface doesn't starve the others
+RCV_BATCH = 64
+
 
 def hexdump(data):
     print " ".join("%02x" % ord(d) for d in data)
@@ -28,118 +90,295 @@ def get_mac(iff):
     SIOCGIFHWADDR = 0x8927          # Get hardware address
     return get_if(iff, SIOCGIFHWADDR)[18:24]
 
+def checksum_add(data, s=0):
+    """
+    Add 16-bit words of the data to the one's complement sum
+    """
+    return s + sum(struct.unpack('!%dH' % (len(data) / 2), data))
+
+def checksum_fold(s):
+    while s >> 16:
+        s = (s & 0xffff) + (s >> 16)
+    return ~s & 0xffff
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t)]
+
+class msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(iovec)),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+class cmsghdr(ctypes.Structure):
+    _fields_ = [("cmsg_len", ctypes.c_size_t),
+                ("cmsg_level", ctypes.c_int),
+                ("cmsg_type", ctypes.c_int)]
+
+class sockaddr_ll(ctypes.Structure):
+    _fields_ = [("sll_family", ctypes.c_ushort),
+                ("sll_protocol", ctypes.c_ushort),
+                ("sll_ifindex", ctypes.c_int),
+                ("sll_hatype", ctypes.c_ushort),
+                ("sll_pkttype", ctypes.c_ubyte),
+                ("sll_halen", ctypes.c_ubyte),
+                ("sll_addr", ctypes.c_ubyte * 8)]
+
+class tpacket_auxdata(ctypes.Structure):
+    _fields_ = [("tp_status", ctypes.c_uint32),
+                ("tp_len", ctypes.c_uint32),
+                ("tp_snaplen", ctypes.c_uint32),
+                ("tp_mac", ctypes.c_uint16),
+                ("tp_net", ctypes.c_uint16),
+                ("tp_vlan_tci", ctypes.c_uint16),
+                ("tp_vlan_tpid", ctypes.c_uint16)]
+
+libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+libc.recvmsg.argtypes = [ctypes.c_int, ctypes.POINTER(msghdr), ctypes.c_int]
+libc.recvmsg.restype = ctypes.c_ssize_t
+
+# CMSG_ALIGN(sizeof(struct cmsghdr)), the data of the control message follows the aligned header
+CMSG_DATA_OFFSET = (ctypes.sizeof(cmsghdr) + ctypes.sizeof(ctypes.c_size_t) - 1) & ~(ctypes.sizeof(ctypes.c_size_t) - 1)
+CONTROL_SIZE = CMSG_DATA_OFFSET + ctypes.sizeof(tpacket_auxdata) + ctypes.sizeof(ctypes.c_size_t)
 
-class Interface(object):
-    ETH_P_ALL = 0x03
-    RCV_TIMEOUT = 1000
-    RCV_SIZE = 4096
 
-    def __init__(self, iface):
+class Interface(object):
+    """
+    Raw socket of the interface.
+    Frames are received by recvmsg() into a preallocated buffer together with the VLAN tag stripped by the kernel.
+    The socket is bound to all protocols, the sockets bound to ARP or IPv6 get the frames after the kernel
+    has dropped the VLAN tag of the interfaces without VLAN devices.
+    """
+    def __init__(self, iface, ndp=False):
         self.iface = iface
-        self.socket = None
         self.mac_address = get_mac(iface)
+        self.socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        bpf_src = BPF_ARP_NDP if ndp else BPF_ARP
+        self.bpf = ctypes.create_string_buffer(''.join(struct.pack("HBBI", *e) for e in bpf_src))
+        bpf = struct.pack('HL', len(bpf_src), ctypes.addressof(self.bpf))
+        self.socket.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, bpf)
+        self.socket.setsockopt(SOL_PACKET, PACKET_AUXDATA, 1)
+        self.socket.bind((iface, 0))
+        self.fd = self.socket.fileno()
+
+        self.buf = ctypes.create_string_buffer(RCV_SIZE)
+        self.control = ctypes.create_string_buffer(CONTROL_SIZE)
+        self.addr = sockaddr_ll()
+        self.iov = iovec(ctypes.cast(self.buf, ctypes.c_void_p), RCV_SIZE)
+        self.msg = msghdr()
+        self.msg.msg_name = ctypes.cast(ctypes.pointer(self.addr), ctypes.c_void_p)
+        self.msg.msg_iov = ctypes.pointer(self.iov)
+        self.msg.msg_iovlen = 1
+        self.msg.msg_control = ctypes.cast(self.control, ctypes.c_void_p)
+        self.cmsg = cmsghdr.from_buffer(self.control)
+        self.auxdata = tpacket_auxdata.from_buffer(self.control, CMSG_DATA_OFFSET)
 
     def __del__(self):
-        if self.socket:
-            self.socket.close()
+        self.socket.close()
+
+    def mac(self):
+        return self.mac_address
 
-    def bind(self):
-        self.socket = scapy2.conf.L2listen(iface=self.iface)
+    def name(self):
+        return self.iface
 
     def handler(self):
-        return self.socket
+        return self.fd
 
     def recv(self):
-        sniffed = self.socket.recv()
-        pkt = sniffed[0]
-        str_pkt = str(pkt).encode("HEX")
-        binpkt = binascii.unhexlify(str_pkt)
-        return binpkt
+        """
+        Receive one frame without blocking.
+        Returns (frame, vlan_tci), vlan_tci is None for untagged frames,
+        ('', None) for the frames sent by this host, (None, None) if no frame is queued.
+        """
+        self.msg.msg_namelen = ctypes.sizeof(sockaddr_ll)
+        self.msg.msg_controllen = CONTROL_SIZE
+        size = libc.recvmsg(self.fd, ctypes.byref(self.msg), MSG_DONTWAIT)
+        if size < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return None, None
+            raise OSError(err, os.strerror(err))
+        if self.addr.sll_pkttype == PACKET_OUTGOING:
+            return '', None
+
+        vlan_tci = None
+        if self.msg.msg_controllen >= CMSG_DATA_OFFSET + ctypes.sizeof(tpacket_auxdata) \
+                and self.cmsg.cmsg_level == SOL_PACKET and self.cmsg.cmsg_type == PACKET_AUXDATA:
+            if self.auxdata.tp_vlan_tci or self.auxdata.tp_status & TP_STATUS_VLAN_VALID:
+                vlan_tci = self.auxdata.tp_vlan_tci
+
+        return ctypes.string_at(self.buf, min(size, RCV_SIZE)), vlan_tci
 
     def send(self, data):
-        scapy2.sendp(data, iface=self.iface)
-
-    def mac(self):
-        return self.mac_address
-
-    def name(self):
-        return self.iface
+        self.socket.send(data)
 
 
 class Poller(object):
     def __init__(self, interfaces, responder):
         self.responder = responder
-        self.mapping = {}
-        for interface in interfaces:
-            self.mapping[interface.handler()] = interface 
+        self.epoll = select.epoll()
+        self.mapping = {interface.handler(): interface for interface in interfaces}
+        for fd in self.mapping:
+            self.epoll.register(fd, select.EPOLLIN)
 
     def poll(self):
-        handlers = self.mapping.keys()
         while True:
-            (rdlist, _, _) = select.select(handlers, [], [])
-            for handler in rdlist:
-                self.responder.action(self.mapping[handler])
+            try:
+                events = self.epoll.poll()
+            except IOError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            for fd, _ in events:
+                interface = self.mapping[fd]
+                for _ in xrange(RCV_BATCH):
+                    data, vlan_tci = interface.recv()
+                    if data is None:
+                        break
+                    if data:
+                        self.responder.action(interface, data, vlan_tci)
 
 
 class ARPResponder(object):
-    ARP_PKT_LEN = 64
     ARP_OP_REQUEST = 1
+
     def __init__(self, ip_sets):
         self.arp_chunk = binascii.unhexlify('08060001080006040002') # defines a part of the packet for ARP Reply
         self.arp_pad = binascii.unhexlify('00' * 18)
 
-        self.ip_sets = ip_sets
+        self.counters = defaultdict(int)
+        self.iface_counters = defaultdict(lambda: defaultdict(int))
+
+        # Reply templates by interface and packed IP address:
+        # ARP: (local_mac, arp reply part up to the remote addresses)
+        # NDP: (local_mac, local_ip, neighbor advertisement after the flags, checksum of the constant fields)
+        self.arp_templates = {}
+        self.ndp_templates = {}
+        for iface, ip_dict in ip_sets.items():
+            self.arp_templates[iface] = {}
+            self.ndp_templates[iface] = {}
+            for ip, local_mac in ip_dict.items():
+                if ip == 'vlan':
+                    # replies are tagged with the tag of the request, see action()
+                    continue
+                elif ':' in ip:
+                    local_ip = socket.inet_pton(socket.AF_INET6, ip)
+                    self.ndp_templates[iface][local_ip] = self.generate_ndp_template(local_mac, local_ip)
+                else:
+                    local_ip = socket.inet_aton(ip)
+                    self.arp_templates[iface][local_ip] = (local_mac, self.arp_chunk + local_mac + local_ip)
 
         return
 
-    def action(self, interface):
-        data = interface.recv()
-        if len(data) > self.ARP_PKT_LEN:
-            return
+    def count(self, interface, counter):
+        self.counters[counter] += 1
+        self.iface_counters[interface.name()][counter] += 1
+
+    def get_counters(self):
+        result = dict(self.counters)
+        result['interfaces'] = dict((iface, dict(c)) for iface, c in self.iface_counters.items())
+        return result
+
+    def action(self, interface, data, vlan_tci):
+        eth_offset = ETH_HDR_LEN
+        ether_type = data[12:14]
+        if ether_type == ETH_TYPE_VLAN:
+            frame_tci = data[14:16]
+            eth_offset += VLAN_HDR_LEN
+            ether_type = data[16:18]
+            if frame_tci != '\x00\x00':
+                vlan_tci = struct.unpack('!H', frame_tci)[0]
 
-        remote_mac, remote_ip, request_ip, op_type, vlan_id = self.extract_arp_info(data)
+        vlan_id = None
+        if vlan_tci is not None:
+            vlan_id = struct.pack('!H', vlan_tci)
+
+        if ether_type == ETH_TYPE_ARP:
+            self.arp_action(interface, data, eth_offset, vlan_id)
+        elif ether_type == ETH_TYPE_IPV6:
+            self.ndp_action(interface, data, eth_offset, vlan_id)
+
+    def arp_action(self, interface, data, eth_offset, vlan_id):
+        remote_mac, remote_ip, request_ip, op_type = self.extract_arp_info(data, eth_offset)
 
         # Don't send ARP response if the ARP op code is not request
         if op_type != self.ARP_OP_REQUEST:
             return
+        self.count(interface, 'arp_requests')
 
-        request_ip_str = socket.inet_ntoa(request_ip)
-        if request_ip_str not in self.ip_sets[interface.name()]:
+        template = self.arp_templates[interface.name()].get(request_ip)
+        if template is None:
             return
-        arp_reply = self.generate_arp_reply(self.ip_sets[interface.name()][request_ip_str], remote_mac, request_ip, remote_ip, vlan_id)
-        interface.send(arp_reply)
+        local_mac, arp_reply_chunk = template
+        interface.send(self.generate_arp_reply(local_mac, arp_reply_chunk, remote_mac, remote_ip, vlan_id))
+        self.count(interface, 'arp_replies')
 
         return
-        
-    def extract_arp_info(self, data):
+
+    def extract_arp_info(self, data, eth_offset):
         # remote_mac, remote_ip, request_ip, op_type
-        rem_ip_start = 28
-        req_ip_start = 38
-        op_type_start = 20
-        eth_offset = 0
-        vlan_id = None
-        ether_type = str(data[12:14]).encode("HEX")
-        if (ether_type == '8100'):
-            vlan = str(data[14:16]).encode("HEX")
-            if (vlan != '0000'):
-                eth_offset = 4
-                vlan_id = data[14:16]
-        rem_ip_start = rem_ip_start + eth_offset
-        req_ip_start = req_ip_start + eth_offset
-        op_type_start = op_type_start + eth_offset
-        rem_ip_end = rem_ip_start + 4
-        req_ip_end = req_ip_start + 4
-        op_type_end = op_type_start + 1
-
-        return data[6:12], data[rem_ip_start:rem_ip_end], data[req_ip_start:req_ip_end], (ord(data[op_type_start]) * 256 + ord(data[op_type_end])), vlan_id
-
-    def generate_arp_reply(self, local_mac, remote_mac, local_ip, remote_ip, vlan_id):
+        op_type_start = eth_offset + 6
+        rem_ip_start = eth_offset + 14
+        req_ip_start = eth_offset + 24
+
+        return data[6:12], data[rem_ip_start:rem_ip_start + 4], data[req_ip_start:req_ip_start + 4], \
+            (ord(data[op_type_start]) * 256 + ord(data[op_type_start + 1])) if len(data) > op_type_start + 1 else None
+
+    def generate_arp_reply(self, local_mac, arp_reply_chunk, remote_mac, remote_ip, vlan_id):
         eth_hdr = remote_mac + local_mac
         if vlan_id is not None:
-            eth_type = binascii.unhexlify('8100')
-            eth_hdr += eth_type + vlan_id
+            eth_hdr += ETH_TYPE_VLAN + vlan_id
 
-        return eth_hdr + self.arp_chunk + local_mac + local_ip + remote_mac + remote_ip + self.arp_pad
+        return eth_hdr + arp_reply_chunk + remote_mac + remote_ip + self.arp_pad
+
+    def ndp_action(self, interface, data, eth_offset, vlan_id):
+        icmp_start = eth_offset + IPV6_HDR_LEN
+        if len(data) < icmp_start + 24 or ord(data[eth_offset + 6]) != IPPROTO_ICMPV6 or ord(data[icmp_start]) != ICMPV6_NS:
+            return
+        self.count(interface, 'ndp_requests')
+
+        target_ip = data[icmp_start + 8:icmp_start + 24]
+        template = self.ndp_templates[interface.name()].get(target_ip)
+        if template is None:
+            return
+        remote_ip = data[eth_offset + 8:eth_offset + 24]
+        interface.send(self.generate_ndp_reply(template, data[6:12], remote_ip, vlan_id))
+        self.count(interface, 'ndp_replies')
+
+    def generate_ndp_template(self, local_mac, local_ip):
+        # neighbor advertisement after the flags: target address and target link-layer address option
+        na_tail = local_ip + struct.pack('!BB', NDP_OPT_TARGET_LL_ADDR, 1) + local_mac
+        # checksum of the pseudo header without the destination and of the advertisement without the flags
+        s = checksum_add(local_ip)
+        s = checksum_add(struct.pack('!IxxxB', 8 + len(na_tail), IPPROTO_ICMPV6), s)
+        s = checksum_add(struct.pack('!BB', ICMPV6_NA, 0), s)
+        s = checksum_add(na_tail, s)
+        return local_mac, local_ip, na_tail, s
+
+    def generate_ndp_reply(self, template, remote_mac, remote_ip, vlan_id):
+        local_mac, local_ip, na_tail, s = template
+        if remote_ip == IPV6_UNSPECIFIED:
+            # Duplicate address detection, advertise to all nodes
+            remote_ip = IPV6_ALL_NODES
+            flags = NA_FLAG_OVERRIDE
+        else:
+            flags = NA_FLAG_SOLICITED | NA_FLAG_OVERRIDE
+        s = checksum_add(remote_ip, s)
+        s = checksum_add(struct.pack('!I', flags), s)
+
+        eth_hdr = remote_mac + local_mac
+        if vlan_id is not None:
+            eth_hdr += ETH_TYPE_VLAN + vlan_id
+        ip_hdr = struct.pack('!IHBB', 0x60000000, 8 + len(na_tail), IPPROTO_ICMPV6, 255) + local_ip + remote_ip
+        icmp = struct.pack('!BBHI', ICMPV6_NA, 0, checksum_fold(s), flags) + na_tail
+
+        return eth_hdr + ETH_TYPE_IPV6 + ip_hdr + icmp
 
 def parse_args():
     parser = argparse.ArgumentParser(description='ARP autoresponder')
@@ -182,14 +421,28 @@ def main():
 
     ifaces = []
     for iface_name in ip_sets.keys():
-        iface = Interface(iface_name)
-        iface.bind()
+        ndp = any(':' in ip for ip in ip_sets[iface_name])
+        iface = Interface(iface_name, ndp)
         ifaces.append(iface)
 
     resp = ARPResponder(ip_sets)
 
+    def print_counters(*args):
+        print json.dumps(resp.get_counters())
+        sys.stdout.flush()
+
+    def stop(*args):
+        print_counters()
+        sys.exit(0)
+
+    signal.signal(signal.SIGUSR1, print_counters)
+    signal.signal(signal.SIGTERM, stop)
+
     p = Poller(ifaces, resp)
-    p.poll()
+    try:
+        p.poll()
+    except KeyboardInterrupt:
+        print_counters()
 
     return
 
@@ -3,16 +3,30 @@
 """
 Script to generate PFC packets.
 
+The frames are sent to all interfaces in batches, by sendmmsg() where it is available.
+The storm is either a number of frames or a duration, optionally at a target rate of frames
+per second per interface. The achieved rate is reported when the storm ends.
 """
 import binascii
 import sys
 import os
+import errno
 import optparse
 import logging
 import logging.handlers
+import select
+import signal
+import time
 from socket import socket, AF_PACKET, SOCK_RAW
+from socket import error as socket_error
 from struct import *
 
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
 my_logger = logging.getLogger('MyLogger')
 my_logger.setLevel(logging.DEBUG)
 
@@ -32,6 +46,138 @@ def checksum(msg):
 
     return s
 
+if ctypes is not None:
+    class iovec(ctypes.Structure):
+        _fields_ = [("iov_base", ctypes.c_void_p),
+                    ("iov_len", ctypes.c_size_t)]
+
+    class msghdr(ctypes.Structure):
+        _fields_ = [("msg_name", ctypes.c_void_p),
+                    ("msg_namelen", ctypes.c_uint32),
+                    ("msg_iov", ctypes.POINTER(iovec)),
+                    ("msg_iovlen", ctypes.c_size_t),
+                    ("msg_control", ctypes.c_void_p),
+                    ("msg_controllen", ctypes.c_size_t),
+                    ("msg_flags", ctypes.c_int)]
+
+    class mmsghdr(ctypes.Structure):
+        _fields_ = [("msg_hdr", msghdr),
+                    ("msg_len", ctypes.c_uint)]
+
+def get_sendmmsg():
+    """
+    Return libc sendmmsg() function, None if it is not available
+    """
+    if ctypes is None:
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+class BatchSender(object):
+    """
+    Send copies of one frame to a bound packet socket, up to 'batch' frames per system call
+    """
+    def __init__(self, sock, packet, batch):
+        self.sock = sock
+        self.packet = packet
+        self.batch = batch
+        self.sendmmsg = get_sendmmsg()
+        if self.sendmmsg is not None:
+            # All messages of the batch point to the same frame buffer
+            self.buf = ctypes.create_string_buffer(packet, len(packet))
+            self.iov = iovec(ctypes.cast(self.buf, ctypes.c_void_p), len(packet))
+            self.msgs = (mmsghdr * batch)()
+            for msg in self.msgs:
+                msg.msg_hdr.msg_iov = ctypes.pointer(self.iov)
+                msg.msg_hdr.msg_iovlen = 1
+
+    def send(self, count):
+        """
+        Send up to count frames, return number of frames sent
+        """
+        count = min(count, self.batch)
+        if self.sendmmsg is None:
+            sent = 0
+            try:
+                while sent < count:
+                    self.sock.send(self.packet)
+                    sent += 1
+            except socket_error as e:
+                if e.errno not in (errno.ENOBUFS, errno.EAGAIN, errno.EINTR):
+                    raise
+            return sent
+
+        sent = self.sendmmsg(self.sock.fileno(), ctypes.addressof(self.msgs), count, 0)
+        if sent < 0:
+            err = ctypes.get_errno()
+            if err not in (errno.ENOBUFS, errno.EAGAIN, errno.EINTR):
+                raise OSError(err, os.strerror(err))
+            return 0
+        return sent
+
+class Storm(object):
+    """
+    Send frames to all interfaces until the number of frames per interface is sent or the duration expires.
+    Every interface has its own schedule: at a target rate the frames due since the start are sent
+    in batches, so a slow interface doesn't hold back the others.
+    """
+    def __init__(self, senders, num=None, duration=None, rate=0):
+        self.senders = senders
+        self.num = num
+        self.duration = duration
+        self.rate = rate
+        self.sent = [0] * len(senders)
+        self.elapsed = 0
+        self.stopped = False
+
+    def stop(self, *args):
+        self.stopped = True
+
+    def run(self):
+        start = time.time()
+        deadline = start + self.duration if self.duration else None
+        active = range(len(self.senders))
+        while active and not self.stopped:
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                break
+            due_min = None
+            for i in list(active):
+                due = self.num - self.sent[i] if self.num is not None else self.senders[i].batch
+                if self.rate:
+                    due = min(due, int((now - start) * self.rate) + 1 - self.sent[i])
+                if due > 0:
+                    self.sent[i] += self.senders[i].send(due)
+                if self.num is not None and self.sent[i] >= self.num:
+                    active.remove(i)
+                due_min = due if due_min is None else min(due_min, due)
+            if self.rate and due_min is not None and due_min <= 0:
+                # Every interface is ahead of the schedule, wait for the next frame
+                wait = float(min(self.sent[i] for i in active) if active else 0) / self.rate - (time.time() - start)
+                if deadline is not None:
+                    wait = min(wait, deadline - time.time())
+                if wait > 0:
+                    try:
+                        select.select([], [], [], wait)
+                    except select.error:
+                        pass
+        self.elapsed = time.time() - start
+
+    def report(self):
+        """
+        Return the achieved rate report
+        """
+        total = sum(self.sent)
+        rate = total / self.elapsed / len(self.senders) if self.elapsed > 0 else 0
+        return "Sent %d frames to %d interface(s) in %.3f sec, %.0f frames/sec per interface" % \
+               (total, len(self.senders), self.elapsed, rate)
+
 def main():
     usage = "usage: %prog [options] arg1 arg2"
     parser = optparse.OptionParser(usage=usage)
@@ -41,6 +187,9 @@ def main():
     parser.add_option("-n", "--num", type="int", dest="num", help="Number of packets to be sent",metavar="number",default=1)
     parser.add_option("-r", "--rsyslog-server", type="string", dest="rsyslog_server", default="127.0.0.1", help="Rsyslog server IPv4 address",metavar="IPAddress") 
     parser.add_option('-g', "--global", action="store_true", dest="global_pf", help="Send global pause frames (not PFC)", default=False)
+    parser.add_option('-d', "--duration", type="float", dest="duration", help="Send frames for the duration in seconds instead of the number of frames", metavar="seconds", default=None)
+    parser.add_option('-s', "--rate", type="int", dest="rate", help="Frames per second per interface, 0 - as fast as possible", metavar="fps", default=0)
+    parser.add_option('-b', "--batch", type="int", dest="batch", help="Max number of frames sent by one system call", metavar="number", default=64)
     (options, args) = parser.parse_args()
 
     if options.interface is None:
@@ -65,6 +214,11 @@ def main():
         parser.print_help()
         sys.exit(1)
 
+    if options.rate < 0 or options.batch < 1:
+        print "Rate must not be negative and batch must be positive."
+        parser.print_help()
+        sys.exit(1)
+
     interfaces = options.interface.split(',')
 
     try:
@@ -144,15 +298,24 @@ def main():
             else:
                 packet = packet + "\x00\x00"
 
+    senders = [BatchSender(s, packet, options.batch) for s in sockets]
+    if options.duration:
+        storm = Storm(senders, duration=options.duration, rate=options.rate)
+    else:
+        storm = Storm(senders, num=options.num, rate=options.rate)
+    # End the storm gracefully when it is stopped by pkill
+    signal.signal(signal.SIGTERM, storm.stop)
+    signal.signal(signal.SIGINT, storm.stop)
+
     pre_str = 'GLOBAL_PF' if options.global_pf else 'PFC'
-    print "Generating %s Packet(s)" % options.num
+    if options.duration:
+        print "Generating %s Packet(s) for %s sec" % (pre_str, options.duration)
+    else:
+        print "Generating %s Packet(s)" % options.num
     my_logger.debug(pre_str + '_STORM_START')
-    iteration = options.num
-    while iteration > 0:
-        for s in sockets:
-            s.send(packet)
-        iteration -= 1
+    storm.run()
     my_logger.debug(pre_str + '_STORM_END')
+    print storm.report()
 
 if __name__ == "__main__":
     main()
@@ -66,6 +66,7 @@ import itertools
 
 from arista import Arista
 import sad_path as sp
+import flow_analyzer as fa
 
 
 class StateMachine():
@@ -166,6 +167,7 @@ class ReloadTest(BaseTest):
         else:
            self.log_file_name = '/tmp/%s.log' % self.test_params['reboot_type']
         self.log_fp = open(self.log_file_name, 'w')
+        self.capture_pcap = "/tmp/capture_%s.pcap" % self.sad_oper if self.sad_oper is not None else "/tmp/capture.pcap"
 
         self.packets_list = []
         self.vnet = self.test_params['vnet']
@@ -1079,36 +1081,37 @@ class ReloadTest(BaseTest):
     def sniff_in_background(self, wait = None):
         """
         This function listens on all ports, in both directions, for the TCP src=1234 dst=5000 packets, until timeout.
-        Once found, all packets are dumped to local pcap file,
-        and all packets are saved to self.packets as scapy type.
-        The native scapy.snif() is used as a background thread, to allow delayed start for the send_in_background().
+        Raw frames with the kernel timestamps are written straight to the pcap file self.capture_pcap,
+        they are parsed only later by examine_flow().
+        The capture runs as a background thread, to allow delayed start for the send_in_background().
         """
         if not wait:
             wait = self.time_to_listen + self.test_params['sniff_time_incr']
         sniffer_start = datetime.datetime.now()
         self.log("Sniffer started at %s" % str(sniffer_start))
         sniff_filter = "tcp and tcp dst port 5000 and tcp src port 1234 and not icmp"
-        scapy_sniffer = threading.Thread(target=self.scapy_sniff, kwargs={'wait': wait, 'sniff_filter': sniff_filter})
-        scapy_sniffer.start()
-        time.sleep(2)               # Let the scapy sniff initialize completely.
+        capture_started = threading.Event()
+        raw_sniffer = threading.Thread(target=self.raw_sniff, kwargs={'wait': wait, 'sniff_filter': sniff_filter, 'started': capture_started})
+        raw_sniffer.start()
+        capture_started.wait(timeout=10)    # Let the capture socket initialize completely.
         self.sniffer_started.set()  # Unblock waiter for the send_in_background.
-        scapy_sniffer.join()
+        raw_sniffer.join()
         self.log("Sniffer has been running for %s" % str(datetime.datetime.now() - sniffer_start))
         self.sniffer_started.clear()
 
     def save_sniffed_packets(self):
-        filename = "/tmp/capture_%s.pcap" % self.sad_oper if self.sad_oper is not None else "/tmp/capture.pcap"
-        if self.packets:
-            scapyall.wrpcap(filename, self.packets)
-            self.log("Pcap file dumped to %s" % filename)
+        if self.captured_count:
+            self.log("Pcap file dumped to %s" % self.capture_pcap)
         else:
             self.log("Pcap file is empty.")
 
-    def scapy_sniff(self, wait = 180, sniff_filter = ''):
+    def raw_sniff(self, wait = 180, sniff_filter = '', started = None):
         """
-        This method exploits native scapy sniff() method.
+        This method captures raw frames by AF_PACKET socket into self.capture_pcap file.
         """
-        self.packets = scapyall.sniff(timeout = wait, filter = sniff_filter)
+        self.captured_count = 0
+        self.captured_count, dropped = fa.sniff_to_pcap(self.capture_pcap, wait, sniff_filter, scapyall.attach_filter, started)
+        self.log("Sniffer captured %d frames, %d frames dropped by kernel" % (self.captured_count, dropped))
 
     def send_and_sniff(self):
         """
@@ -1123,114 +1126,42 @@ class ReloadTest(BaseTest):
         self.sniff_thr.join()
         self.sender_thr.join()
 
-    def check_tcp_payload(self, packet):
-        """
-        This method is used by examine_flow() method.
-        It returns True if a packet is not corrupted and has a valid TCP sequential TCP Payload, as created by generate_bidirectional() method'.
-        """
-        try:
-            int(str(packet[scapyall.TCP].payload)) in range(self.packets_to_send)
-            return True
-        except Exception as err:
-            return False
-
-    def no_flood(self, packet):
-        """
-        This method filters packets which are unique (i.e. no floods).
-        """
-        if (not int(str(packet[scapyall.TCP].payload)) in self.unique_id) and (packet[scapyall.Ether].src == self.dut_mac):
-            # This is a unique (no flooded) received packet.
-            self.unique_id.append(int(str(packet[scapyall.TCP].payload)))
-            return True
-        elif packet[scapyall.Ether].dst == self.dut_mac:
-            # This is a sent packet.
-            return True
-        else:
-            return False
-
     def examine_flow(self, filename = None):
         """
-        This method examines pcap file (if given), or self.packets scapy file.
+        This method examines pcap file (if given), or self.capture_pcap file written by the sniffer.
         The method compares TCP payloads of the packets one by one (assuming all payloads are consecutive integers),
         and the losses if found - are treated as disruptions in Dataplane forwarding.
         All disruptions are saved to self.lost_packets dictionary, in format:
         disrupt_start_id = (missing_packets_count, disrupt_time, disrupt_start_timestamp, disrupt_stop_timestamp)
+        Each frame is decoded only once from raw bytes (see flow_analyzer), so the analysis is linear in the number
+        of captured frames apart from the sort by Payload ID and Timestamp.
         """
-        if filename:
-            all_packets = scapyall.rdpcap(filename)
-        elif self.packets:
-            all_packets = self.packets
-        else:
-            self.log("Filename and self.packets are not defined.")
-            self.fails['dut'].add("Filename and self.packets are not defined")
+        if not filename:
+            filename = self.capture_pcap
+        if not os.path.exists(filename):
+            self.log("Pcap file %s doesn't exist." % filename)
+            self.fails['dut'].add("Pcap file %s doesn't exist" % filename)
             return None
+        all_frames = fa.read_pcap(filename)
         # Filter out packets and remove floods:
-        self.unique_id = list()     # This list will contain all unique Payload ID, to filter out received floods.
-        filtered_packets = [ pkt for pkt in all_packets if
-            scapyall.TCP in pkt and
-            not scapyall.ICMP in pkt and
-            pkt[scapyall.TCP].sport == 1234 and
-            pkt[scapyall.TCP].dport == 5000 and
-            self.check_tcp_payload(pkt) and
-            self.no_flood(pkt)
-            ]
-
-        if self.vnet:
-            decap_packets = [ scapyall.Ether(str(pkt.payload.payload.payload)[8:]) for pkt in all_packets if
-                scapyall.UDP in pkt and
-                pkt[scapyall.UDP].sport == 1234
-                ]
-            filtered_decap_packets = [ pkt for pkt in decap_packets if
-                scapyall.TCP in pkt and
-                not scapyall.ICMP in pkt and
-                pkt[scapyall.TCP].sport == 1234 and
-                pkt[scapyall.TCP].dport == 5000 and
-                self.check_tcp_payload(pkt) and
-                self.no_flood(pkt)
-                ]
-            filtered_packets = filtered_packets + filtered_decap_packets
-
-        # Re-arrange packets, if delayed, by Payload ID and Timestamp:
-        packets = sorted(filtered_packets, key = lambda packet: (int(str(packet[scapyall.TCP].payload)), packet.time ))
-        self.lost_packets = dict()
+        flow = fa.FlowFrames(self.dut_mac, vnet=self.vnet)
+        for index, (timestamp, frame) in enumerate(all_frames):
+            flow.add(timestamp, frame, index)
+
         self.max_disrupt, self.total_disruption = 0, 0
-        sent_packets = dict()
         self.fails['dut'].add("Sniffer failed to capture any traffic")
-        self.assertTrue(packets, "Sniffer failed to capture any traffic")
+        self.assertTrue(len(flow), "Sniffer failed to capture any traffic")
         self.fails['dut'].clear()
-        if packets:
-            prev_payload, prev_time = 0, 0
-            sent_payload = 0
-            received_counter = 0    # Counts packets from dut.
-            self.disruption_start, self.disruption_stop = None, None
-            for packet in packets:
-                if packet[scapyall.Ether].dst == self.dut_mac:
-                    # This is a sent packet - keep track of it as payload_id:timestamp.
-                    sent_payload = int(str(packet[scapyall.TCP].payload))
-                    sent_packets[sent_payload] = packet.time
-                    continue
-                if packet[scapyall.Ether].src == self.dut_mac:
-                    # This is a received packet.
-                    received_time = packet.time
-                    received_payload = int(str(packet[scapyall.TCP].payload))
-                    received_counter += 1
-                if not (received_payload and received_time):
-                    # This is the first valid received packet.
-                    prev_payload = received_payload
-                    prev_time = received_time
-                    continue
-                if received_payload - prev_payload > 1:
-                    # Packets in a row are missing, a disruption.
-                    lost_id = (received_payload -1) - prev_payload # How many packets lost in a row.
-                    disrupt = (sent_packets[received_payload] - sent_packets[prev_payload + 1]) # How long disrupt lasted.
-                    # Add disrupt to the dict:
-                    self.lost_packets[prev_payload] = (lost_id, disrupt, received_time - disrupt, received_time)
-                    self.log("Disruption between packet ID %d and %d. For %.4f " % (prev_payload, received_payload, disrupt))
-                    if not self.disruption_start:
-                        self.disruption_start = datetime.datetime.fromtimestamp(prev_time)
-                    self.disruption_stop = datetime.datetime.fromtimestamp(received_time)
-                prev_payload = received_payload
-                prev_time = received_time
+        # Re-arrange packets, if delayed, by Payload ID and Timestamp and look for the gaps:
+        result = fa.find_disruptions(flow)
+        self.lost_packets = result['lost_packets']
+        received_counter = result['received_counter']
+        for prev_payload, (lost_id, disrupt, _, _) in sorted(self.lost_packets.items()):
+            self.log("Disruption between packet ID %d and %d. For %.4f " % (prev_payload, prev_payload + lost_id + 1, disrupt))
+        self.disruption_start, self.disruption_stop = None, None
+        if result['disruption_start'] is not None:
+            self.disruption_start = datetime.datetime.fromtimestamp(result['disruption_start'])
+            self.disruption_stop = datetime.datetime.fromtimestamp(result['disruption_stop'])
         self.fails['dut'].add("Sniffer failed to filter any traffic from DUT")
         self.assertTrue(received_counter, "Sniffer failed to filter any traffic from DUT")
         self.fails['dut'].clear()
@@ -1250,10 +1181,10 @@ class ReloadTest(BaseTest):
             self.total_disrupt_time = 0
             self.log("Gaps in forwarding not found.")
         self.log("Total incoming packets captured %d" % received_counter)
-        if packets:
-            filename = '/tmp/capture_filtered.pcap' if self.sad_oper is None else "/tmp/capture_filtered_%s.pcap" % self.sad_oper
-            scapyall.wrpcap(filename, packets)
-            self.log("Filtered pcap dumped to %s" % filename)
+        capture = filename
+        filename = '/tmp/capture_filtered.pcap' if self.sad_oper is None else "/tmp/capture_filtered_%s.pcap" % self.sad_oper
+        fa.write_pcap_frames(filename, capture, flow.capture_frames(result['order']))
+        self.log("Filtered pcap dumped to %s" % filename)
 
     def check_forwarding_stop(self):
         self.asic_start_recording_vlan_reachability()
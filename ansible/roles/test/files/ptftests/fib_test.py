@@ -26,6 +26,7 @@ from ptf.mask import Mask
 from ptf.testutils import *
 
 import fib
+import probe
 
 class FibTest(BaseTest):
     '''
@@ -63,6 +64,7 @@ class FibTest(BaseTest):
     DEFAULT_BALANCING_TEST_RATIO = 0.0001
     ACTION_FWD = 'fwd'
     ACTION_DROP = 'drop'
+    DEFAULT_PIPELINE_TIMEOUT = 2
 
     _required_params = [
         'fib_info',
@@ -98,6 +100,11 @@ class FibTest(BaseTest):
          - ip_options       enable ip option header in ipv4 pkts. Default: False(disable)
          - src_vid          vlan tag id of src pkts. Default: None(untag)
          - dst_vid          vlan tag id of dst pkts. Default: None(untag)
+         - pipelined        send the probes of many IP ranges in a burst and match the received
+                            packets back to the probes by the id in the payload. Default: False
+         - pipeline_batch   number of probes in a burst. Default: the ptf queue length of a port (--qlen),
+                            larger bursts require larger --qlen to avoid drops in ptf
+         - pipeline_timeout seconds to wait for the packets of a burst after it was sent. Default: 2
 
         TODO: Have a separate line in fib_info/file to indicate all UP ports
         '''
@@ -121,6 +128,11 @@ class FibTest(BaseTest):
         self.src_vid = self.test_params.get('src_vid', None)
         self.dst_vid = self.test_params.get('dst_vid', None)
 
+        self.pipelined = self.test_params.get('pipelined', False)
+        self.pipeline_batch = self.test_params.get('pipeline_batch', config.get('qlen', 100))
+        self.pipeline_timeout = self.test_params.get('pipeline_timeout', self.DEFAULT_PIPELINE_TIMEOUT)
+        self.probe_id = 0
+
         self.src_ports = self.test_params.get('src_ports', None)
         if self.src_ports is None:
             # Provide the list of all UP interfaces with index in sequence order starting from 0
@@ -150,11 +162,84 @@ class FibTest(BaseTest):
             ip_ranges = self.fib.ipv4_ranges()
         else:
             ip_ranges = self.fib.ipv6_ranges()
-        
+
+        if self.pipelined:
+            self.check_ip_ranges_pipelined(ip_ranges, ipv4)
+            return
+
         for ip_range in ip_ranges:
             next_hop = self.fib[ip_range.get_first_ip()]
             self.check_ip_range(ip_range, next_hop, ipv4)
 
+    def get_range_probe_ips(self, ip_range):
+        '''
+        @summary: IPs to check in the range: the first, the last and a random one
+        '''
+        ips = [ip_range.get_first_ip()]
+        if ip_range.length() > 1:
+            ips.append(ip_range.get_last_ip())
+        if ip_range.length() > 2:
+            ips.append(ip_range.get_random_ip())
+        return ips
+
+    def check_ip_ranges_pipelined(self, ip_ranges, ipv4=True):
+        '''
+        @summary: Check IP ranges sending the probes in bursts of pipeline_batch packets.
+        Every probe carries a unique id in the payload, the received packets are matched
+        back to the probes and their expected ports by this id.
+        '''
+        probes = []
+        balancing_checks = []
+        for ip_range in ip_ranges:
+            next_hop = self.fib[ip_range.get_first_ip()]
+            exp_port_list = next_hop.get_next_hop_list()
+            if not exp_port_list:
+                logging.info("Skip check IP range {} with nexthop {}".format(ip_range, next_hop))
+                continue
+            src_port = random.choice([port for port in self.src_ports if port not in exp_port_list])
+            for dst_ip in self.get_range_probe_ips(ip_range):
+                probes.append((src_port, dst_ip, exp_port_list))
+            if self.is_balancing_check_needed(exp_port_list):
+                balancing_checks.append((ip_range, next_hop, src_port, exp_port_list))
+
+        logging.info("Check {} IP ranges with {} probes in bursts of {}".format(len(ip_ranges), len(probes), self.pipeline_batch))
+        for start in range(0, len(probes), self.pipeline_batch):
+            self.check_probes(probes[start:start + self.pipeline_batch], ipv4)
+
+        for ip_range, next_hop, src_port, exp_port_list in balancing_checks:
+            self.check_ip_range_balancing(ip_range, next_hop, src_port, exp_port_list, ipv4)
+
+    def check_probes(self, probes, ipv4=True):
+        '''
+        @summary: Send a burst of probes and match the received packets to them by the probe id.
+        @param probes: list of (src_port, dst_ip_addr, dst_port_list)
+        '''
+        first_id = self.probe_id + 1
+        pending = {}
+        packets = []
+        for src_port, dst_ip, exp_port_list in probes:
+            self.probe_id += 1
+            if ipv4:
+                pkt, masked_exp_pkt = self.build_ipv4_packets(dst_ip, self.probe_id)
+            else:
+                pkt, masked_exp_pkt = self.build_ipv6_packets(dst_ip, self.probe_id)
+            pending[self.probe_id] = (masked_exp_pkt, exp_port_list)
+            packets.append((src_port, str(pkt)))
+
+        self.dataplane.flush()
+        probe.send_probes(self, packets)
+        received = probe.collect_probes(self, pending, self.pipeline_timeout)
+
+        if self.pkt_action == self.ACTION_DROP:
+            for probe_id, port in received.items():
+                logging.error("Packet to " + probes[probe_id - first_id][1] + " received at " + str(port))
+            assert not received, "{} of {} packets were not dropped".format(len(received), len(probes))
+        else:
+            for probe_id in set(pending) - set(received):
+                src_port, dst_ip, exp_port_list = probes[probe_id - first_id]
+                logging.error("Packet to " + dst_ip + " not received at any of " + str(exp_port_list))
+            assert len(received) == len(pending), "{} of {} packets were not received".format(len(pending) - len(received), len(probes))
+
     def check_ip_range(self, ip_range, next_hop, ipv4=True):
         # Get the expected list of ports that would receive the packets
         exp_port_list = next_hop.get_next_hop_list()
@@ -167,26 +252,27 @@ class FibTest(BaseTest):
 
         logging.info("Check IP range:" + str(ip_range) + " on " + str(exp_port_list) + "...")
 
-        # Send a packet with the first IP in the range
-        self.check_ip_route(src_port, ip_range.get_first_ip(), exp_port_list, ipv4)
-        # Send a packet with the last IP in the range
-        if ip_range.length() > 1:
-            self.check_ip_route(src_port, ip_range.get_last_ip(), exp_port_list, ipv4)
-        # Send a packet with a random IP in the range
-        if ip_range.length() > 2:
-            self.check_ip_route(src_port, ip_range.get_random_ip(), exp_port_list, ipv4)
+        # Send a packet with the first, the last and a random IP in the range
+        for dst_ip in self.get_range_probe_ips(ip_range):
+            self.check_ip_route(src_port, dst_ip, exp_port_list, ipv4)
 
         # Test traffic balancing across ECMP/LAG members
-        if (self.test_balancing and self.pkt_action == self.ACTION_FWD
-                and len(exp_port_list) > 1  
-                and random.random() < self.balancing_test_ratio):
-            logging.info("Check IP range balancing...")
-            dst_ip = ip_range.get_random_ip()
-            hit_count_map = {}
-            for i in range(0, self.balancing_test_times):
-                (matched_index, received) = self.check_ip_route(src_port, dst_ip, exp_port_list, ipv4)
-                hit_count_map[matched_index] = hit_count_map.get(matched_index, 0) + 1
-            self.check_balancing(next_hop.get_next_hop(), hit_count_map)
+        if self.is_balancing_check_needed(exp_port_list):
+            self.check_ip_range_balancing(ip_range, next_hop, src_port, exp_port_list, ipv4)
+
+    def is_balancing_check_needed(self, exp_port_list):
+        return (self.test_balancing and self.pkt_action == self.ACTION_FWD
+                and len(exp_port_list) > 1
+                and random.random() < self.balancing_test_ratio)
+
+    def check_ip_range_balancing(self, ip_range, next_hop, src_port, exp_port_list, ipv4=True):
+        logging.info("Check IP range balancing...")
+        dst_ip = ip_range.get_random_ip()
+        hit_count_map = {}
+        for i in range(0, self.balancing_test_times):
+            (matched_index, received) = self.check_ip_route(src_port, dst_ip, exp_port_list, ipv4)
+            hit_count_map[matched_index] = hit_count_map.get(matched_index, 0) + 1
+        self.check_balancing(next_hop.get_next_hop(), hit_count_map)
 
     def check_ip_route(self, src_port, dst_ip_addr, dst_port_list, ipv4=True):
         if ipv4:
@@ -213,6 +299,24 @@ class FibTest(BaseTest):
         @param dest_ip_addr: destination IP to build packet with.
         @param dst_port_list: list of ports on which to expect packet to come back from the switch
         '''
+        pkt, masked_exp_pkt = self.build_ipv4_packets(dst_ip_addr)
+
+        send_packet(self, src_port, pkt)
+        logging.info("Sending packet from port " + str(src_port) + " to " + dst_ip_addr)
+
+        if self.pkt_action == self.ACTION_FWD:
+            return verify_packet_any_port(self, masked_exp_pkt, dst_port_list)
+        elif self.pkt_action == self.ACTION_DROP:
+            return verify_no_packet_any(self, masked_exp_pkt, dst_port_list)
+    #---------------------------------------------------------------------
+
+    def build_ipv4_packets(self, dst_ip_addr, probe_id=None):
+        '''
+        @summary: Build IPv4 packet to send and the expected packet.
+        @param dest_ip_addr: destination IP to build packet with.
+        @param probe_id: id to put into the payload of the packets
+        @return (packet, masked expected packet)
+        '''
         sport = random.randint(0, 65535)
         dport = random.randint(0, 65535)
         ip_src = "10.0.0.1"
@@ -242,11 +346,27 @@ class FibTest(BaseTest):
                             ip_options=self.ip_options,
                             dl_vlan_enable=self.dst_vid is not None,
                             vlan_vid=self.dst_vid or 0)
+        if probe_id is not None:
+            probe.set_probe_id(pkt, scapy.TCP, probe_id)
+            probe.set_probe_id(exp_pkt, scapy.TCP, probe_id)
         masked_exp_pkt = Mask(exp_pkt)
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether, "dst")
 
+        return pkt, masked_exp_pkt
+    #---------------------------------------------------------------------
+
+    def check_ipv6_route(self, src_port, dst_ip_addr, dst_port_list):
+        '''
+        @summary: Check IPv6 route works.
+        @param source_port_index: index of port to use for sending packet to switch
+        @param dest_ip_addr: destination IP to build packet with.
+        @param dst_port_list: list of ports on which to expect packet to come back from the switch
+        @return Boolean
+        '''
+        pkt, masked_exp_pkt = self.build_ipv6_packets(dst_ip_addr)
+
         send_packet(self, src_port, pkt)
-        logging.info("Sending packet from port " + str(src_port) + " to " + ip_dst)
+        logging.info("Sending packet from port " + str(src_port) + " to " + dst_ip_addr)
 
         if self.pkt_action == self.ACTION_FWD:
             return verify_packet_any_port(self, masked_exp_pkt, dst_port_list)
@@ -254,13 +374,12 @@ class FibTest(BaseTest):
             return verify_no_packet_any(self, masked_exp_pkt, dst_port_list)
     #---------------------------------------------------------------------
 
-    def check_ipv6_route(self, src_port, dst_ip_addr, dst_port_list):
+    def build_ipv6_packets(self, dst_ip_addr, probe_id=None):
         '''
-        @summary: Check IPv6 route works.
-        @param source_port_index: index of port to use for sending packet to switch
+        @summary: Build IPv6 packet to send and the expected packet.
         @param dest_ip_addr: destination IP to build packet with.
-        @param dst_port_list: list of ports on which to expect packet to come back from the switch
-        @return Boolean
+        @param probe_id: id to put into the payload of the packets
+        @return (packet, masked expected packet)
         '''
         sport = random.randint(0, 65535)
         dport = random.randint(0, 65535)
@@ -289,16 +408,13 @@ class FibTest(BaseTest):
                                 ipv6_hlim=max(self.ttl-1, 0),
                                 dl_vlan_enable=self.dst_vid is not None,
                                 vlan_vid=self.dst_vid or 0)
+        if probe_id is not None:
+            probe.set_probe_id(pkt, scapy.TCP, probe_id)
+            probe.set_probe_id(exp_pkt, scapy.TCP, probe_id)
         masked_exp_pkt = Mask(exp_pkt)
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether,"dst")
 
-        send_packet(self, src_port, pkt)
-        logging.info("Sending packet from port " + str(src_port) + " to " + ip_dst)
-
-        if self.pkt_action == self.ACTION_FWD:
-            return verify_packet_any_port(self, masked_exp_pkt, dst_port_list)
-        elif self.pkt_action == self.ACTION_DROP:
-            return verify_no_packet_any(self, masked_exp_pkt, dst_port_list)
+        return pkt, masked_exp_pkt
     #---------------------------------------------------------------------
     def check_within_expected_range(self, actual, expected):
         '''
@@ -0,0 +1,355 @@
+"""
+Helpers for the capture and the analysis of the dataplane flow of the reboot tests.
+
+Frames are captured by AF_PACKET socket with kernel timestamps straight into pcap file, parsing is left
+to the analysis time. Captured frames are decoded once from raw bytes into compact arrays of payload id,
+timestamp and direction, scapy objects are not built.
+"""
+
+import binascii
+import errno
+import select
+import socket
+import struct
+import time
+from array import array
+from fcntl import ioctl
+
+PCAP_MAGIC_USEC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+PCAP_VERSION = (2, 4)
+PCAP_SNAPLEN = 65535
+LINKTYPE_ETHERNET = 1
+
+ETH_HDR_LEN = 14
+ETH_P_IP = 0x0800
+ETH_P_8021Q = 0x8100
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+VXLAN_HDR_LEN = 8
+
+# TCP ports of the packets generated by the reboot test
+FLOW_SPORT = 1234
+FLOW_DPORT = 5000
+
+ETH_P_ALL = 0x0003
+SIOCGSTAMP = 0x8906
+SOL_PACKET = 263
+PACKET_STATISTICS = 6
+SO_RCVBUFFORCE = 33
+CAPTURE_RCVBUF_SIZE = 64 * 1024 * 1024
+
+DIRECTION_SENT = 0
+DIRECTION_RECEIVED = 1
+
+
+def mac_to_bytes(mac):
+    """
+    Converts MAC address string 'aa:bb:cc:dd:ee:ff' to 6 raw bytes.
+    """
+    return binascii.unhexlify(mac.replace(':', ''))
+
+
+def read_pcap_header(pcap, filename):
+    """
+    Reads the global header of the open pcap file.
+    Returns (record header struct, divisor of the timestamp fraction), None for an empty file.
+    """
+    header = pcap.read(24)
+    if len(header) < 24:
+        return None
+    for endian in ('<', '>'):
+        magic = struct.unpack(endian + 'I', header[:4])[0]
+        if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+            break
+    else:
+        raise ValueError("%s is not a pcap file" % filename)
+
+    divisor = 1e9 if magic == PCAP_MAGIC_NSEC else 1e6
+    return struct.Struct(endian + 'IIII'), divisor
+
+
+def read_pcap(filename):
+    """
+    Reads pcap file and yields (timestamp, frame) for each captured frame.
+    """
+    with open(filename, 'rb') as pcap:
+        header = read_pcap_header(pcap, filename)
+        if header is None:
+            return
+        record_header, divisor = header
+        while True:
+            data = pcap.read(record_header.size)
+            if len(data) < record_header.size:
+                break
+            sec, frac, caplen, _ = record_header.unpack(data)
+            frame = pcap.read(caplen)
+            if len(frame) < caplen:
+                break
+            yield sec + frac / divisor, frame
+
+
+def write_pcap_header(pcap, snaplen=PCAP_SNAPLEN):
+    pcap.write(struct.pack('<IHHiIII', PCAP_MAGIC_USEC, PCAP_VERSION[0], PCAP_VERSION[1], 0, 0, snaplen,
+                           LINKTYPE_ETHERNET))
+
+
+def write_pcap_record(pcap, timestamp, frame, wirelen=None):
+    sec = int(timestamp)
+    usec = int(round((timestamp - sec) * 1e6))
+    if usec >= 1000000:
+        sec, usec = sec + 1, usec - 1000000
+    pcap.write(struct.pack('<IIII', sec, usec, len(frame), wirelen or len(frame)))
+    pcap.write(frame)
+
+
+def write_pcap(filename, frames):
+    """
+    Writes list of (timestamp, frame) into pcap file.
+    """
+    with open(filename, 'wb') as pcap:
+        write_pcap_header(pcap)
+        for timestamp, frame in frames:
+            write_pcap_record(pcap, timestamp, frame)
+
+
+def write_pcap_frames(filename, capture, frames):
+    """
+    Writes frames of the capture pcap file into pcap file. frames is a list of (index, offset, length):
+    the frame data[offset:offset + length] of the record at the capture index is written, in the order
+    of the list. The capture is read twice: the offsets of the wanted records are collected skipping
+    the frame data, then the frames are read by the offsets, so only the offsets are kept in memory.
+    """
+    wanted = set(index for index, _, _ in frames)
+    offsets = {}
+    with open(capture, 'rb') as pcap, open(filename, 'wb') as out:
+        header = read_pcap_header(pcap, capture)
+        write_pcap_header(out)
+        if header is None:
+            return
+        record_header, divisor = header
+
+        index = 0
+        while True:
+            offset = pcap.tell()
+            data = pcap.read(record_header.size)
+            if len(data) < record_header.size:
+                break
+            if index in wanted:
+                offsets[index] = offset
+            pcap.seek(record_header.unpack(data)[2], 1)
+            index += 1
+
+        for index, offset, length in frames:
+            pcap.seek(offsets[index])
+            sec, frac, caplen, _ = record_header.unpack(pcap.read(record_header.size))
+            frame = pcap.read(caplen)
+            write_pcap_record(out, sec + frac / divisor, frame[offset:offset + length])
+
+
+def sniff_to_pcap(filename, timeout, bpf_filter=None, attach_filter=None, started=None, snaplen=PCAP_SNAPLEN):
+    """
+    Captures frames from all interfaces, in both directions, into pcap file until timeout.
+    The frames are written as they are received with the kernel timestamps.
+    @param bpf_filter: Filter expression, attached to the socket by attach_filter(socket, bpf_filter)
+    @param started: threading.Event which is set once the socket is ready to capture
+    Returns (captured_frames_count, kernel_dropped_frames_count)
+    """
+    captured = 0
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+    try:
+        # Big socket buffer makes the capture survive bursts and the slow disk writes
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, CAPTURE_RCVBUF_SIZE)
+        except socket.error:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, CAPTURE_RCVBUF_SIZE)
+        if bpf_filter:
+            attach_filter(sock, bpf_filter)
+        if started is not None:
+            started.set()
+
+        deadline = time.time() + timeout
+        with open(filename, 'wb') as pcap:
+            write_pcap_header(pcap, snaplen)
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                readable, _, _ = select.select([sock], [], [], remaining)
+                if not readable:
+                    continue
+                # Drain everything queued by the kernel before sleeping in select() again
+                while time.time() < deadline:
+                    try:
+                        frame = sock.recv(snaplen, socket.MSG_DONTWAIT)
+                    except socket.error as err:
+                        if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                            break
+                        raise
+                    sec, usec = struct.unpack('ll', ioctl(sock, SIOCGSTAMP, struct.pack('ll', 0, 0)))
+                    write_pcap_record(pcap, sec + usec / 1e6, frame)
+                    captured += 1
+
+        _, dropped = struct.unpack('II', sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 8))
+    finally:
+        sock.close()
+
+    return captured, dropped
+
+
+def parse_l4(frame):
+    """
+    Parses Ethernet (optionally 802.1Q tagged) IPv4 frame.
+    Returns (ip_proto, sport, dport, l4_payload_offset, l4_payload) for TCP and UDP frames, otherwise None.
+    """
+    offset = ETH_HDR_LEN
+    if len(frame) < offset:
+        return None
+    ethertype = struct.unpack_from('!H', frame, offset - 2)[0]
+    while ethertype == ETH_P_8021Q and len(frame) >= offset + 4:
+        ethertype = struct.unpack_from('!H', frame, offset + 2)[0]
+        offset += 4
+    if ethertype != ETH_P_IP or len(frame) < offset + 20:
+        return None
+
+    ver_ihl, total_len, proto = struct.unpack_from('!B1xH5xB', frame, offset)
+    ip_end = min(len(frame), offset + total_len)
+    l4 = offset + (ver_ihl & 0x0f) * 4
+
+    if proto == IPPROTO_TCP and l4 + 20 <= ip_end:
+        sport, dport = struct.unpack_from('!HH', frame, l4)
+        data_offset = l4 + (struct.unpack_from('!B', frame, l4 + 12)[0] >> 4) * 4
+        return proto, sport, dport, data_offset, frame[data_offset:ip_end]
+    if proto == IPPROTO_UDP and l4 + 8 <= ip_end:
+        sport, dport = struct.unpack_from('!HH', frame, l4)
+        return proto, sport, dport, l4 + 8, frame[l4 + 8:ip_end]
+
+    return None
+
+
+class FlowFrames(object):
+    """
+    Compact representation of the captured test flow.
+    For each frame of the flow payload id, timestamp, direction, index in the capture and offset and length
+    of the frame in the captured one (VXLAN decapsulated frames in VNET mode) are kept in arrays,
+    the frames themselves are not kept, see write_pcap_frames().
+    Received floods (frames from DUT with already seen payload id) are dropped while adding.
+    """
+
+    def __init__(self, dut_mac, vnet=False):
+        self.dut_mac = mac_to_bytes(dut_mac)
+        self.vnet = vnet
+        self.ids = array('l')
+        self.times = array('d')
+        self.directions = array('b')
+        self.indices = array('l')
+        self.offsets = array('l')
+        self.lengths = array('l')
+        self.received_ids = set()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, timestamp, frame, index, offset=0):
+        """
+        Adds the frame if it is a valid frame of the test flow: TCP from port 1234 to port 5000
+        with integer payload id, sent to DUT or received from DUT. In VNET mode VXLAN encapsulated
+        frames (UDP from port 1234) are decapsulated.
+        index is the index of the frame in the capture, offset is the offset of the frame in the captured one.
+        Returns True if the frame was added.
+        """
+        parsed = parse_l4(frame)
+        if parsed is None:
+            return False
+        proto, sport, dport, payload_offset, payload = parsed
+
+        if self.vnet and proto == IPPROTO_UDP and sport == FLOW_SPORT:
+            return self.add(timestamp, payload[VXLAN_HDR_LEN:], index, offset + payload_offset + VXLAN_HDR_LEN)
+
+        if proto != IPPROTO_TCP or sport != FLOW_SPORT or dport != FLOW_DPORT:
+            return False
+        try:
+            payload_id = int(payload)
+        except ValueError:
+            return False
+
+        if frame[6:12] == self.dut_mac:
+            if payload_id in self.received_ids:
+                return False
+            self.received_ids.add(payload_id)
+            direction = DIRECTION_RECEIVED
+        elif frame[0:6] == self.dut_mac:
+            direction = DIRECTION_SENT
+        else:
+            return False
+
+        self.ids.append(payload_id)
+        self.times.append(timestamp)
+        self.directions.append(direction)
+        self.indices.append(index)
+        self.offsets.append(offset)
+        self.lengths.append(len(frame))
+        return True
+
+    def sorted_indices(self):
+        """
+        Returns indices of the frames ordered by payload id and timestamp.
+        """
+        ids, times = self.ids, self.times
+        return sorted(xrange(len(ids)), key=lambda i: (ids[i], times[i]))
+
+    def capture_frames(self, order):
+        """
+        Returns (index, offset, length) of the frames in the given order for write_pcap_frames().
+        """
+        return [(self.indices[i], self.offsets[i], self.lengths[i]) for i in order]
+
+
+def find_disruptions(flow):
+    """
+    Walks the flow ordered by payload id and timestamp once. Payload ids are consecutive integers,
+    so gaps in the ids of the received frames are treated as disruptions in dataplane forwarding.
+    Returns dictionary with:
+        lost_packets - {disrupt_start_id: (missing_packets_count, disrupt_time, disrupt_start_timestamp, disrupt_stop_timestamp)}
+        received_counter - number of unique frames received from DUT
+        disruption_start, disruption_stop - timestamps of the first and the last disruption
+        order - indices of the flow frames ordered by payload id and timestamp
+    """
+    order = flow.sorted_indices()
+    ids, times, directions = flow.ids, flow.times, flow.directions
+
+    sent_packets = dict()
+    lost_packets = dict()
+    prev_payload, prev_time = 0, 0
+    received_payload, received_time = None, None
+    received_counter = 0
+    disruption_start, disruption_stop = None, None
+
+    for i in order:
+        if directions[i] == DIRECTION_SENT:
+            # This is a sent packet - keep track of it as payload_id:timestamp.
+            sent_packets[ids[i]] = times[i]
+            continue
+        received_payload, received_time = ids[i], times[i]
+        received_counter += 1
+        if not (received_payload and received_time):
+            # This is the first valid received packet.
+            prev_payload, prev_time = received_payload, received_time
+            continue
+        if received_payload - prev_payload > 1:
+            # Packets in a row are missing, a disruption.
+            lost_id = (received_payload - 1) - prev_payload  # How many packets lost in a row.
+            disrupt = sent_packets[received_payload] - sent_packets[prev_payload + 1]  # How long disrupt lasted.
+            lost_packets[prev_payload] = (lost_id, disrupt, received_time - disrupt, received_time)
+            if disruption_start is None:
+                disruption_start = prev_time
+            disruption_stop = received_time
+        prev_payload, prev_time = received_payload, received_time
+
+    return {
+        'lost_packets': lost_packets,
+        'received_counter': received_counter,
+        'disruption_start': disruption_start,
+        'disruption_stop': disruption_stop,
+        'order': order,
+    }
@@ -7,6 +7,7 @@ Description:    This file contains the hash test for SONiC
 #---------------------------------------------------------------------
 import ipaddress
 import logging
+import math
 import random
 import socket
 import sys
@@ -24,6 +25,47 @@ from ptf.testutils import *
 
 import fib
 import lpm
+import probe
+
+
+def chi_square_p_value(statistic, df):
+    '''
+    @summary: Upper tail probability of the chi-square distribution, i.e. probability to get
+    the statistic at least as big as the given one by chance. Computed as the regularized
+    upper incomplete gamma function Q(df/2, statistic/2).
+    '''
+    a, x = df / 2.0, statistic / 2.0
+    if x <= 0:
+        return 1.0
+    log_prefix = -x + a * math.log(x) - math.lgamma(a)
+    if x < a + 1:
+        # series of the lower regularized gamma function
+        term = total = 1.0 / a
+        n = a
+        while abs(term) > abs(total) * 1e-12:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1.0 - total * math.exp(log_prefix))
+    # continued fraction of the upper regularized gamma function (modified Lentz's method)
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = 1 / (d if abs(d) > tiny else tiny)
+        c = b + an / c
+        c = c if abs(c) > tiny else tiny
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-12:
+            break
+    return min(1.0, math.exp(log_prefix) * h)
+
 
 class HashTest(BaseTest):
 
@@ -32,6 +74,8 @@ class HashTest(BaseTest):
     #---------------------------------------------------------------------
     DEFAULT_BALANCING_RANGE = 0.25
     BALANCING_TEST_TIMES = 1000
+    DEFAULT_PROBE_TIMEOUT = 2
+    HASH_FIELDS = ['src_ip', 'dst_ip', 'src_port', 'dst_port']
 
     def __init__(self):
         '''
@@ -45,6 +89,15 @@ class HashTest(BaseTest):
     def setUp(self):
         '''
         @summary: Setup for the test
+        Some test parameters are used:
+         - balancing_range: accepted deviation of the number of packets received by a port from the expected one
+         - balancing_test_times: number of packets sent for every hash field
+         - batched: generate the probes of all hash fields in advance, send them in bursts and match
+                    the received packets back to the probes by the id in the payload. Default: False
+         - batch_size: number of probes in a burst. Default: the ptf queue length of a port (--qlen)
+         - probe_timeout: seconds to wait for the packets of a burst after it was sent. Default: 2
+         - chi_square_alpha: fail the balancing check of a hash field when the p-value of the chi-square
+                    uniformity test is below this significance level. Default: None (only logged)
         '''
         self.dataplane = ptf.dataplane_instance
         self.fib = fib.Fib(self.test_params['fib_info'])
@@ -54,6 +107,12 @@ class HashTest(BaseTest):
         self.test_ipv6 = self.test_params.get('ipv6', True)
 
         self.balancing_range = self.test_params.get('balancing_range', self.DEFAULT_BALANCING_RANGE)
+        self.balancing_test_times = self.test_params.get('balancing_test_times', self.BALANCING_TEST_TIMES)
+        self.batched = self.test_params.get('batched', False)
+        self.batch_size = self.test_params.get('batch_size', config.get('qlen', 100))
+        self.probe_timeout = self.test_params.get('probe_timeout', self.DEFAULT_PROBE_TIMEOUT)
+        self.chi_square_alpha = self.test_params.get('chi_square_alpha', None)
+        self.probe_id = 0
 
         # Provide the list of all UP interfaces with index in sequence order starting from 0
         if self.test_params['testbed_type'] == 't1' or self.test_params['testbed_type'] == 't1-lag':
@@ -70,13 +129,94 @@ class HashTest(BaseTest):
             self.src_ports = range(0, 120)
     #---------------------------------------------------------------------
 
-    def check_hash(self, ipv4=True):
+    def get_ip_intervals(self, ipv4=True):
         if ipv4:
             src_ip_interval = lpm.LpmDict.IpInterval(ip_address(u'8.0.0.0'), ip_address(u'8.255.255.255'))
             dst_ip_interval = lpm.LpmDict.IpInterval(ip_address(u'9.0.0.0'), ip_address(u'9.255.255.255'))
         else:
             src_ip_interval = lpm.LpmDict.IpInterval(ip_address(u'20D0:A800:0:00::'), ip_address(u'20D0:A800:0:00::FFFF'))
             dst_ip_interval = lpm.LpmDict.IpInterval(ip_address(u'20D0:A800:0:00::'), ip_address(u'20D0:A800:0:00::FFFF'))
+        return src_ip_interval, dst_ip_interval
+
+    def check_hash_batched(self, ipv4=True):
+        '''
+        @summary: Check the hash fields with the probes sent in bursts.
+        The probes of all hash fields are generated in advance. For every hash field only this field
+        is randomized and the distribution of the received packets across the expected ports is checked.
+        The in port is not a hash field: packets of the same flow from the different in ports must
+        egress the same port.
+        '''
+        src_ip_interval, dst_ip_interval = self.get_ip_intervals(ipv4)
+
+        base_flow = {
+            'src_ip': src_ip_interval.get_random_ip(),
+            'dst_ip': dst_ip_interval.get_random_ip(),
+            'src_port': random.randint(0, 65535),
+            'dst_port': random.randint(0, 65535),
+        }
+        generators = {
+            'src_ip': src_ip_interval.get_random_ip,
+            'dst_ip': dst_ip_interval.get_random_ip,
+            'src_port': lambda: random.randint(0, 65535),
+            'dst_port': lambda: random.randint(0, 65535),
+        }
+        exp_port_list = self.fib[base_flow['dst_ip']].get_next_hop_list()
+        in_ports = [port for port in self.src_ports if port not in exp_port_list]
+        in_port = random.choice(in_ports)
+
+        probes = []
+        for field in self.HASH_FIELDS:
+            for i in range(0, self.balancing_test_times):
+                flow = dict(base_flow)
+                flow[field] = generators[field]()
+                probes.append((field, in_port, flow))
+        for i in range(0, self.balancing_test_times):
+            probes.append(('in_port', random.choice(in_ports), base_flow))
+
+        received_ports = self.send_probes(probes, exp_port_list, ipv4)
+
+        hit_count_maps = {}
+        for (field, _, _), port in zip(probes, received_ports):
+            hit_count_map = hit_count_maps.setdefault(field, {})
+            hit_count_map[port] = hit_count_map.get(port, 0) + 1
+
+        for field in self.HASH_FIELDS:
+            logging.info("Hash field {}: {}".format(field, hit_count_maps[field]))
+            self.check_balancing(exp_port_list, hit_count_maps[field])
+
+        assert len(hit_count_maps['in_port']) == 1, \
+            "Packets of the same flow from different in ports egressed from {}".format(hit_count_maps['in_port'].keys())
+
+    def send_probes(self, probes, exp_port_list, ipv4=True):
+        '''
+        @summary: Send the probes in bursts of batch_size packets
+        @param probes: list of (field, in_port, flow)
+        @param exp_port_list: list of ports on which to expect packets to come back from the switch
+        @return: list of ports where the probes were received
+        '''
+        received_ports = []
+        for start in range(0, len(probes), self.batch_size):
+            batch = probes[start:start + self.batch_size]
+            pending = {}
+            packets = []
+            for _, in_port, flow in batch:
+                self.probe_id += 1
+                pkt, masked_exp_pkt = self.build_packets(flow['src_port'], flow['dst_port'],
+                        flow['src_ip'], flow['dst_ip'], ipv4, self.probe_id)
+                pending[self.probe_id] = (masked_exp_pkt, exp_port_list)
+                packets.append((in_port, str(pkt)))
+
+            self.dataplane.flush()
+            probe.send_probes(self, packets)
+            received = probe.collect_probes(self, pending, self.probe_timeout)
+            assert len(received) == len(pending), \
+                "{} of {} packets were not received".format(len(pending) - len(received), len(pending))
+            received_ports.extend(received[probe_id] for probe_id in sorted(pending))
+
+        return received_ports
+
+    def check_hash(self, ipv4=True):
+        src_ip_interval, dst_ip_interval = self.get_ip_intervals(ipv4)
 
         # hash field for regular packets:
         #   src_ip, dst_ip, protocol, l4_src_port, l4_dst_port (if applicable)
@@ -93,7 +233,7 @@ class HashTest(BaseTest):
 
         # step 1: check randomizing source ip
         hit_count_map = {}
-        for i in range(0, self.BALANCING_TEST_TIMES):
+        for i in range(0, self.balancing_test_times):
             src_ip = src_ip_interval.get_random_ip()
             (matched_index, _) = self.check_ip_route(
                     in_port, src_port, dst_port, src_ip, dst_ip, exp_port_list, ipv4)
@@ -103,7 +243,7 @@ class HashTest(BaseTest):
 
         # step 2: check randomizing destination ip
         hit_count_map.clear()
-        for i in range(0, self.BALANCING_TEST_TIMES):
+        for i in range(0, self.balancing_test_times):
             dst_ip = dst_ip_interval.get_random_ip()
             (matched_index, _) = self.check_ip_route(
                     in_port, src_port, dst_port, src_ip, dst_ip, exp_port_list, ipv4)
@@ -113,7 +253,7 @@ class HashTest(BaseTest):
 
         # step 3: check randomizing l3 source port
         hit_count_map.clear()
-        for i in range(0, self.BALANCING_TEST_TIMES):
+        for i in range(0, self.balancing_test_times):
             src_port = random.randint(0, 65535)
             (matched_index, _) = self.check_ip_route(
                     in_port, src_port, dst_port, src_ip, dst_ip, exp_port_list, ipv4)
@@ -123,7 +263,7 @@ class HashTest(BaseTest):
 
         # step 4: check randomizing l4 destination port
         hit_count_map.clear()
-        for i in range(0, self.BALANCING_TEST_TIMES):
+        for i in range(0, self.balancing_test_times):
             dst_port = random.randint(0, 65535)
             (matched_index, _) = self.check_ip_route(
                     in_port, src_port, dst_port, src_ip, dst_ip, exp_port_list, ipv4)
@@ -133,7 +273,7 @@ class HashTest(BaseTest):
 
         ### check non hash fields ###
         hit_count_map.clear()
-        for i in range(0, self.BALANCING_TEST_TIMES):
+        for i in range(0, self.balancing_test_times):
             dst_port = random.randint(0, 65535)
             (matched_index, _) = self.check_ip_route(
                     in_port, src_port, dst_port, src_ip, dst_ip, exp_port_list, ipv4)
@@ -145,7 +285,7 @@ class HashTest(BaseTest):
         # get the first packet's _ port
         (expected_index, _) = self.check_ip_route(
                 in_port, src_port, dst_port, src_ip, dst_ip, exp_port_list, ipv4)
-        for i in range(0, self.BALANCING_TEST_TIMES):
+        for i in range(0, self.balancing_test_times):
             # randomize in port
             in_port = random.choice([port for port in self.src_ports if port not in exp_port_list])
             (matched_index, _) = self.check_ip_route(
@@ -176,6 +316,25 @@ class HashTest(BaseTest):
         @param dest_ip_addr: destination IP to build packet with.
         @param dst_port_list: list of ports on which to expect packet to come back from the switch
         '''
+        pkt, masked_exp_pkt = self.build_packets(sport, dport, ip_src, ip_dst)
+
+        send_packet(self, in_port, pkt)
+        logging.info("Sending packet from port " + str(in_port) + " to " + ip_dst)
+
+        return verify_packet_any_port(self, masked_exp_pkt, dst_port_list)
+    #---------------------------------------------------------------------
+
+    def build_packets(self, sport, dport, ip_src, ip_dst, ipv4=True, probe_id=None):
+        '''
+        @summary: Build packet to send and the expected packet.
+        @param probe_id: id to put into the payload of the packets
+        @return (packet, masked expected packet)
+        '''
+        if ipv4:
+            return self.build_ipv4_packets(sport, dport, ip_src, ip_dst, probe_id)
+        return self.build_ipv6_packets(sport, dport, ip_src, ip_dst, probe_id)
+
+    def build_ipv4_packets(self, sport, dport, ip_src, ip_dst, probe_id=None):
         src_mac = self.dataplane.get_mac(0, 0)
 
         pkt = simple_tcp_packet(
@@ -193,13 +352,13 @@ class HashTest(BaseTest):
                             tcp_sport=sport,
                             tcp_dport=dport,
                             ip_ttl=63)
+        if probe_id is not None:
+            probe.set_probe_id(pkt, scapy.TCP, probe_id)
+            probe.set_probe_id(exp_pkt, scapy.TCP, probe_id)
         masked_exp_pkt = Mask(exp_pkt)
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether, "dst")
 
-        send_packet(self, in_port, pkt)
-        logging.info("Sending packet from port " + str(in_port) + " to " + ip_dst)
-
-        return verify_packet_any_port(self, masked_exp_pkt, dst_port_list)
+        return pkt, masked_exp_pkt
     #---------------------------------------------------------------------
 
     def check_ipv6_route(self, in_port, sport, dport,
@@ -211,6 +370,15 @@ class HashTest(BaseTest):
         @param dst_port_list: list of ports on which to expect packet to come back from the switch
         @return Boolean
         '''
+        pkt, masked_exp_pkt = self.build_packets(sport, dport, ip_src, ip_dst, ipv4=False)
+
+        send_packet(self, in_port, pkt)
+        logging.info("Sending packet from port " + str(in_port) + " to " + ip_dst)
+
+        return verify_packet_any_port(self, masked_exp_pkt, dst_port_list)
+    #---------------------------------------------------------------------
+
+    def build_ipv6_packets(self, sport, dport, ip_src, ip_dst, probe_id=None):
         src_mac = self.dataplane.get_mac(0, 0)
 
         pkt = simple_tcpv6_packet(
@@ -228,13 +396,13 @@ class HashTest(BaseTest):
                                 tcp_sport=sport,
                                 tcp_dport=dport,
                                 ipv6_hlim=63)
+        if probe_id is not None:
+            probe.set_probe_id(pkt, scapy.TCP, probe_id)
+            probe.set_probe_id(exp_pkt, scapy.TCP, probe_id)
         masked_exp_pkt = Mask(exp_pkt)
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether,"dst")
 
-        send_packet(self, in_port, pkt)
-        logging.info("Sending packet from port " + str(in_port) + " to " + ip_dst)
-
-        return verify_packet_any_port(self, masked_exp_pkt, dst_port_list)
+        return pkt, masked_exp_pkt
     #---------------------------------------------------------------------
     def check_within_expected_range(self, actual, expected):
         '''
@@ -259,11 +427,32 @@ class HashTest(BaseTest):
 
         total_hit_cnt = sum(port_hit_cnt.values())
         for port in dest_port_list:
-            (p, r) = self.check_within_expected_range(port_hit_cnt[port], float(total_hit_cnt)/len(dest_port_list))
+            (p, r) = self.check_within_expected_range(port_hit_cnt.get(port, 0), float(total_hit_cnt)/len(dest_port_list))
             result &= r
 
+        (statistic, p_value) = self.check_uniformity(dest_port_list, port_hit_cnt)
+        logging.info("Chi-square statistic %.3f, p-value %.4f" % (statistic, p_value))
+        if self.chi_square_alpha is not None:
+            result &= p_value >= self.chi_square_alpha
+
         assert result
 
+    #---------------------------------------------------------------------
+    def check_uniformity(self, dest_port_list, port_hit_cnt):
+        '''
+        @summary: Pearson's chi-square test of the uniform distribution of the packets across the ports
+        @param dest_port_list : a list of ports
+        @param port_hit_cnt : a dict that records the number of packets each port received
+        @return (chi-square statistic, p-value)
+        '''
+        if len(dest_port_list) < 2:
+            return (0.0, 1.0)
+        expected = float(sum(port_hit_cnt.values())) / len(dest_port_list)
+        if not expected:
+            return (0.0, 1.0)
+        statistic = sum((port_hit_cnt.get(port, 0) - expected) ** 2 / expected for port in dest_port_list)
+        return (statistic, chi_square_p_value(statistic, len(dest_port_list) - 1))
+
     #---------------------------------------------------------------------
 
     def runTest(self):
@@ -275,4 +464,7 @@ class HashTest(BaseTest):
         # if (self.test_ipv4):
         #     self.check_hash()
         if (self.test_ipv6):
-            self.check_hash(ipv4=False)
+            if self.batched:
+                self.check_hash_batched(ipv4=False)
+            else:
+                self.check_hash(ipv4=False)
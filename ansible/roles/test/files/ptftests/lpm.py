@@ -1,6 +1,8 @@
 import random
+import socket
+import struct
+from array import array
 
-from ipaddress import ip_address, ip_network
 from SubnetTree import SubnetTree
 
 '''
@@ -18,17 +20,57 @@ sub-class IpInterval then could be used to get the first/last/random IP within
 this range. It could also check the length of the range and if an IP is within
 this range.
 
+Boundaries of the ranges are kept as integers and the sorted IPv4 boundaries
+are stored in an array, so ranges of large route tables take little memory.
+The ranges() function returns a lazy sequence which creates IpInterval objects
+on access. Use update() to load many prefixes at once.
+
 To achieve the LPM functionality, use the LpmDict as a dictionary and use
 [] operator to get the corresponding value using the key (IP).
 
 Please check the test_lpm.py file to see the details of how this class works.
 '''
+IPV4_BITS = 32
+IPV6_BITS = 128
+IPV4_MAX = (1 << IPV4_BITS) - 1
+IPV6_MAX = (1 << IPV6_BITS) - 1
+
+
+def ip_to_int(ip, ipv4=True):
+    if ipv4:
+        return struct.unpack('!I', socket.inet_pton(socket.AF_INET, ip))[0]
+    high, low = struct.unpack('!QQ', socket.inet_pton(socket.AF_INET6, ip))
+    return (high << 64) | low
+
+
+def int_to_ip(value, ipv4=True):
+    if ipv4:
+        return socket.inet_ntop(socket.AF_INET, struct.pack('!I', value))
+    return socket.inet_ntop(socket.AF_INET6, struct.pack('!QQ', value >> 64, value & 0xffffffffffffffff))
+
+
+def parse_prefix(prefix, ipv4=True):
+    '''
+    Parse prefix string into integers (first IP, prefix length, last IP).
+    Raise ValueError for malformed prefix or prefix with host bits set.
+    '''
+    address, _, prefixlen = prefix.partition('/')
+    bits = IPV4_BITS if ipv4 else IPV6_BITS
+    prefixlen = int(prefixlen) if prefixlen else bits
+    if not 0 <= prefixlen <= bits:
+        raise ValueError("%s has invalid prefix length" % prefix)
+    try:
+        first = ip_to_int(address, ipv4)
+    except socket.error:
+        raise ValueError("%s does not appear to be an IPv%d network" % (prefix, 4 if ipv4 else 6))
+    host_mask = (1 << (bits - prefixlen)) - 1
+    if first & host_mask:
+        raise ValueError("%s has host bits set" % prefix)
+    return first, prefixlen, first | host_mask
+
+
 class LpmDict():
     class IpInterval:
-        def __init__(self, s):
-            self._start = s
-            self._end = s
-
         def __init__(self, s, e):
             assert s <= e
             self._start = s
@@ -54,52 +96,102 @@ class LpmDict():
         def __str__(self):
             return str(self._start) + ' - ' + str(self._end)
 
+    class IntIpInterval(IpInterval):
+        '''
+        IpInterval with integer boundaries, IP strings are created only on access.
+        '''
+        def __init__(self, s, e, ipv4=True):
+            LpmDict.IpInterval.__init__(self, s, e)
+            self._ipv4 = ipv4
+
+        def length(self):
+            return self._end - self._start
+
+        def contains(self, ip):
+            if not isinstance(ip, (int, long)):
+                ip = ip_to_int(str(ip), self._ipv4)
+            return self._start <= ip <= self._end
+
+        def get_first_ip(self):
+            return int_to_ip(self._start, self._ipv4)
+
+        def get_last_ip(self):
+            return int_to_ip(self._end, self._ipv4)
+
+        def get_random_ip(self):
+            return int_to_ip(self._start + random.randint(0, self.length()), self._ipv4)
+
+        def __str__(self):
+            return self.get_first_ip() + ' - ' + self.get_last_ip()
+
+    class IpRanges:
+        '''
+        Read-only sequence of IP ranges defined by the sorted boundaries.
+        '''
+        def __init__(self, boundaries, ipv4=True):
+            # IPv6 boundaries don't fit into array items
+            self._boundaries = array('L', boundaries) if ipv4 else boundaries
+            self._ipv4 = ipv4
+            self._max = IPV4_MAX if ipv4 else IPV6_MAX
+
+        def __len__(self):
+            return len(self._boundaries)
+
+        def __getitem__(self, index):
+            if index < 0:
+                index += len(self._boundaries)
+            if not 0 <= index < len(self._boundaries):
+                raise IndexError("range index out of range")
+            end = self._boundaries[index + 1] - 1 if index + 1 < len(self._boundaries) else self._max
+            return LpmDict.IntIpInterval(self._boundaries[index], end, self._ipv4)
+
+        def __iter__(self):
+            for index in xrange(len(self._boundaries)):
+                yield self[index]
+
     def __init__(self, ipv4=True):
         self._ipv4 = ipv4
+        self._max = IPV4_MAX if ipv4 else IPV6_MAX
+        # prefixes are kept as integers (first_ip << 8 | prefix_length)
         self._prefix_set = set()
         self._subnet_tree = SubnetTree()
         # 0.0.0.0 is a non-routable meta-address that needs to be skipped
-        self._boundaries = { ip_address(u'0.0.0.0') : 1} if ipv4 else { ip_address(u'::') : 1}
+        self._boundaries = { 0 : 1 }
 
     def __setitem__(self, key, value):
-        prefix = ip_network(unicode(key))
+        first, prefixlen, last = parse_prefix(key, self._ipv4)
+        prefix = first << 8 | prefixlen
         # add the current key to self._prefix_set only when it is not the default route and it is not a duplicate key
-        if prefix.prefixlen and key not in self._prefix_set:
-            boundary = prefix[0]
-            self._boundaries[boundary] = self._boundaries.get(boundary, 0) + 1
-            if prefix[-1] != ip_address(u'255.255.255.255') and prefix[-1] != ip_address(u'ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff'):
-                next_boundary = prefix[-1] + 1
-                self._boundaries[next_boundary] = self._boundaries.get(next_boundary, 0) + 1
-            self._prefix_set.add(key)
-        self._subnet_tree.__setitem__(key, value)
+        if prefixlen and prefix not in self._prefix_set:
+            boundaries = self._boundaries
+            boundaries[first] = boundaries.get(first, 0) + 1
+            if last != self._max:
+                boundaries[last + 1] = boundaries.get(last + 1, 0) + 1
+            self._prefix_set.add(prefix)
+        self._subnet_tree[key] = value
+
+    def update(self, items):
+        '''
+        Bulk load of (prefix, value) pairs.
+        '''
+        for key, value in items:
+            self[key] = value
 
     def __getitem__(self, key):
         return self._subnet_tree[key]
 
     def __delitem__(self, key):
-        if '/0' not in key:
-            prefix = ip_network(unicode(key))
-            boundary = prefix[0]
-            next_boundary = prefix[-1] + 1
-            self._boundaries[boundary] = self._boundaries.get(boundary) - 1
-            if not self._boundaries[boundary]:
-                del self._boundaries[boundary]
-            self._boundaries[next_boundary] = self._boundaries.get(next_boundary) - 1
-            if not self._boundaries[next_boundary]:
-                del self._boundaries[next_boundary]
-            self._prefix_set.remove(key)
+        first, prefixlen, last = parse_prefix(key, self._ipv4)
+        if prefixlen:
+            boundaries = [first]
+            if last != self._max:
+                boundaries.append(last + 1)
+            for boundary in boundaries:
+                self._boundaries[boundary] = self._boundaries.get(boundary) - 1
+                if not self._boundaries[boundary]:
+                    del self._boundaries[boundary]
+            self._prefix_set.remove(first << 8 | prefixlen)
         self._subnet_tree.__delitem__(key)
 
     def ranges(self):
-        sorted_boundaries = sorted(self._boundaries.keys())
-        ranges = []
-        for index, boundary in enumerate(sorted_boundaries):
-            if index != len(sorted_boundaries) - 1:
-                interval = self.IpInterval(sorted_boundaries[index], sorted_boundaries[index + 1] - 1)
-            else:
-                if self._ipv4:
-                    interval = self.IpInterval(sorted_boundaries[index], ip_address(u'255.255.255.255'))
-                else:
-                    interval = self.IpInterval(sorted_boundaries[index], ip_address(u'ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff'))
-            ranges.append(interval)
-        return ranges
+        return self.IpRanges(sorted(self._boundaries), self._ipv4)
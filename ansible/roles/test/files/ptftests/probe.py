@@ -0,0 +1,80 @@
+'''
+Description:    Helpers for the tests which send probe packets in bursts instead of
+                one send/verify round trip per packet.
+
+                Every probe carries a unique id at the beginning of its L4 payload.
+                The received packets are matched back to the probes by this id, so
+                a burst of probes is verified in one receive loop.
+'''
+
+import time
+
+import ptf.packet as scapy
+import ptf.dataplane as dataplane
+
+from ptf.testutils import send_packet
+
+PROBE_MARKER = 'PTFPROBE'
+PROBE_ID_LEN = 10
+
+
+def set_probe_id(pkt, l4, probe_id):
+    '''
+    @summary: Put the probe id at the beginning of the packet payload keeping the packet length
+    @param pkt: scapy packet
+    @param l4: scapy layer class which payload is replaced, e.g. scapy.TCP
+    @param probe_id: integer id of the probe
+    '''
+    layer = pkt[l4]
+    length = len(layer.payload)
+    marker = "%s%0*d" % (PROBE_MARKER, PROBE_ID_LEN, probe_id)
+    layer.remove_payload()
+    layer.add_payload(scapy.Raw(marker + "\0" * max(0, length - len(marker))))
+
+
+def get_probe_id(pkt):
+    '''
+    @summary: Get the probe id from the payload of the received packet
+    @param pkt: received packet as string
+    @return: probe id or None
+    '''
+    pos = pkt.find(PROBE_MARKER)
+    if pos < 0:
+        return None
+    probe_id = pkt[pos + len(PROBE_MARKER):pos + len(PROBE_MARKER) + PROBE_ID_LEN]
+    return int(probe_id) if probe_id.isdigit() else None
+
+
+def send_probes(test, packets):
+    '''
+    @summary: Send a burst of probes
+    @param packets: list of (port, packet)
+    '''
+    for port, pkt in packets:
+        send_packet(test, port, pkt)
+
+
+def collect_probes(test, probes, timeout):
+    '''
+    @summary: Receive packets until all probes are received or timeout expires.
+    @param probes: dictionary {probe_id: (masked expected packet, list of expected ports)}
+    @param timeout: seconds to wait for the probes
+    @return: dictionary {probe_id: port} of the probes received at one of their expected ports
+    '''
+    received = {}
+    deadline = time.time() + timeout
+    while len(received) < len(probes):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        result = test.dataplane.poll(port_number=None, timeout=remaining)
+        if not isinstance(result, test.dataplane.PollSuccess):
+            break
+        probe_id = get_probe_id(result.packet)
+        if probe_id not in probes or probe_id in received:
+            continue
+        masked_exp_pkt, exp_port_list = probes[probe_id]
+        if result.port in exp_port_list and dataplane.match_exp_pkt(masked_exp_pkt, result.packet):
+            received[probe_id] = result.port
+
+    return received
@@ -9,6 +9,7 @@ import socket
 import ptf.dataplane as dataplane
 import sai_base_test
 import operator
+import struct
 import sys
 from ptf.testutils import (ptf_ports,
                            simple_arp_packet,
@@ -16,15 +17,17 @@ from ptf.testutils import (ptf_ports,
                            simple_tcp_packet,
                            simple_qinq_tcp_packet)
 from ptf.mask import Mask
+from traffic_burst import packet_template, send_burst
 from switch import (switch_init,
                     sai_thrift_create_scheduler_profile,
                     sai_thrift_clear_all_counters,
                     sai_thrift_read_port_counters,
                     sai_port_list,
                     port_list,
-                    sai_thrift_read_port_watermarks,
                     sai_thrift_read_pg_counters,
                     sai_thrift_read_buffer_pool_watermark,
+                    sai_thrift_read_counters_snapshot,
+                    sai_thrift_counters_delta,
                     sai_thrift_port_tx_disable,
                     sai_thrift_port_tx_enable)
 from switch_sai_thrift.ttypes import (sai_thrift_attribute_value_t,
@@ -55,6 +58,32 @@ STOP_PORT_MAX_RATE = 1
 RELEASE_PORT_MAX_RATE = 0
 ECN_INDEX_IN_HEADER = 53 # Fits the ptf hex_dump_buffer() parse function
 DSCP_INDEX_IN_HEADER = 52 # Fits the ptf hex_dump_buffer() parse function
+ETH_HDR_LEN = 14
+ETH_TYPE_IPV4 = '\x08\x00'
+ETH_TYPE_VLAN = '\x81\x00'
+VLAN_HDR_LEN = 4
+IPV4_HDR_LEN = 20
+# Number of the runs of the same dscp kept in the WRRtest order trace
+WRR_ORDER_TRACE_RUNS = 64
+
+def get_ip_frame_dscp(frame, ip_src, ip_dst, ip_id):
+    """
+    Return DSCP of the IPv4 frame with the addresses and the IP id, None for any other frame.
+    The fields are read at fixed offsets of the raw frame, no scapy packet is built.
+    @param ip_src, ip_dst: addresses packed by socket.inet_aton()
+    """
+    offset = ETH_HDR_LEN
+    eth_type = frame[offset - 2:offset]
+    if eth_type == ETH_TYPE_VLAN:
+        offset += VLAN_HDR_LEN
+        eth_type = frame[offset - 2:offset]
+    if eth_type != ETH_TYPE_IPV4 or len(frame) < offset + IPV4_HDR_LEN:
+        return None
+    if frame[offset + 12:offset + 16] != ip_src or frame[offset + 16:offset + 20] != ip_dst:
+        return None
+    if struct.unpack_from('!H', frame, offset + 4)[0] != ip_id:
+        return None
+    return ord(frame[offset + 1]) >> 2
 
 
 class ARPpopulate(sai_base_test.ThriftInterfaceDataPlane):
@@ -571,7 +600,7 @@ class PFCtest(sai_base_test.ThriftInterfaceDataPlane):
 
         try:
             # send packets short of triggering pfc
-            send_packet(self, src_port_id, pkt, pkts_num_leak_out + pkts_num_trig_pfc - 1 - margin)
+            send_burst(self, src_port_id, pkt, pkts_num_leak_out + pkts_num_trig_pfc - 1 - margin)
             # allow enough time for the dut to sync up the counter values in counters_db
             time.sleep(8)
             # get a snapshot of counter values at recv and transmit ports
@@ -586,7 +615,7 @@ class PFCtest(sai_base_test.ThriftInterfaceDataPlane):
             assert(xmit_counters[EGRESS_DROP] == xmit_counters_base[EGRESS_DROP])
 
             # send 1 packet to trigger pfc
-            send_packet(self, src_port_id, pkt, 1 + 2 * margin)
+            send_burst(self, src_port_id, pkt, 1 + 2 * margin)
             # allow enough time for the dut to sync up the counter values in counters_db
             time.sleep(8)
             # get a snapshot of counter values at recv and transmit ports
@@ -602,7 +631,7 @@ class PFCtest(sai_base_test.ThriftInterfaceDataPlane):
             assert(xmit_counters[EGRESS_DROP] == xmit_counters_base[EGRESS_DROP])
 
             # send packets short of ingress drop
-            send_packet(self, src_port_id, pkt, pkts_num_trig_ingr_drp - pkts_num_trig_pfc - 1 - 2 * margin)
+            send_burst(self, src_port_id, pkt, pkts_num_trig_ingr_drp - pkts_num_trig_pfc - 1 - 2 * margin)
             # allow enough time for the dut to sync up the counter values in counters_db
             time.sleep(8)
             # get a snapshot of counter values at recv and transmit ports
@@ -618,7 +647,7 @@ class PFCtest(sai_base_test.ThriftInterfaceDataPlane):
             assert(xmit_counters[EGRESS_DROP] == xmit_counters_base[EGRESS_DROP])
 
             # send 1 packet to trigger ingress drop
-            send_packet(self, src_port_id, pkt, 1 + 2 * margin)
+            send_burst(self, src_port_id, pkt, 1 + 2 * margin)
             # allow enough time for the dut to sync up the counter values in counters_db
             time.sleep(8)
             # get a snapshot of counter values at recv and transmit ports
@@ -697,7 +726,7 @@ class PFCXonTest(sai_base_test.ThriftInterfaceDataPlane):
                                     ip_dst=dst_port_ip,
                                     ip_tos=tos,
                                     ip_ttl=ttl)
-            send_packet(self, src_port_id, pkt, pkts_num_leak_out + pkts_num_trig_pfc - pkts_num_dismiss_pfc)
+            send_burst(self, src_port_id, pkt, pkts_num_leak_out + pkts_num_trig_pfc - pkts_num_dismiss_pfc)
             # send packets to dst port 1
             pkt = simple_tcp_packet(pktlen=default_packet_length,
                                     eth_dst=router_mac if router_mac != '' else dst_port_2_mac,
@@ -706,7 +735,7 @@ class PFCXonTest(sai_base_test.ThriftInterfaceDataPlane):
                                     ip_dst=dst_port_2_ip,
                                     ip_tos=tos,
                                     ip_ttl=ttl)
-            send_packet(self, src_port_id, pkt, pkts_num_leak_out + margin + pkts_num_dismiss_pfc - 1)
+            send_burst(self, src_port_id, pkt, pkts_num_leak_out + margin + pkts_num_dismiss_pfc - 1)
             # send 1 packet to dst port 2
             pkt = simple_tcp_packet(pktlen=default_packet_length,
                                     eth_dst=router_mac if router_mac != '' else dst_port_3_mac,
@@ -715,7 +744,7 @@ class PFCXonTest(sai_base_test.ThriftInterfaceDataPlane):
                                     ip_dst=dst_port_3_ip,
                                     ip_tos=tos,
                                     ip_ttl=ttl)
-            send_packet(self, src_port_id, pkt, pkts_num_leak_out + 1)
+            send_burst(self, src_port_id, pkt, pkts_num_leak_out + 1)
 
             # allow enough time for the dut to sync up the counter values in counters_db
             time.sleep(8)
@@ -841,6 +870,14 @@ class HdrmPoolSizeTest(sai_base_test.ThriftInterfaceDataPlane):
     def tearDown(self):
         sai_base_test.ThriftInterfaceDataPlane.tearDown(self)
 
+    def read_port_counters_delta(self, counters_base, port):
+        """
+        Return the port counters of the port accumulated since counters_base snapshot,
+        in the order of sai_thrift_read_port_counters
+        """
+        snapshot = sai_thrift_read_counters_snapshot(self.client, [port], queues=False, pgs=False)
+        return sai_thrift_counters_delta(counters_base, snapshot)['ports'][port]['port']
+
     def runTest(self):
         margin = 0
         sidx_dscp_pg_tuples = [(sidx, dscp, self.pgs[pgidx]) for sidx, sid in enumerate(self.src_port_ids) for pgidx, dscp in enumerate(self.dscps)]
@@ -848,10 +885,27 @@ class HdrmPoolSizeTest(sai_base_test.ThriftInterfaceDataPlane):
         print >> sys.stderr, sidx_dscp_pg_tuples
         sys.stderr.flush()
 
+        # Prepare TCP packet data of every pg once, the same packets are sent in all phases
+        pkts = []
+        for i in range(0, self.pgs_num):
+            tos = sidx_dscp_pg_tuples[i][1] << 2
+            tos |= self.ecn
+            ttl = 64
+            default_packet_length = 64
+            pkt = simple_tcp_packet(pktlen=default_packet_length,
+                                    eth_dst=self.router_mac if self.router_mac != '' else self.dst_port_mac,
+                                    eth_src=self.src_port_macs[sidx_dscp_pg_tuples[i][0]],
+                                    ip_src=self.src_port_ips[sidx_dscp_pg_tuples[i][0]],
+                                    ip_dst=self.dst_port_ip,
+                                    ip_tos=tos,
+                                    ip_ttl=ttl)
+            pkts.append(packet_template(pkt))
+
         # get a snapshot of counter values at recv and transmit ports
-        # queue_counters value is not of our interest here
-        recv_counters_bases = [sai_thrift_read_port_counters(self.client, port_list[sid])[0] for sid in self.src_port_ids]
-        xmit_counters_base, queue_counters = sai_thrift_read_port_counters(self.client, port_list[self.dst_port_id])
+        # queue and pg counters are not of our interest here
+        src_ports = [port_list[sid] for sid in self.src_port_ids]
+        dst_port = port_list[self.dst_port_id]
+        counters_base = sai_thrift_read_counters_snapshot(self.client, src_ports + [dst_port], queues=False, pgs=False)
 
         # Pause egress of dut xmit port
         sai_thrift_port_tx_disable(self.client, self.asic_type, [self.dst_port_id])
@@ -865,24 +919,12 @@ class HdrmPoolSizeTest(sai_base_test.ThriftInterfaceDataPlane):
                         ip_src=self.src_port_ips[sidx],
                         ip_dst=self.dst_port_ip,
                         ip_ttl=64)
-            send_packet(self, self.src_port_ids[sidx], pkt, self.pkts_num_leak_out)
+            send_burst(self, self.src_port_ids[sidx], pkt, self.pkts_num_leak_out)
 
             # send packets to all pgs to fill the service pool
             # and trigger PFC on all pgs
             for i in range(0, self.pgs_num):
-                # Prepare TCP packet data
-                tos = sidx_dscp_pg_tuples[i][1] << 2
-                tos |= self.ecn
-                ttl = 64
-                default_packet_length = 64
-                pkt = simple_tcp_packet(pktlen=default_packet_length,
-                                        eth_dst=self.router_mac if self.router_mac != '' else self.dst_port_mac,
-                                        eth_src=self.src_port_macs[sidx_dscp_pg_tuples[i][0]],
-                                        ip_src=self.src_port_ips[sidx_dscp_pg_tuples[i][0]],
-                                        ip_dst=self.dst_port_ip,
-                                        ip_tos=tos,
-                                        ip_ttl=ttl)
-                send_packet(self, self.src_port_ids[sidx_dscp_pg_tuples[i][0]], pkt, self.pkts_num_trig_pfc)
+                send_burst(self, self.src_port_ids[sidx_dscp_pg_tuples[i][0]], pkts[i], self.pkts_num_trig_pfc)
 
             print >> sys.stderr, "Service pool almost filled"
             sys.stderr.flush()
@@ -890,34 +932,21 @@ class HdrmPoolSizeTest(sai_base_test.ThriftInterfaceDataPlane):
             time.sleep(8)
 
             for i in range(0, self.pgs_num):
-                # Prepare TCP packet data
-                tos = sidx_dscp_pg_tuples[i][1] << 2
-                tos |= self.ecn
-                ttl = 64
-                default_packet_length = 64
-                pkt = simple_tcp_packet(pktlen=default_packet_length,
-                                        eth_dst=self.router_mac if self.router_mac != '' else self.dst_port_mac,
-                                        eth_src=self.src_port_macs[sidx_dscp_pg_tuples[i][0]],
-                                        ip_src=self.src_port_ips[sidx_dscp_pg_tuples[i][0]],
-                                        ip_dst=self.dst_port_ip,
-                                        ip_tos=tos,
-                                        ip_ttl=ttl)
                 pkt_cnt = 0
 
-                recv_counters, queue_counters = sai_thrift_read_port_counters(self.client, port_list[self.src_port_ids[sidx_dscp_pg_tuples[i][0]]])
-                while (recv_counters[sidx_dscp_pg_tuples[i][2]] == recv_counters_bases[sidx_dscp_pg_tuples[i][0]][sidx_dscp_pg_tuples[i][2]]) and (pkt_cnt < 10):
-                    send_packet(self, self.src_port_ids[sidx_dscp_pg_tuples[i][0]], pkt, 1)
+                recv_counters = self.read_port_counters_delta(counters_base, src_ports[sidx_dscp_pg_tuples[i][0]])
+                while (recv_counters[sidx_dscp_pg_tuples[i][2]] == 0) and (pkt_cnt < 10):
+                    send_burst(self, self.src_port_ids[sidx_dscp_pg_tuples[i][0]], pkts[i], 1)
                     pkt_cnt += 1
                     # allow enough time for the dut to sync up the counter values in counters_db
                     time.sleep(8)
 
-                    # get a snapshot of counter values at recv and transmit ports
-                    # queue_counters value is not of our interest here
-                    recv_counters, queue_counters = sai_thrift_read_port_counters(self.client, port_list[self.src_port_ids[sidx_dscp_pg_tuples[i][0]]])
+                    # get a snapshot of counter values at recv port
+                    recv_counters = self.read_port_counters_delta(counters_base, src_ports[sidx_dscp_pg_tuples[i][0]])
 
                 if pkt_cnt == 10:
                     sys.exit("Too many pkts needed to trigger pfc: %d" % (pkt_cnt))
-                assert(recv_counters[sidx_dscp_pg_tuples[i][2]] > recv_counters_bases[sidx_dscp_pg_tuples[i][0]][sidx_dscp_pg_tuples[i][2]])
+                assert(recv_counters[sidx_dscp_pg_tuples[i][2]] > 0)
                 print >> sys.stderr, "%d packets for sid: %d, pg: %d to trigger pfc" % (pkt_cnt, self.src_port_ids[sidx_dscp_pg_tuples[i][0]], sidx_dscp_pg_tuples[i][2] - 2)
                 sys.stderr.flush()
 
@@ -926,26 +955,13 @@ class HdrmPoolSizeTest(sai_base_test.ThriftInterfaceDataPlane):
 
             # send packets to all pgs to fill the headroom pool
             for i in range(0, self.pgs_num):
-                # Prepare TCP packet data
-                tos = sidx_dscp_pg_tuples[i][1] << 2
-                tos |= self.ecn
-                ttl = 64
-                default_packet_length = 64
-                pkt = simple_tcp_packet(pktlen=default_packet_length,
-                                        eth_dst=self.router_mac if self.router_mac != '' else self.dst_port_mac,
-                                        eth_src=self.src_port_macs[sidx_dscp_pg_tuples[i][0]],
-                                        ip_src=self.src_port_ips[sidx_dscp_pg_tuples[i][0]],
-                                        ip_dst=self.dst_port_ip,
-                                        ip_tos=tos,
-                                        ip_ttl=ttl)
-
-                send_packet(self, self.src_port_ids[sidx_dscp_pg_tuples[i][0]], pkt, self.pkts_num_hdrm_full if i != self.pgs_num - 1 else self.pkts_num_hdrm_partial)
+                send_burst(self, self.src_port_ids[sidx_dscp_pg_tuples[i][0]], pkts[i], self.pkts_num_hdrm_full if i != self.pgs_num - 1 else self.pkts_num_hdrm_partial)
                 # allow enough time for the dut to sync up the counter values in counters_db
                 time.sleep(8)
 
-                recv_counters, queue_counters = sai_thrift_read_port_counters(self.client, port_list[self.src_port_ids[sidx_dscp_pg_tuples[i][0]]])
+                recv_counters = self.read_port_counters_delta(counters_base, src_ports[sidx_dscp_pg_tuples[i][0]])
                 # assert no ingress drop
-                assert(recv_counters[INGRESS_DROP] == recv_counters_bases[sidx_dscp_pg_tuples[i][0]][INGRESS_DROP])
+                assert(recv_counters[INGRESS_DROP] == 0)
 
             print >> sys.stderr, "all but the last pg hdrms filled"
             sys.stderr.flush()
@@ -953,16 +969,16 @@ class HdrmPoolSizeTest(sai_base_test.ThriftInterfaceDataPlane):
             # last pg
             i = self.pgs_num - 1
             # send 1 packet on last pg to trigger ingress drop
-            send_packet(self, self.src_port_ids[sidx_dscp_pg_tuples[i][0]], pkt, 1 + 2 * margin)
+            send_burst(self, self.src_port_ids[sidx_dscp_pg_tuples[i][0]], pkts[i], 1 + 2 * margin)
             # allow enough time for the dut to sync up the counter values in counters_db
             time.sleep(8)
-            recv_counters, queue_counters = sai_thrift_read_port_counters(self.client, port_list[self.src_port_ids[sidx_dscp_pg_tuples[i][0]]])
+            recv_counters = self.read_port_counters_delta(counters_base, src_ports[sidx_dscp_pg_tuples[i][0]])
             # assert ingress drop
-            assert(recv_counters[INGRESS_DROP] > recv_counters_bases[sidx_dscp_pg_tuples[i][0]][INGRESS_DROP])
+            assert(recv_counters[INGRESS_DROP] > 0)
 
             # assert no egress drop at the dut xmit port
-            xmit_counters, queue_counters = sai_thrift_read_port_counters(self.client, port_list[self.dst_port_id])
-            assert(xmit_counters[EGRESS_DROP] == xmit_counters_base[EGRESS_DROP])
+            xmit_counters = self.read_port_counters_delta(counters_base, dst_port)
+            assert(xmit_counters[EGRESS_DROP] == 0)
 
             print >> sys.stderr, "pg hdrm filled"
             sys.stderr.flush()
@@ -1135,102 +1151,35 @@ class WRRtest(sai_base_test.ThriftInterfaceDataPlane):
                     ip_src=src_port_ip,
                     ip_dst=dst_port_ip,
                     ip_ttl=64)
-        send_packet(self, src_port_id, pkt, pkts_num_leak_out)
+        send_burst(self, src_port_id, pkt, pkts_num_leak_out)
 
         # Get a snapshot of counter values
         port_counters_base, queue_counters_base = sai_thrift_read_port_counters(self.client, port_list[dst_port_id])
 
         # Send packets to each queue based on dscp field
-        dscp = 3
-        tos = dscp << 2
-        tos |= ecn
-        pkt = simple_tcp_packet(pktlen=default_packet_length,
-                    eth_dst=router_mac if router_mac != '' else dst_port_mac,
-                    eth_src=src_port_mac,
-                    ip_src=src_port_ip,
-                    ip_dst=dst_port_ip,
-                    ip_tos=tos,
-                    ip_id=exp_ip_id,
-                    ip_ttl=64)
-        send_packet(self, src_port_id, pkt, queue_3_num_of_pkts)
-
-        dscp = 4
-        tos = dscp << 2
-        tos |= ecn
-        pkt = simple_tcp_packet(pktlen=default_packet_length,
-                    eth_dst=router_mac if router_mac != '' else dst_port_mac,
-                    eth_src=src_port_mac,
-                    ip_src=src_port_ip,
-                    ip_dst=dst_port_ip,
-                    ip_tos=tos,
-                    ip_id=exp_ip_id,
-                    ip_ttl=64)
-        send_packet(self, src_port_id, pkt, queue_4_num_of_pkts)
-
-        dscp = 8
-        tos = dscp << 2
-        tos |= ecn
-        pkt = simple_tcp_packet(pktlen=default_packet_length,
-                    eth_dst=router_mac if router_mac != '' else dst_port_mac,
-                    eth_src=src_port_mac,
-                    ip_src=src_port_ip,
-                    ip_dst=dst_port_ip,
-                    ip_tos=tos,
-                    ip_id=exp_ip_id,
-                    ip_ttl=64)
-        send_packet(self, src_port_id, pkt, queue_0_num_of_pkts)
-
-        dscp = 0
-        tos = dscp << 2
-        tos |= ecn
-        pkt = simple_tcp_packet(pktlen=default_packet_length,
-                    eth_dst=router_mac if router_mac != '' else dst_port_mac,
-                    eth_src=src_port_mac,
-                    ip_src=src_port_ip,
-                    ip_dst=dst_port_ip,
-                    ip_tos=tos,
-                    ip_id=exp_ip_id,
-                    ip_ttl=64)
-        send_packet(self, src_port_id, pkt, queue_1_num_of_pkts)
-
-        dscp = 5
-        tos = dscp << 2
-        tos |= ecn
-        pkt = simple_tcp_packet(pktlen=default_packet_length,
-                    eth_dst=router_mac if router_mac != '' else dst_port_mac,
-                    eth_src=src_port_mac,
-                    ip_src=src_port_ip,
-                    ip_dst=dst_port_ip,
-                    ip_tos=tos,
-                    ip_id=exp_ip_id,
-                    ip_ttl=64)
-        send_packet(self, src_port_id, pkt, queue_2_num_of_pkts)
-
-        dscp = 46
-        tos = dscp << 2
-        tos |= ecn
-        pkt = simple_tcp_packet(pktlen=default_packet_length,
-                    eth_dst=router_mac if router_mac != '' else dst_port_mac,
-                    eth_src=src_port_mac,
-                    ip_src=src_port_ip,
-                    ip_dst=dst_port_ip,
-                    ip_tos=tos,
-                    ip_id=exp_ip_id,
-                    ip_ttl=64)
-        send_packet(self, src_port_id, pkt, queue_5_num_of_pkts)
+        # The packets of all queues are prepared before sending, so the queues are filled back to back
+        pkts = []
+        for dscp, num_of_pkts in [(3, queue_3_num_of_pkts),
+                                  (4, queue_4_num_of_pkts),
+                                  (8, queue_0_num_of_pkts),
+                                  (0, queue_1_num_of_pkts),
+                                  (5, queue_2_num_of_pkts),
+                                  (46, queue_5_num_of_pkts),
+                                  (48, queue_6_num_of_pkts)]:
+            tos = dscp << 2
+            tos |= ecn
+            pkt = simple_tcp_packet(pktlen=default_packet_length,
+                        eth_dst=router_mac if router_mac != '' else dst_port_mac,
+                        eth_src=src_port_mac,
+                        ip_src=src_port_ip,
+                        ip_dst=dst_port_ip,
+                        ip_tos=tos,
+                        ip_id=exp_ip_id,
+                        ip_ttl=64)
+            pkts.append((packet_template(pkt), num_of_pkts))
 
-        dscp = 48
-        tos = dscp << 2
-        tos |= ecn
-        pkt = simple_tcp_packet(pktlen=default_packet_length,
-                    eth_dst=router_mac if router_mac != '' else dst_port_mac,
-                    eth_src=src_port_mac,
-                    ip_src=src_port_ip,
-                    ip_dst=dst_port_ip,
-                    ip_tos=tos,
-                    ip_id=exp_ip_id,
-                    ip_ttl=64)
-        send_packet(self, src_port_id, pkt, queue_6_num_of_pkts)
+        for pkt, num_of_pkts in pkts:
+            send_burst(self, src_port_id, pkt, num_of_pkts)
 
         # Set receiving socket buffers to some big value
         for p in self.dataplane.ports.values():
@@ -1239,26 +1188,8 @@ class WRRtest(sai_base_test.ThriftInterfaceDataPlane):
         # Release port
         sai_thrift_port_tx_enable(self.client, asic_type, [dst_port_id])
 
-        cnt = 0
-        pkts = []
-        recv_pkt = scapy.Ether()
-
-        while recv_pkt:
-            received = self.dataplane.poll(device_number=0, port_number=dst_port_id, timeout=2)
-            if isinstance(received, self.dataplane.PollFailure):
-                recv_pkt = None
-                break
-            recv_pkt = scapy.Ether(received.packet)
-
-            try:
-                if recv_pkt.payload.src == src_port_ip and recv_pkt.payload.dst == dst_port_ip and recv_pkt.payload.id == exp_ip_id:
-                    cnt += 1
-                    pkts.append(recv_pkt)
-            except AttributeError:
-                continue
-
-        queue_pkt_counters = [0] * 49
-        queue_num_of_pkts  = [0] * 49
+        queue_pkt_counters = [0] * 64
+        queue_num_of_pkts  = [0] * 64
         queue_num_of_pkts[8]  = queue_0_num_of_pkts
         queue_num_of_pkts[0]  = queue_1_num_of_pkts
         queue_num_of_pkts[5]  = queue_2_num_of_pkts
@@ -1267,18 +1198,48 @@ class WRRtest(sai_base_test.ThriftInterfaceDataPlane):
         queue_num_of_pkts[46] = queue_5_num_of_pkts
         queue_num_of_pkts[48] = queue_6_num_of_pkts
         total_pkts = 0
-
-        for pkt_to_inspect in pkts:
-            dscp_of_pkt = pkt_to_inspect.payload.tos >> 2
+        # Bounded trace of the order of the received packets: the first WRR_ORDER_TRACE_RUNS runs
+        # as [dscp, number of packets received in a row], the number of runs of every dscp
+        # and the order in which the dscps have been received completely
+        order_trace = []
+        dscp_runs = [0] * 64
+        completion_order = []
+        last_dscp = None
+        runs = 0
+
+        # Classify the packets from the raw bytes as they are received, keep only the counters
+        # and the order trace, so the loop keeps up with the released queues
+        ip_src = socket.inet_aton(src_port_ip)
+        ip_dst = socket.inet_aton(dst_port_ip)
+        while True:
+            received = self.dataplane.poll(device_number=0, port_number=dst_port_id, timeout=2)
+            if isinstance(received, self.dataplane.PollFailure):
+                break
+            dscp_of_pkt = get_ip_frame_dscp(received.packet, ip_src, ip_dst, exp_ip_id)
+            if dscp_of_pkt is None:
+                continue
             total_pkts += 1
+            if dscp_of_pkt != last_dscp:
+                last_dscp = dscp_of_pkt
+                dscp_runs[dscp_of_pkt] += 1
+                runs += 1
+                if runs <= WRR_ORDER_TRACE_RUNS:
+                    order_trace.append([dscp_of_pkt, 1])
+            elif runs <= WRR_ORDER_TRACE_RUNS:
+                order_trace[-1][1] += 1
 
             # Count packet ordering
 
             queue_pkt_counters[dscp_of_pkt] += 1
             if queue_pkt_counters[dscp_of_pkt] == queue_num_of_pkts[dscp_of_pkt]:
+                 completion_order.append(dscp_of_pkt)
+                 print >> sys.stderr, queue_pkt_counters
                  assert((queue_0_num_of_pkts + queue_1_num_of_pkts + queue_2_num_of_pkts + queue_3_num_of_pkts + queue_4_num_of_pkts + queue_5_num_of_pkts + queue_6_num_of_pkts) - total_pkts < limit)
 
-            print >> sys.stderr, queue_pkt_counters
+        print >> sys.stderr, queue_pkt_counters
+        print >> sys.stderr, "order of received dscps, first %d of %d runs [dscp, packets in a row]: %s" % (len(order_trace), runs, order_trace)
+        print >> sys.stderr, "runs of received dscps {dscp: runs}: %s" % dict((dscp, n) for dscp, n in enumerate(dscp_runs) if n)
+        print >> sys.stderr, "order of completely received dscps: %s" % completion_order
 
         # Read counters
         print "DST port counters: "
@@ -1338,7 +1299,7 @@ class LossyQueueTest(sai_base_test.ThriftInterfaceDataPlane):
 
         try:
             # send packets short of triggering egress drop
-            send_packet(self, src_port_id, pkt, pkts_num_leak_out + pkts_num_trig_egr_drp - 1 - margin)
+            send_burst(self, src_port_id, pkt, pkts_num_leak_out + pkts_num_trig_egr_drp - 1 - margin)
             # allow enough time for the dut to sync up the counter values in counters_db
             time.sleep(8)
             # get a snapshot of counter values at recv and transmit ports
@@ -1353,7 +1314,7 @@ class LossyQueueTest(sai_base_test.ThriftInterfaceDataPlane):
             assert(xmit_counters[EGRESS_DROP] == xmit_counters_base[EGRESS_DROP])
 
             # send 1 packet to trigger egress drop
-            send_packet(self, src_port_id, pkt, 1 + 2 * margin)
+            send_burst(self, src_port_id, pkt, 1 + 2 * margin)
             # allow enough time for the dut to sync up the counter values in counters_db
             time.sleep(8)
             # get a snapshot of counter values at recv and transmit ports
@@ -1412,6 +1373,7 @@ class PGSharedWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
         # or the leak out is simply less than expected as we have occasionally observed
         margin = 2
 
+        src_port = port_list[src_port_id]
         sai_thrift_port_tx_disable(self.client, asic_type, [dst_port_id])
 
         # send packets
@@ -1419,9 +1381,9 @@ class PGSharedWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
             # send packets to fill pg min but not trek into shared pool
             # so if pg min is zero, it directly treks into shared pool by 1
             # this is the case for lossy traffic
-            send_packet(self, src_port_id, pkt, pkts_num_leak_out + pkts_num_fill_min)
+            send_burst(self, src_port_id, pkt, pkts_num_leak_out + pkts_num_fill_min)
             time.sleep(8)
-            q_wm_res, pg_shared_wm_res, pg_headroom_wm_res = sai_thrift_read_port_watermarks(self.client, port_list[src_port_id])
+            pg_shared_wm_res = sai_thrift_read_counters_snapshot(self.client, [src_port], port_stats=False, queues=False)['ports'][src_port]['pg_shared_wm']
             print >> sys.stderr, "Init pkts num sent: %d, min: %d, actual watermark value to start: %d" % ((pkts_num_leak_out + pkts_num_fill_min), pkts_num_fill_min, pg_shared_wm_res[pg])
             if pkts_num_fill_min:
                 assert(pg_shared_wm_res[pg] == 0)
@@ -1447,9 +1409,9 @@ class PGSharedWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
                     expected_wm = total_shared
                 print >> sys.stderr, "pkts num to send: %d, total pkts: %d, pg shared: %d" % (pkts_num, expected_wm, total_shared)
 
-                send_packet(self, src_port_id, pkt, pkts_num)
+                send_burst(self, src_port_id, pkt, pkts_num)
                 time.sleep(8)
-                q_wm_res, pg_shared_wm_res, pg_headroom_wm_res = sai_thrift_read_port_watermarks(self.client, port_list[src_port_id])
+                pg_shared_wm_res = sai_thrift_read_counters_snapshot(self.client, [src_port], port_stats=False, queues=False)['ports'][src_port]['pg_shared_wm']
                 print >> sys.stderr, "lower bound: %d, actual value: %d, upper bound (+%d): %d" % (expected_wm * cell_size, pg_shared_wm_res[pg], margin, (expected_wm + margin) * cell_size)
                 assert(pg_shared_wm_res[pg] <= (expected_wm + margin) * cell_size)
                 assert(expected_wm * cell_size <= pg_shared_wm_res[pg])
@@ -1457,9 +1419,9 @@ class PGSharedWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
                 pkts_num = pkts_inc
 
             # overflow the shared pool
-            send_packet(self, src_port_id, pkt, pkts_num)
+            send_burst(self, src_port_id, pkt, pkts_num)
             time.sleep(8)
-            q_wm_res, pg_shared_wm_res, pg_headroom_wm_res = sai_thrift_read_port_watermarks(self.client, port_list[src_port_id])
+            pg_shared_wm_res = sai_thrift_read_counters_snapshot(self.client, [src_port], port_stats=False, queues=False)['ports'][src_port]['pg_shared_wm']
             print >> sys.stderr, "exceeded pkts num sent: %d, expected watermark: %d, actual value: %d" % (pkts_num, (expected_wm * cell_size), pg_shared_wm_res[pg])
             assert(expected_wm == total_shared)
             assert(expected_wm * cell_size <= pg_shared_wm_res[pg])
@@ -1510,14 +1472,15 @@ class PGHeadroomWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
         # or the leak out is simply less than expected as we have occasionally observed
         margin = 0
 
+        src_port = port_list[src_port_id]
         sai_thrift_port_tx_disable(self.client, asic_type, [dst_port_id])
 
         # send packets
         try:
             # send packets to trigger pfc but not trek into headroom
-            send_packet(self, src_port_id, pkt, pkts_num_leak_out + pkts_num_trig_pfc)
+            send_burst(self, src_port_id, pkt, pkts_num_leak_out + pkts_num_trig_pfc)
             time.sleep(8)
-            q_wm_res, pg_shared_wm_res, pg_headroom_wm_res = sai_thrift_read_port_watermarks(self.client, port_list[src_port_id])
+            pg_headroom_wm_res = sai_thrift_read_counters_snapshot(self.client, [src_port], port_stats=False, queues=False)['ports'][src_port]['pg_headroom_wm']
             assert(pg_headroom_wm_res[pg] == 0)
 
             # send packet batch of fixed packet numbers to fill pg headroom
@@ -1533,9 +1496,9 @@ class PGHeadroomWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
                     expected_wm = total_hdrm
                 print >> sys.stderr, "pkts num to send: %d, total pkts: %d, pg headroom: %d" % (pkts_num, expected_wm, total_hdrm)
 
-                send_packet(self, src_port_id, pkt, pkts_num)
+                send_burst(self, src_port_id, pkt, pkts_num)
                 time.sleep(8)
-                q_wm_res, pg_shared_wm_res, pg_headroom_wm_res = sai_thrift_read_port_watermarks(self.client, port_list[src_port_id])
+                pg_headroom_wm_res = sai_thrift_read_counters_snapshot(self.client, [src_port], port_stats=False, queues=False)['ports'][src_port]['pg_headroom_wm']
                 print >> sys.stderr, "lower bound: %d, actual value: %d, upper bound: %d" % ((expected_wm - margin) * cell_size, pg_headroom_wm_res[pg], (expected_wm * cell_size))
                 assert(pg_headroom_wm_res[pg] <= expected_wm * cell_size)
                 assert((expected_wm - margin) * cell_size <= pg_headroom_wm_res[pg])
@@ -1543,9 +1506,9 @@ class PGHeadroomWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
                 pkts_num = pkts_inc
 
             # overflow the headroom
-            send_packet(self, src_port_id, pkt, pkts_num)
+            send_burst(self, src_port_id, pkt, pkts_num)
             time.sleep(8)
-            q_wm_res, pg_shared_wm_res, pg_headroom_wm_res = sai_thrift_read_port_watermarks(self.client, port_list[src_port_id])
+            pg_headroom_wm_res = sai_thrift_read_counters_snapshot(self.client, [src_port], port_stats=False, queues=False)['ports'][src_port]['pg_headroom_wm']
             print >> sys.stderr, "exceeded pkts num sent: %d, actual value: %d, expected watermark: %d" % (pkts_num, pg_headroom_wm_res[pg], (expected_wm * cell_size))
             assert(expected_wm == total_hdrm)
             assert(pg_headroom_wm_res[pg] == expected_wm * cell_size)
@@ -1598,6 +1561,7 @@ class QSharedWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
         # shared test, so the margin here actually means extra capacity margin
         margin = 8
 
+        dst_port = port_list[dst_port_id]
         sai_thrift_port_tx_disable(self.client, asic_type, [dst_port_id])
 
         # send packets
@@ -1606,9 +1570,9 @@ class QSharedWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
             # so if queue min is zero, it will directly trek into shared pool by 1
             # TH2 uses scheduler-based TX enable, this does not require sending packets
             # to leak out
-            send_packet(self, src_port_id, pkt, pkts_num_leak_out + pkts_num_fill_min)
+            send_burst(self, src_port_id, pkt, pkts_num_leak_out + pkts_num_fill_min)
             time.sleep(8)
-            q_wm_res, pg_shared_wm_res, pg_headroom_wm_res = sai_thrift_read_port_watermarks(self.client, port_list[dst_port_id])
+            q_wm_res = sai_thrift_read_counters_snapshot(self.client, [dst_port], port_stats=False, pgs=False)['ports'][dst_port]['queue_wm']
             print >> sys.stderr, "Init pkts num sent: %d, min: %d, actual watermark value to start: %d" % ((pkts_num_leak_out + pkts_num_fill_min), pkts_num_fill_min, q_wm_res[queue])
             if pkts_num_fill_min:
                 assert(q_wm_res[queue] == 0)
@@ -1628,9 +1592,9 @@ class QSharedWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
                     expected_wm = total_shared
                 print >> sys.stderr, "pkts num to send: %d, total pkts: %d, queue shared: %d" % (pkts_num, expected_wm, total_shared)
 
-                send_packet(self, src_port_id, pkt, pkts_num)
+                send_burst(self, src_port_id, pkt, pkts_num)
                 time.sleep(8)
-                q_wm_res, pg_shared_wm_res, pg_headroom_wm_res = sai_thrift_read_port_watermarks(self.client, port_list[dst_port_id])
+                q_wm_res = sai_thrift_read_counters_snapshot(self.client, [dst_port], port_stats=False, pgs=False)['ports'][dst_port]['queue_wm']
                 print >> sys.stderr, "lower bound: %d, actual value: %d, upper bound: %d" % (expected_wm * cell_size, q_wm_res[queue], (expected_wm * cell_size))
                 assert(q_wm_res[queue] <= expected_wm * cell_size)
                 assert(expected_wm * cell_size <= q_wm_res[queue])
@@ -1638,9 +1602,9 @@ class QSharedWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
                 pkts_num = pkts_inc
 
             # overflow the shared pool
-            send_packet(self, src_port_id, pkt, pkts_num)
+            send_burst(self, src_port_id, pkt, pkts_num)
             time.sleep(8)
-            q_wm_res, pg_shared_wm_res, pg_headroom_wm_res = sai_thrift_read_port_watermarks(self.client, port_list[dst_port_id])
+            q_wm_res = sai_thrift_read_counters_snapshot(self.client, [dst_port], port_stats=False, pgs=False)['ports'][dst_port]['queue_wm']
             print >> sys.stderr, "exceeded pkts num sent: %d, expected watermark: %d, actual value: %d" % (pkts_num, (expected_wm * cell_size), q_wm_res[queue])
             assert(expected_wm == total_shared)
             assert(expected_wm * cell_size <= q_wm_res[queue])
@@ -1723,7 +1687,7 @@ class BufferPoolWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
             # TH2 uses scheduler-based TX enable, this does not require sending packets to leak out
             sai_thrift_port_tx_disable(self.client, asic_type, [dst_port_id])
             pkts_num_to_send += (pkts_num_leak_out + pkts_num_fill_min)
-            send_packet(self, src_port_id, pkt, pkts_num_to_send)
+            send_burst(self, src_port_id, pkt, pkts_num_to_send)
             sai_thrift_port_tx_enable(self.client, asic_type, [dst_port_id])
             time.sleep(8)
             buffer_pool_wm = sai_thrift_read_buffer_pool_watermark(self.client, buf_pool_roid)
@@ -1753,7 +1717,7 @@ class BufferPoolWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
 
                 sai_thrift_port_tx_disable(self.client, asic_type, [dst_port_id])
                 pkts_num_to_send += pkts_num
-                send_packet(self, src_port_id, pkt, pkts_num_to_send)
+                send_burst(self, src_port_id, pkt, pkts_num_to_send)
                 sai_thrift_port_tx_enable(self.client, asic_type, [dst_port_id])
                 time.sleep(8)
                 buffer_pool_wm = sai_thrift_read_buffer_pool_watermark(self.client, buf_pool_roid)
@@ -1766,7 +1730,7 @@ class BufferPoolWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
             # overflow the shared pool
             sai_thrift_port_tx_disable(self.client, asic_type, [dst_port_id])
             pkts_num_to_send += pkts_num
-            send_packet(self, src_port_id, pkt, pkts_num_to_send)
+            send_burst(self, src_port_id, pkt, pkts_num_to_send)
             sai_thrift_port_tx_enable(self.client, asic_type, [dst_port_id])
             time.sleep(8)
             buffer_pool_wm = sai_thrift_read_buffer_pool_watermark(self.client, buf_pool_roid)
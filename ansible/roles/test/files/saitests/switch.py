@@ -55,8 +55,30 @@ is_bmv2 = ('BMV2_TEST' in os.environ) and (int(os.environ['BMV2_TEST']) == 1)
 STOP_PORT_MAX_RATE = 1
 RELEASE_PORT_MAX_RATE = 0
 
+# The port counters read by sai_thrift_read_port_counters, tests index the results in this order
+PORT_COUNTER_IDS = [
+    SAI_PORT_STAT_IF_OUT_DISCARDS,
+    SAI_PORT_STAT_IF_IN_DISCARDS,
+    SAI_PORT_STAT_PFC_0_TX_PKTS,
+    SAI_PORT_STAT_PFC_1_TX_PKTS,
+    SAI_PORT_STAT_PFC_2_TX_PKTS,
+    SAI_PORT_STAT_PFC_3_TX_PKTS,
+    SAI_PORT_STAT_PFC_4_TX_PKTS,
+    SAI_PORT_STAT_PFC_5_TX_PKTS,
+    SAI_PORT_STAT_PFC_6_TX_PKTS,
+    SAI_PORT_STAT_PFC_7_TX_PKTS,
+    SAI_PORT_STAT_IF_OUT_OCTETS,
+    SAI_PORT_STAT_IF_OUT_UCAST_PKTS
+]
+QUEUE_COUNTER_IDS = [SAI_QUEUE_STAT_PACKETS]
+
+# port object id: (queue object ids, PG object ids), see sai_thrift_get_port_qos_objects
+port_qos_objects = {}
+
 def switch_init(client):
     global switch_inited
+    # queue and PG ids are cached for the duration of one test
+    port_qos_objects.clear()
     if switch_inited:
         return
 
@@ -607,19 +629,10 @@ def sai_thrift_create_pool_profile(client, pool_type, size, threshold_mode):
 
 def sai_thrift_clear_all_counters(client):
     for port in sai_port_list:
-        queue_list=[]
         client.sai_thrift_clear_port_all_stats(port)
-        port_attr_list = client.sai_thrift_get_port_attribute(port)
-        attr_list = port_attr_list.attr_list
-        for attribute in attr_list:
-            if attribute.id == SAI_PORT_ATTR_QOS_QUEUE_LIST:
-                for queue_id in attribute.value.objlist.object_id_list:
-                    queue_list.append(queue_id)
-
-        cnt_ids=[]
-        cnt_ids.append(SAI_QUEUE_STAT_PACKETS)
+        queue_list, _ = sai_thrift_get_port_qos_objects(client, port)
         for queue in queue_list:
-            client.sai_thrift_clear_queue_stats(queue,cnt_ids,len(cnt_ids))
+            client.sai_thrift_clear_queue_stats(queue,QUEUE_COUNTER_IDS,len(QUEUE_COUNTER_IDS))
 
 def sai_thrift_port_tx_disable(client, asic_type, port_ids):
     if asic_type == 'mellanox':
@@ -649,40 +662,38 @@ def sai_thrift_port_tx_enable(client, asic_type, port_ids):
     for port_id in port_ids:
         client.sai_thrift_set_port_attribute(port_list[port_id], attr)
 
+def sai_thrift_get_port_qos_objects(client, port):
+    """
+    Return (queue_list, pg_list) object ids of the port.
+    The port attributes are fetched on the first call only, the lists are kept in port_qos_objects
+    until the next switch_init().
+    """
+    if port not in port_qos_objects:
+        queue_list=[]
+        pg_list=[]
+        port_attr_list = client.sai_thrift_get_port_attribute(port)
+        attr_list = port_attr_list.attr_list
+        for attribute in attr_list:
+            if attribute.id == SAI_PORT_ATTR_QOS_QUEUE_LIST:
+                for queue_id in attribute.value.objlist.object_id_list:
+                    queue_list.append(queue_id)
+            elif attribute.id == SAI_PORT_ATTR_INGRESS_PRIORITY_GROUP_LIST:
+                for pg_id in attribute.value.objlist.object_id_list:
+                    pg_list.append(pg_id)
+        port_qos_objects[port] = (queue_list, pg_list)
+    return port_qos_objects[port]
+
 def sai_thrift_read_port_counters(client,port):
-    port_cnt_ids=[]
-    port_cnt_ids.append(SAI_PORT_STAT_IF_OUT_DISCARDS)
-    port_cnt_ids.append(SAI_PORT_STAT_IF_IN_DISCARDS)
-    port_cnt_ids.append(SAI_PORT_STAT_PFC_0_TX_PKTS)
-    port_cnt_ids.append(SAI_PORT_STAT_PFC_1_TX_PKTS)
-    port_cnt_ids.append(SAI_PORT_STAT_PFC_2_TX_PKTS)
-    port_cnt_ids.append(SAI_PORT_STAT_PFC_3_TX_PKTS)
-    port_cnt_ids.append(SAI_PORT_STAT_PFC_4_TX_PKTS)
-    port_cnt_ids.append(SAI_PORT_STAT_PFC_5_TX_PKTS)
-    port_cnt_ids.append(SAI_PORT_STAT_PFC_6_TX_PKTS)
-    port_cnt_ids.append(SAI_PORT_STAT_PFC_7_TX_PKTS)
-    port_cnt_ids.append(SAI_PORT_STAT_IF_OUT_OCTETS)
-    port_cnt_ids.append(SAI_PORT_STAT_IF_OUT_UCAST_PKTS)
     counters_results=[]
-    counters_results = client.sai_thrift_get_port_stats(port,port_cnt_ids,len(port_cnt_ids))
+    counters_results = client.sai_thrift_get_port_stats(port,PORT_COUNTER_IDS,len(PORT_COUNTER_IDS))
 
-    queue_list=[]
-    port_attr_list = client.sai_thrift_get_port_attribute(port)
-    attr_list = port_attr_list.attr_list
-    for attribute in attr_list:
-        if attribute.id == SAI_PORT_ATTR_QOS_QUEUE_LIST:
-            for queue_id in attribute.value.objlist.object_id_list:
-                queue_list.append(queue_id)
-    cnt_ids=[]
+    queue_list, _ = sai_thrift_get_port_qos_objects(client, port)
     thrift_results=[]
     queue_counters_results=[]
-    cnt_ids.append(SAI_QUEUE_STAT_PACKETS)
-    queue1=0
-    for queue in queue_list:
-        if queue1 <= 7:
-            thrift_results=client.sai_thrift_get_queue_stats(queue,cnt_ids,len(cnt_ids))
-            queue_counters_results.append(thrift_results[0])
-            queue1+=1
+    # Only use the first 8 queues (unicast) - multicast queues are not used
+    for queue in queue_list[:8]:
+        thrift_results=client.sai_thrift_get_queue_stats(queue,QUEUE_COUNTER_IDS,len(QUEUE_COUNTER_IDS))
+        queue_counters_results.append(thrift_results[0])
     return (counters_results, queue_counters_results)
 
 def sai_thrift_read_port_watermarks(client,port):
@@ -693,17 +704,7 @@ def sai_thrift_read_port_watermarks(client,port):
     pg_wm_ids.append(SAI_INGRESS_PRIORITY_GROUP_STAT_XOFF_ROOM_WATERMARK_BYTES)
     pg_wm_ids.append(SAI_INGRESS_PRIORITY_GROUP_STAT_SHARED_WATERMARK_BYTES)
 
-    queue_list=[]
-    pg_list=[]
-    port_attr_list = client.sai_thrift_get_port_attribute(port)
-    attr_list = port_attr_list.attr_list
-    for attribute in attr_list:
-        if attribute.id == SAI_PORT_ATTR_QOS_QUEUE_LIST:
-            for queue_id in attribute.value.objlist.object_id_list:
-                queue_list.append(queue_id)
-        elif attribute.id == SAI_PORT_ATTR_INGRESS_PRIORITY_GROUP_LIST:
-            for pg_id in attribute.value.objlist.object_id_list:
-                pg_list.append(pg_id)
+    queue_list, pg_list = sai_thrift_get_port_qos_objects(client, port)
 
     thrift_results=[]
     queue_res=[]
@@ -728,13 +729,7 @@ def sai_thrift_read_pg_counters(client, port_id):
     ]
 
     # fetch pg ids under port id
-    pg_ids = []
-    port_attrs = client.sai_thrift_get_port_attribute(port_id)
-    attrs = port_attrs.attr_list
-    for attr in attrs:
-        if attr.id == SAI_PORT_ATTR_INGRESS_PRIORITY_GROUP_LIST:
-            for pg_id in attr.value.objlist.object_id_list:
-                pg_ids.append(pg_id)
+    _, pg_ids = sai_thrift_get_port_qos_objects(client, port_id)
 
     # get counter values of counter ids of interest under each pg
     pg_cntrs=[]
@@ -744,6 +739,76 @@ def sai_thrift_read_pg_counters(client, port_id):
 
     return pg_cntrs
 
+def sai_thrift_read_counters_snapshot(client, ports, buffer_pool_ids=None, port_stats=True, queues=True, pgs=True):
+    """
+    Read the counters of the ports and the buffer pools in one pass.
+    All counters of a queue or a PG are read by one RPC and the queue and PG ids are cached,
+    so the snapshot costs one RPC per port, unicast queue, PG and buffer pool.
+    port_stats, queues and pgs select the counters to read, the lists of the skipped counters are empty.
+
+    Returns dictionary:
+        'time': time of the snapshot
+        'ports': {port: {
+            'port': port counters in the order of PORT_COUNTER_IDS (as sai_thrift_read_port_counters),
+            'queue': packets of the unicast queues,
+            'queue_wm': shared watermark bytes of the unicast queues,
+            'pg': packets of the PGs,
+            'pg_headroom_wm': xoff room watermark bytes of the PGs,
+            'pg_shared_wm': shared watermark bytes of the PGs}}
+        'buffer_pools': {buffer_pool_id: watermark bytes}
+    """
+    q_ids = [SAI_QUEUE_STAT_PACKETS, SAI_QUEUE_STAT_SHARED_WATERMARK_BYTES]
+    pg_ids = [SAI_INGRESS_PRIORITY_GROUP_STAT_PACKETS,
+              SAI_INGRESS_PRIORITY_GROUP_STAT_XOFF_ROOM_WATERMARK_BYTES,
+              SAI_INGRESS_PRIORITY_GROUP_STAT_SHARED_WATERMARK_BYTES]
+
+    snapshot = {'time': time.time(), 'ports': {}, 'buffer_pools': {}}
+    for port in ports:
+        queue_list, pg_list = sai_thrift_get_port_qos_objects(client, port)
+        counters = {'port': [],
+                    'queue': [], 'queue_wm': [],
+                    'pg': [], 'pg_headroom_wm': [], 'pg_shared_wm': []}
+        if port_stats:
+            counters['port'] = client.sai_thrift_get_port_stats(port,PORT_COUNTER_IDS,len(PORT_COUNTER_IDS))
+
+        # Only use the first 8 queues (unicast) - multicast queues are not used
+        for queue in queue_list[:8] if queues else []:
+            thrift_results=client.sai_thrift_get_queue_stats(queue,q_ids,len(q_ids))
+            counters['queue'].append(thrift_results[0])
+            counters['queue_wm'].append(thrift_results[1])
+
+        for pg in pg_list if pgs else []:
+            thrift_results=client.sai_thrift_get_pg_stats(pg,pg_ids,len(pg_ids))
+            counters['pg'].append(thrift_results[0])
+            counters['pg_headroom_wm'].append(thrift_results[1])
+            counters['pg_shared_wm'].append(thrift_results[2])
+
+        snapshot['ports'][port] = counters
+
+    for buffer_pool_id in buffer_pool_ids or []:
+        snapshot['buffer_pools'][buffer_pool_id] = sai_thrift_read_buffer_pool_watermark(client, buffer_pool_id)
+
+    return snapshot
+
+def sai_thrift_counters_delta(base, snapshot):
+    """
+    Return the difference of two snapshots of sai_thrift_read_counters_snapshot in the same format.
+    Counters are subtracted, watermarks are not cumulative so the values of the later snapshot are kept.
+    The snapshot may hold a subset of the ports and the counters of the base snapshot.
+    """
+    delta = {'time': snapshot['time'] - base['time'],
+             'ports': {},
+             'buffer_pools': dict(snapshot['buffer_pools'])}
+    for port, counters in snapshot['ports'].items():
+        base_counters = base['ports'][port]
+        delta['ports'][port] = {}
+        for key, values in counters.items():
+            if key.endswith('_wm'):
+                delta['ports'][port][key] = list(values)
+            else:
+                delta['ports'][port][key] = [value - base_value for value, base_value in zip(values, base_counters[key])]
+    return delta
+
 def sai_thrift_read_buffer_pool_watermark(client, buffer_pool_id):
     buffer_pool_wm_ids = [
         SAI_BUFFER_POOL_STAT_WATERMARK_BYTES
@@ -0,0 +1,77 @@
+"""
+Burst transmit for the traffic phases of the QoS tests.
+
+send_packet() of ptf serializes the packet and goes through the dataplane, which logs and
+records every copy. Filling the buffers with it is limited by python, not by the port.
+send_burst() serializes the packet once and writes the copies straight to the socket of
+the ptf dataplane port.
+"""
+
+import errno
+import select
+import socket
+import sys
+import time
+
+from ptf.testutils import send_packet
+
+SEND_BUFFER_SIZE = 4 * 1024 * 1024
+SEND_RETRY_TIMEOUT = 0.01
+
+
+def packet_template(pkt):
+    """
+    Serialize the packet once, the result can be passed to send_burst() many times
+    """
+    return str(pkt)
+
+
+def get_port_socket(test, port, device_number=0):
+    """
+    Return the raw socket of the ptf dataplane port, None if the port has no socket (e.g. nanomsg ports)
+    """
+    dp_port = test.dataplane.ports.get((device_number, port))
+    sock = getattr(dp_port, 'socket', None)
+    if sock is None or getattr(sock, 'family', None) != socket.AF_PACKET:
+        return None
+    if not getattr(dp_port, 'burst_sndbuf', False):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_SIZE)
+        except socket.error:
+            pass
+        dp_port.burst_sndbuf = True
+    return sock
+
+
+def send_burst(test, port, pkt, count=1, device_number=0):
+    """
+    Send count copies of the packet to the port as fast as the port socket accepts them.
+    @param pkt: scapy packet or the packet serialized by packet_template()
+    @return: achieved rate in packets per second
+    """
+    frame = pkt if isinstance(pkt, str) else packet_template(pkt)
+    sock = get_port_socket(test, port, device_number)
+
+    start = time.time()
+    if sock is None:
+        send_packet(test, port, frame, count)
+    else:
+        send = sock.send
+        sent = 0
+        while sent < count:
+            try:
+                send(frame)
+                sent += 1
+            except socket.timeout:
+                continue
+            except socket.error as err:
+                if err.errno not in (errno.ENOBUFS, errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    raise
+                # The queue of the interface is full, wait until the socket is writable again
+                select.select([], [sock], [], SEND_RETRY_TIMEOUT)
+    elapsed = time.time() - start
+
+    rate = count / elapsed if elapsed > 0 else float('inf')
+    print >> sys.stderr, "port %d: sent %d packets in %.3f sec, %.0f pps" % (port, count, elapsed, rate)
+    sys.stderr.flush()
+    return rate
@@ -17,9 +17,15 @@ Usage:          Examples of how to use log analyzer
 # Global imports
 #---------------------------------------------------------------------
 import sys
+import os
 import getopt
+import gzip
+import shutil
 import re
+import sre_parse
+import sre_constants
 import csv
+import json
 import pprint
 import logging
 import logging.handlers
@@ -31,6 +37,8 @@ from __builtin__ import True
 tokenizer = ','
 comment_key = '#'
 system_log_file = '/var/log/syslog'
+#-- Size of the chunks read backwards from the end of analyzed log files
+read_block_size = 64 * 1024
 
 #-- List of ERROR codes to be returned by AnsibleLogAnalyzer
 err_duplicate_start_marker = -1
@@ -39,6 +47,152 @@ err_no_end_marker = -3
 err_no_start_marker = -4
 err_invalid_string_format = -5
 err_invalid_input = -6
+err_log_position_not_found = -7
+
+#-- Shortest literal substring which is used to pre-filter lines for a regex
+min_anchor_len = 3
+
+class MessageMatcher:
+    '''
+    @summary: Set of regular expressions compiled once and matched against log lines.
+
+    Each expression is compiled separately, so the expression which matched
+    a line is always known. For every expression the longest literal substring
+    which must be present in any matching line (anchor) is extracted.
+    Lines are first checked for the anchors with plain substring search and
+    only expressions whose anchor is found in the line are executed.
+    Expressions without an anchor are checked with one combined expression.
+    '''
+
+    def __init__(self, messages_regex):
+        self.messages_regex = list(messages_regex)
+        self.rules = [re.compile(regex) for regex in self.messages_regex]
+
+        self.anchored = []
+        self.unanchored = []
+        for index, regex in enumerate(self.messages_regex):
+            anchor = self.literal_anchor(regex, self.rules[index])
+            if anchor is None:
+                self.unanchored.append(index)
+            else:
+                self.anchored.append((index, anchor))
+
+        if self.unanchored:
+            self.unanchored_regex = re.compile('|'.join(self.messages_regex[index] for index in self.unanchored))
+        else:
+            self.unanchored_regex = None
+    #---------------------------------------------------------------------
+
+    @staticmethod
+    def literal_anchor(regex, compiled):
+        '''
+        @summary: Find the longest run of literal characters on the top level
+                  of the regular expression. Such run has to be present in every
+                  string matched by the expression.
+
+        @param regex: Regular expression string.
+
+        @param compiled: Compiled regular expression.
+
+        @return: Literal substring or None if there is no usable anchor.
+        '''
+        if compiled.flags & re.IGNORECASE:
+            return None
+
+        try:
+            parsed = sre_parse.parse(regex)
+        except Exception:
+            return None
+
+        anchor = ''
+        current = []
+        for op, av in list(parsed) + [(None, None)]:
+            if op == sre_constants.LITERAL and av < 256:
+                current.append(chr(av))
+                continue
+            if len(current) > len(anchor):
+                anchor = ''.join(current)
+            current = []
+
+        if len(anchor) < min_anchor_len:
+            return None
+        return anchor
+    #---------------------------------------------------------------------
+
+    def candidates(self, str):
+        '''
+        @summary: Indexes of the expressions which may match given string.
+        '''
+        return [index for index, anchor in self.anchored if anchor in str]
+    #---------------------------------------------------------------------
+
+    def search(self, str):
+        '''
+        @summary: Find an expression matching given string.
+
+        @return: Regular expression string which matched or None.
+        '''
+        for index in self.candidates(str):
+            if self.rules[index].search(str):
+                return self.messages_regex[index]
+
+        if self.unanchored_regex is not None and self.unanchored_regex.search(str):
+            for index in self.unanchored:
+                if self.rules[index].search(str):
+                    return self.messages_regex[index]
+
+        return None
+    #---------------------------------------------------------------------
+
+    def matching_rules(self, str):
+        '''
+        @summary: Find all expressions matching given string.
+
+        @return: List of indexes of the matched expressions.
+        '''
+        matched = [index for index in self.candidates(str) if self.rules[index].search(str)]
+
+        if self.unanchored_regex is not None and self.unanchored_regex.search(str):
+            matched.extend(index for index in self.unanchored if self.rules[index].search(str))
+
+        return matched
+    #---------------------------------------------------------------------
+
+    def unused_rules(self, lines):
+        '''
+        @summary: Find expressions which did not match any of given lines.
+
+        @param lines: Lines to match against.
+
+        @return: List of regular expression strings.
+        '''
+        used = set()
+        for line in lines:
+            used.update(self.matching_rules(line))
+
+        return [regex for index, regex in enumerate(self.messages_regex) if index not in used]
+    #---------------------------------------------------------------------
+
+#-- Matchers are cached by the list of expressions, so the same set of
+#-- expressions is compiled only once per process.
+msg_matcher_cache = {}
+
+def get_msg_matcher(messages_regex):
+    '''
+    @summary: Get a MessageMatcher for the list of regular expressions.
+
+    @param messages_regex: List of regular expression strings.
+
+    @return: MessageMatcher instance or None if the list is empty.
+    '''
+    if not messages_regex:
+        return None
+
+    key = tuple(messages_regex)
+    if key not in msg_matcher_cache:
+        msg_matcher_cache[key] = MessageMatcher(key)
+    return msg_matcher_cache[key]
+#---------------------------------------------------------------------
 
 class AnsibleLogAnalyzer:
     '''
@@ -188,13 +342,14 @@ class AnsibleLogAnalyzer:
 
         @param file_list : List of file paths, contains search expressions.
 
-        @return: A regex class instance, corresponding to loaded regex expressions.
+        @return: A MessageMatcher instance, corresponding to loaded regex expressions,
+            and the list of loaded regex expressions.
             Will be used for matching operations by callers.
         '''
         messages_regex = []
 
         if file_lsit is None or (0 == len(file_lsit)):
-            return None
+            return None, messages_regex
 
         for filename in file_lsit:
             self.print_diagnostic_message('processing match file:%s' % filename)
@@ -236,11 +391,7 @@ class AnsibleLogAnalyzer:
                         print repr(e)
                         sys.exit(err_invalid_string_format)
 
-        if (len(messages_regex)):
-            regex = re.compile('|'.join(messages_regex))
-        else:
-            regex = None
-        return regex, messages_regex
+        return get_msg_matcher(messages_regex), messages_regex
     #---------------------------------------------------------------------
 
     def line_matches(self, str, match_messages_regex, ignore_messages_regex):
@@ -254,21 +405,21 @@ class AnsibleLogAnalyzer:
             'ignore' set - will not be reported (will be ignored)
 
         @param match_messages_regex:
-            regex class instance containing messages to match against.
+            MessageMatcher instance containing messages to match against.
 
         @param ignore_messages_regex:
-            regex class instance containing messages to ignore match against.
+            MessageMatcher instance containing messages to ignore match against.
 
         @return: True is str matches regex criteria, otherwise False.
         '''
 
         ret_code = False
 
-        if ((match_messages_regex is not None) and (match_messages_regex.findall(str))):
+        if ((match_messages_regex is not None) and (match_messages_regex.search(str) is not None)):
             if (ignore_messages_regex is None):
                 ret_code = True
 
-            elif (not ignore_messages_regex.findall(str)):
+            elif (ignore_messages_regex.search(str) is None):
                 self.print_diagnostic_message('matching line: %s' % str)
                 ret_code = True
 
@@ -282,11 +433,49 @@ class AnsibleLogAnalyzer:
         '''
 
         ret_code = False
-        if (expect_messages_regex is not None) and (expect_messages_regex.findall(str)):
+        if (expect_messages_regex is not None) and (expect_messages_regex.search(str) is not None):
             ret_code = True
 
         return ret_code
 
+    def read_lines_reversed(self, log_file, block_size=read_block_size):
+        '''
+        @summary: Generator which yields lines of the file starting from the last one.
+                  File is read backwards from EOF in blocks of fixed size, so the
+                  memory usage depends on the block size and not on the file size.
+                  Reading stops as soon as the caller stops iterating.
+
+        @param log_file: Opened seekable file object.
+
+        @param block_size: Size of the chunk read from the file at once.
+
+        @return: Lines of the file in reversed order, each line keeps its '\\n'.
+        '''
+        log_file.seek(0, os.SEEK_END)
+        position = log_file.tell()
+        buf = ''
+
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            log_file.seek(position)
+            buf = log_file.read(read_size) + buf
+
+            #-- The first line in the buffer may be incomplete, keep it until
+            #-- the previous block is read.
+            end = len(buf)
+            while True:
+                line_start = buf.rfind('\n', 0, end - 1) + 1
+                if line_start == 0:
+                    break
+                yield buf[line_start:end]
+                end = line_start
+            buf = buf[:end]
+
+        if buf:
+            yield buf
+    #---------------------------------------------------------------------
+
     def analyze_file(self, log_file_path, match_messages_regex, ignore_messages_regex, expect_messages_regex):
         '''
         @summary: Analyze input file content for messages matching input regex
@@ -295,13 +484,13 @@ class AnsibleLogAnalyzer:
         @param log_file_path: Patch to the log file.
 
         @param match_messages_regex:
-            regex class instance containing messages to match against.
+            MessageMatcher instance containing messages to match against.
 
         @param ignore_messages_regex:
-            regex class instance containing messages to ignore match against.
+            MessageMatcher instance containing messages to ignore match against.
 
         @param expect_messages_regex:
-            regex class instance containing messages that are expected to appear in logfile.
+            MessageMatcher instance containing messages that are expected to appear in logfile.
 
         @param end_marker_regex - end marker
 
@@ -321,13 +510,15 @@ class AnsibleLogAnalyzer:
         found_end_marker = False
         if stdin_as_input:
             log_file = sys.stdin
+            rev_lines = reversed(log_file.readlines())
         else:
             log_file = open(log_file_path, 'r')
+            rev_lines = self.read_lines_reversed(log_file)
 
         start_marker = self.create_start_marker()
         end_marker = self.create_end_marker()
 
-        for rev_line in reversed(log_file.readlines()):
+        for rev_line in rev_lines:
             if stdin_as_input:
                 in_analysis_range = True
             else:
@@ -361,6 +552,9 @@ class AnsibleLogAnalyzer:
                 elif self.line_matches(rev_line, match_messages_regex, ignore_messages_regex):
                     matching_lines.append(rev_line)
 
+        if not stdin_as_input:
+            log_file.close()
+
         # care about the markers only if input is not stdin
         if not stdin_as_input:
             if (not found_start_marker):
@@ -382,13 +576,13 @@ class AnsibleLogAnalyzer:
         @param log_file_list: List of paths to the log files.
 
         @param match_messages_regex:
-            regex class instance containing messages to match against.
+            MessageMatcher instance containing messages to match against.
 
         @param ignore_messages_regex:
-            regex class instance containing messages to ignore match against.
+            MessageMatcher instance containing messages to ignore match against.
 
         @param expect_messages_regex:
-            regex class instance containing messages that are expected to appear in logfile.
+            MessageMatcher instance containing messages that are expected to appear in logfile.
 
         @return: Returns map <file_name, list_of_matching_strings>
         '''
@@ -415,6 +609,10 @@ def usage():
     print '                                 to all log files specified in --logs parameter.'
     print '                                 analyze - perform log analysis of files specified in --logs parameter.'
     print '                                 add_end_marker - add end marker to all log files specified in --logs parameter.'
+    print '                                 summary - analyze log files specified in --logs parameter, which already'
+    print '                                 contain start and end markers, and print the summary in JSON to stdout.'
+    print '                                 extract - copy system log content starting from --position into --target_file,'
+    print '                                 following the log file through rotation.'
     print '--out_dir path                   Directory path where to place output files, '
     print '                                 must be present when --action == analyze'
     print '--logs path{,path}               List of full paths to log files to be analyzed.'
@@ -433,10 +631,14 @@ def usage():
     print '                                 All the strings from these files will be expected to present'
     print '                                 in one of specified log files during the analysis. Must be present'
     print '                                 when action == analyze.'
+    print '--position inode:offset          Position in system log file printed by init action.'
+    print '                                 Must be present when action == extract.'
+    print '--target_file path               Path to the file where extracted log is saved.'
+    print '                                 Must be present when action == extract.'
 
 #---------------------------------------------------------------------
 
-def check_action(action, log_files_in, out_dir, match_files_in, ignore_files_in, expect_files_in):
+def check_action(action, log_files_in, out_dir, match_files_in, ignore_files_in, expect_files_in, position=None, target_file=None):
     '''
     @summary: This function validates command line parameter 'action' and
         other related parameters.
@@ -450,6 +652,17 @@ def check_action(action, log_files_in, out_dir, match_files_in, ignore_files_in,
         ret_code = True
     elif (action == 'add_end_marker'):
         ret_code = True
+    elif (action == 'extract'):
+        if position is None or parse_log_position(position) is None:
+            print 'ERROR: missing or invalid position for extract action'
+            ret_code = False
+        elif target_file is None or len(target_file) == 0:
+            print 'ERROR: missing required target_file for extract action'
+            ret_code = False
+    elif (action == 'summary'):
+        if match_files_in is None or len(match_files_in) == 0:
+            print 'ERROR: missing required match_files_in for summary action'
+            ret_code = False
     elif (action == 'analyze'):
         if out_dir is None or len(out_dir) == 0:
             print 'ERROR: missing required out_dir for analyze action'
@@ -523,12 +736,9 @@ def write_result_file(run_id, out_dir, analysis_result_per_file, messages_regex_
         out_file.write("\n-------------------------------------------------\n\n")
         out_file.write('Total matches:%d\n' % match_cnt)
         # Find unused regex matches
-        for regex in messages_regex_e:
-            for line in expected_lines_total:
-                if re.search(regex, line):
-                    break
-            else:
-                unused_regex_messages.append(regex)
+        expect_matcher = get_msg_matcher(messages_regex_e)
+        if expect_matcher is not None:
+            unused_regex_messages.extend(expect_matcher.unused_rules(expected_lines_total))
 
         out_file.write('Total expected and found matches:%d\n' % expected_cnt)
         out_file.write('Total expected but not found matches: %d\n\n' % len(unused_regex_messages))
@@ -576,6 +786,155 @@ def write_summary_file(run_id, out_dir, analysis_result_per_file, unused_regex_m
     out_file.close()
 #---------------------------------------------------------------------
 
+def get_log_position(log_file):
+    '''
+    @summary: Get current position in the log file.
+
+    @param log_file: Path to the log file.
+
+    @return: String 'inode:offset', where offset is the current size of the file.
+    '''
+
+    stat = os.stat(log_file)
+    return '%d:%d' % (stat.st_ino, stat.st_size)
+#---------------------------------------------------------------------
+
+def parse_log_position(position):
+    '''
+    @summary: Parse position string returned by get_log_position().
+
+    @return: Tuple (inode, offset) or None if position is malformed.
+    '''
+
+    try:
+        inode, offset = position.split(':')
+        return int(inode), int(offset)
+    except ValueError:
+        return None
+#---------------------------------------------------------------------
+
+def list_rotated_logs(log_file):
+    '''
+    @summary: List the log file and its rotated copies (log_file.N, log_file.N.gz).
+
+    @return: List of paths sorted from the newest file to the oldest one.
+    '''
+
+    directory, name = os.path.split(log_file)
+    rotated_regex = re.compile(r'^%s(\.(\d+))?(\.gz)?$' % re.escape(name))
+
+    rotated_logs = []
+    for filename in os.listdir(directory):
+        match = rotated_regex.match(filename)
+        if match:
+            rotated_logs.append((int(match.group(2) or 0), os.path.join(directory, filename)))
+
+    return [path for index, path in sorted(rotated_logs)]
+#---------------------------------------------------------------------
+
+def extract_log_from_position(log_file, position, target_file):
+    '''
+    @summary: Copy log content written after the given position into target file.
+        If the log file was rotated after the position was taken, the rotated
+        file is found by inode and the content of newer files is appended.
+
+    @param log_file: Path to the log file.
+
+    @param position: Position string returned by get_log_position().
+
+    @param target_file: Path to the file where extracted log is saved.
+
+    @return: True if log was extracted, False if file with the inode of the
+        position does not exist anymore (e.g. it was compressed) or was truncated.
+    '''
+
+    inode, offset = parse_log_position(position)
+    rotated_logs = list_rotated_logs(log_file)
+
+    for index, path in enumerate(rotated_logs):
+        if os.stat(path).st_ino == inode:
+            break
+    else:
+        return False
+
+    with open(rotated_logs[index], 'rb') as start_file:
+        start_file.seek(0, os.SEEK_END)
+        if start_file.tell() < offset:
+            return False
+
+        with open(target_file, 'wb') as out_file:
+            start_file.seek(offset)
+            shutil.copyfileobj(start_file, out_file)
+
+            for path in reversed(rotated_logs[:index]):
+                if path.endswith('.gz'):
+                    newer_file = gzip.open(path, 'rb')
+                else:
+                    newer_file = open(path, 'rb')
+                with newer_file:
+                    shutil.copyfileobj(newer_file, out_file)
+
+    return True
+#---------------------------------------------------------------------
+
+def build_summary(analysis_result_per_file, expect_messages_regex):
+    '''
+    @summary: This function builds results summary of the analysis.
+
+    @param analysis_result_per_file: map file_name:[list of matching strings, list of expected strings]
+
+    @param expect_messages_regex: MessageMatcher instance containing messages that
+        are expected to appear in log files.
+
+    @return: dictionary with total and per file counters, found messages and
+        expected regular expressions which were not found.
+    '''
+
+    summary = {"total": {"match": 0, "expected_match": 0, "expected_missing_match": 0},
+               "match_files": {},
+               "match_messages": {},
+               "expect_messages": {},
+               "unused_expected_regexp": []
+               }
+    expected_lines_total = []
+
+    for key, value in analysis_result_per_file.iteritems():
+        matching_lines, expecting_lines = value
+        summary["total"]["match"] += len(matching_lines)
+        summary["total"]["expected_match"] += len(expecting_lines)
+        summary["match_files"][key] = {"match": len(matching_lines), "expected_match": len(expecting_lines)}
+        summary["match_messages"][key] = matching_lines
+        summary["expect_messages"][key] = expecting_lines
+        expected_lines_total.extend(expecting_lines)
+
+    # Find unused regex matches
+    if expect_messages_regex is not None:
+        summary["unused_expected_regexp"] = expect_messages_regex.unused_rules(expected_lines_total)
+    summary["total"]["expected_missing_match"] = len(summary["unused_expected_regexp"])
+
+    return summary
+#---------------------------------------------------------------------
+
+def print_json_summary(summary):
+    '''
+    @summary: Print results summary in JSON format to stdout.
+        Log lines which are not valid UTF-8 are printed with replaced characters.
+
+    @param summary: dictionary returned by build_summary()
+    '''
+
+    def to_unicode(obj):
+        if isinstance(obj, str):
+            return obj.decode('utf-8', 'replace')
+        if isinstance(obj, list):
+            return [to_unicode(item) for item in obj]
+        if isinstance(obj, dict):
+            return dict((to_unicode(key), to_unicode(value)) for key, value in obj.iteritems())
+        return obj
+
+    print json.dumps(to_unicode(summary))
+#---------------------------------------------------------------------
+
 def main(argv):
 
     action = None
@@ -586,10 +945,12 @@ def main(argv):
     match_files_in = None
     ignore_files_in = None
     expect_files_in = None
+    position = None
+    target_file = None
     verbose = False
 
     try:
-        opts, args = getopt.getopt(argv, "a:r:s:l:o:m:i:e:vh", ["action=", "run_id=", "start_marker=", "logs=", "out_dir=", "match_files_in=", "ignore_files_in=", "expect_files_in=", "verbose", "help"])
+        opts, args = getopt.getopt(argv, "a:r:s:l:o:m:i:e:p:t:vh", ["action=", "run_id=", "start_marker=", "logs=", "out_dir=", "match_files_in=", "ignore_files_in=", "expect_files_in=", "position=", "target_file=", "verbose", "help"])
 
     except getopt.GetoptError:
         print "Invalid option specified"
@@ -625,10 +986,16 @@ def main(argv):
         elif (opt in ("-e", "--expect_files_in")):
             expect_files_in = arg
 
+        elif (opt in ("-p", "--position")):
+            position = arg
+
+        elif (opt in ("-t", "--target_file")):
+            target_file = arg
+
         elif (opt in ("-v", "--verbose")):
             verbose = True
 
-    if not (check_action(action, log_files_in, out_dir, match_files_in, ignore_files_in, expect_files_in) and check_run_id(run_id)):
+    if not (check_action(action, log_files_in, out_dir, match_files_in, ignore_files_in, expect_files_in, position, target_file) and check_run_id(run_id)):
         usage()
         sys.exit(err_invalid_input)
 
@@ -638,8 +1005,15 @@ def main(argv):
 
     result = {}
     if (action == "init"):
+        # Position is taken before placing the marker, so the marker is always after it
+        print get_log_position(system_log_file)
         analyzer.place_marker(log_file_list, analyzer.create_start_marker())
         return 0
+    elif (action == "extract"):
+        if not extract_log_from_position(system_log_file, position, target_file):
+            print 'ERROR: log position %s not found' % position
+            sys.exit(err_log_position_not_found)
+        return 0
     elif (action == "analyze"):
         match_file_list = match_files_in.split(tokenizer)
         ignore_file_list = ignore_files_in.split(tokenizer)
@@ -663,6 +1037,23 @@ def main(argv):
     elif (action == "add_end_marker"):
         analyzer.place_marker(log_file_list, analyzer.create_end_marker())
         return 0
+    elif (action == "summary"):
+        match_file_list = filter(None, match_files_in.split(tokenizer))
+        ignore_file_list = filter(None, (ignore_files_in or "").split(tokenizer))
+        expect_file_list = filter(None, (expect_files_in or "").split(tokenizer))
+
+        match_messages_regex, messages_regex_m = analyzer.create_msg_regex(match_file_list)
+        ignore_messages_regex, messages_regex_i = analyzer.create_msg_regex(ignore_file_list)
+        expect_messages_regex, messages_regex_e = analyzer.create_msg_regex(expect_file_list)
+
+        # if no log file specified - add system log
+        if not log_file_list:
+            log_file_list.append(system_log_file)
+
+        result = analyzer.analyze_file_list(log_file_list, match_messages_regex,
+                                            ignore_messages_regex, expect_messages_regex)
+        print_json_summary(build_summary(result, expect_messages_regex))
+        return 0
 
     else:
         print 'Unknown action:%s specified' % action
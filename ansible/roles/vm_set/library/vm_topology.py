@@ -8,6 +8,11 @@ import re
 import docker
 from ansible.module_utils.basic import *
 import traceback
+import copy
+import json
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from pprint import pprint
 
 DOCUMENTATION = '''
@@ -31,7 +36,7 @@ description:
       - connect dut fp ports to bridges representing vm set fp ports
       - connect dut mgmt ports to mgmt bridge (option)
     - with cmd: 'renumber' the module:
-      - disconnect vlan interface to bridges representing vm set fp ports
+      - disconnect vlan interface to bridges representing vm set fp ports (only ports which are bound to other bridges)
       - inserts mgmt interface inside of the docker container with name "ptf_{{vm_set_name}}"
       - assigns ip address and default route to the mgmt interface
       - inserts physical vlans into the docker container to represent endhosts
@@ -42,6 +47,7 @@ description:
       - disconnect all VM ports from the DUT
     - With cmd: 'disconnect-vms' the module:
       - reconnect all VM ports to the DUT
+    - 'connect-vms' and 'disconnect-vms' rewrite the flows of all VM bridges, or of the bridges of the VMs in vms only
 
 
 Parameters:
@@ -58,6 +64,7 @@ Parameters:
     - dut_fp_ports: dut ports
     - dut_mgmt_port: dut mgmt port
     - fp_mtu: MTU for FP ports
+    - vms: hostnames of the VMs to connect or disconnect (optional, all VMs of the topology by default)
 '''
 
 EXAMPLES = '''
@@ -105,9 +112,14 @@ PTF_MGMT_IF_TEMPLATE = 'ptf-%s-m'
 PTF_BP_IF_TEMPLATE = 'ptf-%s-b'
 ROOT_BACK_BR_TEMPLATE = 'br-b-%s'
 PTF_FP_IFACE_TEMPLATE = 'eth%d'
+OVS_FP_BINDING_EXTERNAL_ID = 'vm_topology_binding'
 RETRIES = 3
+# Most of the setup is waiting for ip/ovs/nsenter processes, so run more workers than cores
+PARALLEL_WORKERS = max(4, 2 * multiprocessing.cpu_count())
 
 cmd_debug_fname = None
+cmd_debug_fp = None
+cmd_debug_lock = threading.Lock()
 
 class VMTopology(object):
 
@@ -191,11 +203,21 @@ class VMTopology(object):
 
         return vlans
 
+    def run_method_parallel(self, method_name, args_list):
+        """run the method for every arguments tuple in args_list concurrently.
+        Every task works with its own shallow copy of the object, so the interface lists refreshed
+        by update() in one task don't interfere with the other tasks"""
+        run_parallel([(getattr(copy.copy(self), method_name), args) for args in args_list])
+
+        return
+
     def create_bridges(self):
+        bridges = []
         for vm in self.vm_names:
             for fp_num in xrange(self.max_fp_num):
                 fp_br_name = OVS_FP_BRIDGE_TEMPLATE % (vm, fp_num)
-                self.create_ovs_bridge(fp_br_name, self.fp_mtu)
+                bridges.append((fp_br_name, self.fp_mtu))
+        self.run_method_parallel('create_ovs_bridge', bridges)
 
         return
 
@@ -211,10 +233,12 @@ class VMTopology(object):
         return
 
     def destroy_bridges(self):
+        bridges = []
         for vm in self.vm_names:
             for ifname in self.host_ifaces:
                 if re.compile(OVS_FP_BRIDGE_REGEX % vm).match(ifname):
-                    self.destroy_ovs_bridge(ifname)
+                    bridges.append((ifname,))
+        self.run_method_parallel('destroy_ovs_bridge', bridges)
 
         return
 
@@ -234,10 +258,12 @@ class VMTopology(object):
         return brs
 
     def add_veth_ports_to_docker(self):
+        veth_ports = []
         for vlan in self.injected_fp_ports:
             ext_if = INJECTED_INTERFACES_TEMPLATE % (self.vm_set_name, vlan)
             int_if = PTF_FP_IFACE_TEMPLATE % vlan
-            self.add_veth_if_to_docker(ext_if, int_if)
+            veth_ports.append((ext_if, int_if))
+        self.run_method_parallel('add_veth_if_to_docker', veth_ports)
 
         return
 
@@ -365,26 +391,32 @@ class VMTopology(object):
 
     def bind_devices_interconnect(self):
         self.update()
+        self.run_method_parallel('bind_devices_interconnect_link', self.devices_interconnect_interfaces.items())
+
+        return
 
-        for link_index, vlans in self.devices_interconnect_interfaces.items():
-            interconnection_bridge = OVS_INTERCONNECTION_BRIDGE_TEMPLATE % (self.vm_set_name, link_index)
-            self.create_ovs_bridge(interconnection_bridge, self.fp_mtu)
-            vlan1_iface = self.dut_fp_ports[vlans[0]]
-            vlan2_iface = self.dut_fp_ports[vlans[1]]
-            self.bind_devices_interconnect_ports(interconnection_bridge, vlan1_iface, vlan2_iface)
+    def bind_devices_interconnect_link(self, link_index, vlans):
+        interconnection_bridge = OVS_INTERCONNECTION_BRIDGE_TEMPLATE % (self.vm_set_name, link_index)
+        self.create_ovs_bridge(interconnection_bridge, self.fp_mtu)
+        vlan1_iface = self.dut_fp_ports[vlans[0]]
+        vlan2_iface = self.dut_fp_ports[vlans[1]]
+        self.bind_devices_interconnect_ports(interconnection_bridge, vlan1_iface, vlan2_iface)
 
         return
 
     def unbind_devices_interconnect(self):
         self.update()
+        self.run_method_parallel('unbind_devices_interconnect_link', self.devices_interconnect_interfaces.items())
 
-        for link_index, vlans in self.devices_interconnect_interfaces.items():
-            interconnection_bridge = OVS_INTERCONNECTION_BRIDGE_TEMPLATE % (self.vm_set_name, link_index)
-            vlan1_iface = self.dut_fp_ports[vlans[0]]
-            vlan2_iface = self.dut_fp_ports[vlans[1]]
-            self.unbind_ovs_port(interconnection_bridge, vlan1_iface)
-            self.unbind_ovs_port(interconnection_bridge, vlan2_iface)
-            self.destroy_ovs_bridge(interconnection_bridge)
+        return
+
+    def unbind_devices_interconnect_link(self, link_index, vlans):
+        interconnection_bridge = OVS_INTERCONNECTION_BRIDGE_TEMPLATE % (self.vm_set_name, link_index)
+        vlan1_iface = self.dut_fp_ports[vlans[0]]
+        vlan2_iface = self.dut_fp_ports[vlans[1]]
+        self.unbind_ovs_port(interconnection_bridge, vlan1_iface)
+        self.unbind_ovs_port(interconnection_bridge, vlan2_iface)
+        self.destroy_ovs_bridge(interconnection_bridge)
 
         return
 
@@ -409,22 +441,76 @@ class VMTopology(object):
 
         return
 
-    def bind_fp_ports(self, disconnect_vm=False):
-        for attr in self.VMs.itervalues():
+    def bind_fp_ports(self, disconnect_vm=False, vms=None, refresh=False):
+        """bind dut/injected/vm ports of the VMs (all VMs by default) under their ovs bridges.
+        The current state of all ovs bridges is read once and only the difference is applied:
+        stale ports are removed and missing ports are added in one ovs-vsctl transaction,
+        flows are replaced only on the bridges where ports, their OpenFlow port ids or the VM connection
+        differ from the binding recorded when the flows were replaced last time.
+        With refresh the flows of all bridges of the VMs are replaced, as the flows are also changed outside
+        of vm_topology (e.g. by vm_resumer.py) or lost when ovs-vswitchd restarts"""
+        fp_bindings = []
+        for hostname, attr in self.VMs.iteritems():
+            if vms is not None and hostname not in vms:
+                continue
             for vlan_num, vlan in enumerate(attr['vlans']):
                 injected_iface = INJECTED_INTERFACES_TEMPLATE % (self.vm_set_name, vlan)
                 br_name = OVS_FP_BRIDGE_TEMPLATE % (self.vm_names[self.vm_base_index + attr['vm_offset']], vlan_num)
                 vm_iface = OVS_FP_TAP_TEMPLATE % (self.vm_names[self.vm_base_index + attr['vm_offset']], vlan_num)
-                self.bind_ovs_ports(br_name, self.dut_fp_ports[vlan], injected_iface, vm_iface, disconnect_vm)
+                fp_bindings.append((br_name, self.dut_fp_ports[vlan], injected_iface, vm_iface))
+
+        if not fp_bindings:
+            return
+
+        br_ports, br_bindings = VMTopology.get_ovs_state()
+
+        # remove stale ports first, so a port can be moved to another bridge in the same transaction
+        del_ports = []
+        add_ports = []
+        changed_bridges = set()
+        for br_name, dut_iface, injected_iface, vm_iface in fp_bindings:
+            ports = br_ports.get(br_name, set())
+            for port in sorted(ports - set([dut_iface, injected_iface, vm_iface])):
+                del_ports.append('del-port %s %s' % (br_name, port))
+                changed_bridges.add(br_name)
+            for port in (injected_iface, dut_iface):
+                if port not in ports:
+                    add_ports.append('--may-exist add-port %s %s' % (br_name, port))
+                    changed_bridges.add(br_name)
+        if del_ports or add_ports:
+            VMTopology.cmd('ovs-vsctl %s' % ' -- '.join(del_ports + add_ports))
+
+        ifaces = set()
+        for _, dut_iface, injected_iface, vm_iface in fp_bindings:
+            ifaces.update([dut_iface, injected_iface, vm_iface])
+        bindings = VMTopology.get_ovs_ofports(ifaces)
+
+        replace_flows = []
+        set_bindings = []
+        for br_name, dut_iface, injected_iface, vm_iface in fp_bindings:
+            binding = '%s,%s,%s,%s' % (bindings[dut_iface], bindings[injected_iface], bindings[vm_iface],
+                                       'disconnected' if disconnect_vm else 'connected')
+            if not refresh and br_name not in changed_bridges and br_bindings.get(br_name) == binding:
+                continue
+            flows = VMTopology.get_fp_flows(bindings[dut_iface], bindings[injected_iface], bindings[vm_iface], disconnect_vm)
+            # replace old bindings with all flows of the bridge at once
+            replace_flows.append(('ovs-ofctl replace-flows %s -' % br_name, '\n'.join(flows) + '\n'))
+            set_bindings.append('br-set-external-id %s %s %s' % (br_name, OVS_FP_BINDING_EXTERNAL_ID, binding))
+
+        if replace_flows:
+            run_parallel([(VMTopology.cmd, args) for args in replace_flows])
+            VMTopology.cmd('ovs-vsctl %s' % ' -- '.join(set_bindings))
 
         return
 
     def unbind_fp_ports(self):
+        fp_bridges = []
         for attr in self.VMs.itervalues():
             for vlan_num, vlan in enumerate(attr['vlans']):
                 br_name = OVS_FP_BRIDGE_TEMPLATE % (self.vm_names[self.vm_base_index + attr['vm_offset']], vlan_num)
                 vm_iface = OVS_FP_TAP_TEMPLATE % (self.vm_names[self.vm_base_index + attr['vm_offset']], vlan_num)
-                self.unbind_ovs_ports(br_name, vm_iface)
+                fp_bridges.append((br_name, vm_iface))
+        self.run_method_parallel('unbind_ovs_ports', fp_bridges)
 
         return
 
@@ -456,43 +542,6 @@ class VMTopology(object):
 
         return
 
-    def bind_ovs_ports(self, br_name, dut_iface, injected_iface, vm_iface, disconnect_vm=False):
-        """bind dut/injected/vm ports under an ovs bridge"""
-        ports = VMTopology.get_ovs_br_ports(br_name)
-
-        if injected_iface not in ports:
-            VMTopology.cmd('ovs-vsctl add-port %s %s' % (br_name, injected_iface))
-
-        if dut_iface not in ports:
-            VMTopology.cmd('ovs-vsctl add-port %s %s' % (br_name, dut_iface))
-
-        bindings = VMTopology.get_ovs_port_bindings(br_name, dut_iface)
-        dut_iface_id = bindings[dut_iface]
-        injected_iface_id = bindings[injected_iface]
-        vm_iface_id = bindings[vm_iface]
-
-        # clear old bindings
-        VMTopology.cmd('ovs-ofctl del-flows %s' % br_name)
-
-        if disconnect_vm:
-            # Drop packets from VM
-            VMTopology.cmd("ovs-ofctl add-flow %s table=0,in_port=%s,action=drop" % (br_name, vm_iface_id))
-        else:
-            # Add flow from a VM to an external iface
-            VMTopology.cmd("ovs-ofctl add-flow %s table=0,in_port=%s,action=output:%s" % (br_name, vm_iface_id, dut_iface_id))
-
-        if disconnect_vm:
-            # Add flow from external iface to ptf container
-            VMTopology.cmd("ovs-ofctl add-flow %s table=0,in_port=%s,action=output:%s" % (br_name, dut_iface_id, injected_iface_id))
-        else:
-            # Add flow from external iface to a VM and a ptf container
-            VMTopology.cmd("ovs-ofctl add-flow %s table=0,in_port=%s,action=output:%s,%s" % (br_name, dut_iface_id, vm_iface_id, injected_iface_id))
-
-        # Add flow from a ptf container to an external iface
-        VMTopology.cmd("ovs-ofctl add-flow %s table=0,in_port=%s,action=output:%s" % (br_name, injected_iface_id, dut_iface_id))
-
-        return
-
     def unbind_ovs_ports(self, br_name, vm_port):
         """unbind all ports except the vm port from an ovs bridge"""
         self.update()
@@ -519,16 +568,16 @@ class VMTopology(object):
     def inject_host_ports(self):
         """inject dut port into the ptf docker"""
         self.update()
-        for vlan in self.host_interfaces:
-            self.add_dut_if_to_docker(PTF_FP_IFACE_TEMPLATE % vlan, self.dut_fp_ports[vlan])
+        self.run_method_parallel('add_dut_if_to_docker',
+                                 [(PTF_FP_IFACE_TEMPLATE % vlan, self.dut_fp_ports[vlan]) for vlan in self.host_interfaces])
 
         return
 
     def deject_host_ports(self):
         """deject dut port from the ptf docker"""
         self.update()
-        for vlan in self.host_interfaces:
-            self.remove_dut_if_from_docker(PTF_FP_IFACE_TEMPLATE % vlan, self.dut_fp_ports[vlan])
+        self.run_method_parallel('remove_dut_if_from_docker',
+                                 [(PTF_FP_IFACE_TEMPLATE % vlan, self.dut_fp_ports[vlan]) for vlan in self.host_interfaces])
 
     @staticmethod
     def iface_up(iface_name, pid=None):
@@ -553,19 +602,48 @@ class VMTopology(object):
             return VMTopology.cmd('nsenter -t %s -n ethtool -K %s tx off' % (pid, iface_name))
 
     @staticmethod
-    def cmd(cmdline):
-        with open(cmd_debug_fname, 'a') as fp:
-            pprint("CMD: %s" % cmdline, fp)
+    def get_fp_flows(dut_iface_id, injected_iface_id, vm_iface_id, disconnect_vm=False):
+        """flows binding dut/injected/vm ports of an ovs bridge"""
+        flows = []
+
+        if disconnect_vm:
+            # Drop packets from VM
+            flows.append("table=0,in_port=%s,action=drop" % vm_iface_id)
+        else:
+            # Add flow from a VM to an external iface
+            flows.append("table=0,in_port=%s,action=output:%s" % (vm_iface_id, dut_iface_id))
+
+        if disconnect_vm:
+            # Add flow from external iface to ptf container
+            flows.append("table=0,in_port=%s,action=output:%s" % (dut_iface_id, injected_iface_id))
+        else:
+            # Add flow from external iface to a VM and a ptf container
+            flows.append("table=0,in_port=%s,action=output:%s,%s" % (dut_iface_id, vm_iface_id, injected_iface_id))
+
+        # Add flow from a ptf container to an external iface
+        flows.append("table=0,in_port=%s,action=output:%s" % (injected_iface_id, dut_iface_id))
+
+        return flows
+
+    @staticmethod
+    def cmd(cmdline, stdin=None):
+        global cmd_debug_fp
+        with cmd_debug_lock:
+            if cmd_debug_fp is None:
+                cmd_debug_fp = open(cmd_debug_fname, 'a')
+            pprint("CMD: %s" % cmdline, cmd_debug_fp)
         cmd = cmdline.split(' ')
         process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate()
+        stdout, stderr = process.communicate(stdin)
         ret_code = process.returncode
 
         if ret_code != 0:
+            with cmd_debug_lock:
+                cmd_debug_fp.flush()
             raise Exception("ret_code=%d, error message=%s. cmd=%s" % (ret_code, stderr, cmdline))
 
-        with open(cmd_debug_fname, 'a') as fp:
-            pprint("OUTPUT: %s" % stdout, fp)
+        with cmd_debug_lock:
+            pprint("OUTPUT: %s" % stdout, cmd_debug_fp)
         return stdout
 
     @staticmethod
@@ -598,6 +676,51 @@ class VMTopology(object):
         # Flow reaches here when vlan_iface not present in result 
         raise Exception("Can't find vlan_iface_id")
 
+    @staticmethod
+    def get_ovs_state():
+        """snapshot ports and recorded front panel bindings of all ovs bridges with two ovsdb queries"""
+        def ovsdb_rows(table, columns):
+            out = VMTopology.cmd('ovs-vsctl --format=json --columns=%s list %s' % (columns, table))
+            return json.loads(out)['data']
+
+        def ovsdb_set(value):
+            # a set with one element is not wrapped into ["set", [...]]
+            if isinstance(value, list) and value[0] == 'set':
+                return value[1]
+            return [value]
+
+        port_names = {}
+        for (_, port_uuid), name in ovsdb_rows('Port', '_uuid,name'):
+            port_names[port_uuid] = name
+
+        br_ports = {}
+        br_bindings = {}
+        for name, ports, (_, external_ids) in ovsdb_rows('Bridge', 'name,ports,external_ids'):
+            br_ports[name] = set(port_names[port_uuid] for _, port_uuid in ovsdb_set(ports) if port_uuid in port_names)
+            br_bindings[name] = dict(external_ids).get(OVS_FP_BINDING_EXTERNAL_ID)
+
+        return br_ports, br_bindings
+
+    @staticmethod
+    def get_ovs_ofports(ifaces):
+        """get OpenFlow port ids of the interfaces of all ovs bridges with one call"""
+        # Interface addition may take few secs to reflect in OVS Command,
+        # Let`s retry few times in that case.
+        for retries in range(RETRIES):
+            out = VMTopology.cmd('ovs-vsctl --format=csv --data=bare --no-headings --columns=name,ofport list Interface')
+            result = {}
+            for line in out.split('\n'):
+                terms = line.replace('"', '').split(',')
+                # ofport is -1 or empty for the interfaces which are not attached yet
+                if len(terms) == 2 and terms[1].isdigit():
+                    result[terms[0]] = terms[1]
+            missing = set(ifaces) - set(result)
+            if not missing:
+                return result
+            time.sleep(2*retries+1)
+        # Flow reaches here when some interfaces are not present in result
+        raise Exception("Can't find OpenFlow port ids for interfaces: %s" % ", ".join(sorted(missing)))
+
     @staticmethod
     def ifconfig(cmdline):
         out = VMTopology.cmd(cmdline)
@@ -649,6 +772,32 @@ class VMTopology(object):
 
         return br_to_ifs, if_to_br
 
+def run_parallel(tasks, workers=PARALLEL_WORKERS):
+    """run (func, args) tasks with bounded parallelism, wait for all of them and
+    raise one exception with the errors of all failed tasks"""
+    if not tasks:
+        return
+
+    def run_task(task):
+        func, args = task
+        try:
+            func(*args)
+        except Exception as error:
+            return "%s%s: %s" % (func.__name__, str(tuple(args)), str(error))
+        return None
+
+    pool = ThreadPool(processes=min(workers, len(tasks)))
+    try:
+        errors = [error for error in pool.map(run_task, tasks) if error is not None]
+    finally:
+        pool.close()
+        pool.join()
+
+    if errors:
+        raise Exception("%d of %d tasks failed: %s" % (len(errors), len(tasks), " | ".join(errors)))
+
+    return
+
 def check_topo(topo):
     hostif_exists = False
     vms_exists = False
@@ -739,6 +888,7 @@ def main():
             dut_mgmt_port=dict(required=False, type='str'),
             fp_mtu=dict(required=False, type='int', default=DEFAULT_MTU),
             max_fp_num=dict(required=False, type='int', default=NUM_FP_VLANS_PER_FP),
+            vms=dict(required=False, type='list'),
         ),
         supports_check_mode=False)
 
@@ -805,7 +955,7 @@ def main():
                 net.add_veth_ports_to_docker()
                 if module.params['dut_mgmt_port']:
                     net.bind_mgmt_port(mgmt_bridge, module.params['dut_mgmt_port'])
-                net.bind_fp_ports()
+                net.bind_fp_ports(refresh=True)
                 net.bind_vm_backplane()
                 net.add_bp_port_to_docker(ptf_bp_ip_addr, ptf_bp_ipv6_addr)
 
@@ -886,8 +1036,8 @@ def main():
             ptf_bp_ipv6_addr = module.params['ptf_bp_ipv6_addr']
 
             if vms_exists:
-                net.unbind_fp_ports()
                 net.add_veth_ports_to_docker()
+                # stale ports are unbound by bind_fp_ports, flows of the bridges which are not changed are kept
                 net.bind_fp_ports()
             if hostif_exists:
                 net.inject_host_ports()
@@ -917,10 +1067,16 @@ def main():
             net.init(vm_set_name, topo, vm_base, dut_fp_ports)
 
             if vms_exists:
+                vms = module.params['vms']
+                if vms is not None:
+                    unknown_vms = set(vms) - set(topo['VMs'])
+                    if unknown_vms:
+                        raise Exception("VMs %s are not in the topology" % ", ".join(sorted(unknown_vms)))
+                # flows of the (re)connected VMs are always rewritten
                 if cmd == 'connect-vms':
-                    net.bind_fp_ports()
+                    net.bind_fp_ports(vms=vms, refresh=True)
                 else:
-                    net.bind_fp_ports(True)
+                    net.bind_fp_ports(True, vms=vms, refresh=True)
         else:
             raise Exception("Got wrong cmd: %s. Ansible bug?" % cmd)
 
@@ -0,0 +1,201 @@
+"""
+Persistent SSH command channel for running plain commands on the devices used in testing.
+
+Every 'command' or 'shell' ansible module call uploads the module to the host, starts a python interpreter there and
+possibly sets up a new SSH session. For trivial commands this overhead is much bigger than the command itself.
+The command channel keeps one SSH connection per host open during the whole test session. Each command is executed
+in a new SSH channel multiplexed over this connection, so commands can be sent from several threads at the same time.
+The result of a command has the same format as the result of the ansible 'command' and 'shell' modules.
+"""
+import logging
+import pipes
+import select
+import shlex
+import threading
+from datetime import datetime
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+RECV_BUFFER_SIZE = 32768
+
+
+class CommandResult(dict):
+    """
+    @summary: Result of a command in the format of the ansible 'command'/'shell' module result.
+    """
+    @property
+    def is_failed(self):
+        return self.get("failed", False)
+
+    @property
+    def is_successful(self):
+        return not self.is_failed
+
+    @property
+    def is_changed(self):
+        return self.get("changed", False)
+
+
+class SSHCommandChannel(object):
+    """
+    @summary: Persistent SSH connection to a host for executing plain commands.
+
+    The connection is established on the first command and re-established if it was dropped (device reboot, etc.).
+    """
+
+    def __init__(self, address, user, password, port=22, become=True, timeout=30):
+        """
+        @param address: IP address or name of the host.
+        @param user: SSH user name.
+        @param password: SSH user password. It is also used for 'sudo' if it requires a password.
+        @param port: SSH port.
+        @param become: Run commands as root using 'sudo'.
+        @param timeout: Timeout in seconds for establishing the connection and opening a channel.
+        """
+        self.address = address
+        self.user = user
+        self.password = password
+        self.port = port
+        self.become = become
+        self.timeout = timeout
+        self._client = None
+        self._sudo_prefix = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """
+        @summary: Get the SSH transport, connect to the host if there is no active connection.
+        """
+        with self._lock:
+            if self._client is not None:
+                transport = self._client.get_transport()
+                if transport is not None and transport.is_active():
+                    return transport
+                logger.debug("SSH connection to %s dropped, reconnecting" % self.address)
+                self._client.close()
+                self._client = None
+
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client.connect(self.address, port=self.port, username=self.user, password=self.password,
+                           timeout=self.timeout)
+            client.get_transport().set_keepalive(self.timeout)
+            self._client = client
+
+            if self.become and self._sudo_prefix is None:
+                # Send the password to 'sudo' only when it requires it, otherwise the password would be read by
+                # the command from its stdin
+                rc, _, _ = self._exec(client.get_transport(), "sudo -n true")
+                self._sudo_prefix = "sudo -H -n" if rc == 0 else "sudo -H -S -p ''"
+
+            return client.get_transport()
+
+    def _exec(self, transport, remote_cmd, stdin_data=None):
+        """
+        @summary: Execute command in a new channel and collect its output.
+        @return: Tuple (rc, stdout, stderr)
+        """
+        channel = transport.open_session(timeout=self.timeout)
+        try:
+            channel.exec_command(remote_cmd)
+            if stdin_data:
+                channel.sendall(stdin_data)
+            channel.shutdown_write()
+
+            stdout, stderr = [], []
+            while not channel.exit_status_ready() or channel.recv_ready() or channel.recv_stderr_ready():
+                select.select([channel], [], [], 1)
+                while channel.recv_ready():
+                    stdout.append(channel.recv(RECV_BUFFER_SIZE))
+                while channel.recv_stderr_ready():
+                    stderr.append(channel.recv_stderr(RECV_BUFFER_SIZE))
+
+            return channel.recv_exit_status(), "".join(stdout), "".join(stderr)
+        finally:
+            channel.close()
+
+    def _remote_cmd(self, module_name, cmd):
+        """
+        @summary: Build command line to be executed by the remote login shell.
+
+        Command of the 'command' module is not processed by shell on the host, so each argument is quoted.
+        Command of the 'shell' module is executed by '/bin/sh' as ansible does.
+        """
+        if module_name == "shell":
+            remote_cmd = "/bin/sh -c %s" % pipes.quote(cmd)
+        else:
+            remote_cmd = " ".join([pipes.quote(arg) for arg in shlex.split(cmd)])
+
+        if self.become:
+            remote_cmd = "%s %s" % (self._sudo_prefix, remote_cmd)
+        return remote_cmd
+
+    def run(self, module_name, cmd):
+        """
+        @summary: Run command on the host.
+        @param module_name: Name of the ansible module which is replaced, 'command' or 'shell'.
+        @param cmd: Command to be executed.
+        @return: CommandResult in the format of the ansible 'command'/'shell' module result.
+        """
+        transport = self._connect()
+        stdin_data = None
+        if self.become and "-S" in self._sudo_prefix:
+            stdin_data = self.password + "\n"
+
+        start = datetime.now()
+        rc, stdout, stderr = self._exec(transport, self._remote_cmd(module_name, cmd), stdin_data)
+        end = datetime.now()
+
+        stdout = stdout.rstrip("\r\n")
+        stderr = stderr.rstrip("\r\n")
+        result = CommandResult(cmd=cmd,
+                               rc=rc,
+                               stdout=stdout,
+                               stderr=stderr,
+                               stdout_lines=stdout.splitlines(),
+                               stderr_lines=stderr.splitlines(),
+                               start=str(start),
+                               end=str(end),
+                               delta=str(end - start),
+                               changed=True,
+                               failed=rc != 0)
+        if rc != 0:
+            result["msg"] = "non-zero return code"
+        return result
+
+    def close(self):
+        """
+        @summary: Close the SSH connection.
+        """
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+_channels = {}
+_channels_lock = threading.Lock()
+
+
+def get_command_channel(address, user, password, port=22):
+    """
+    @summary: Get command channel for the host. Channels are shared, so all objects of the same host use one
+        SSH connection during the test session.
+    """
+    key = (address, port, user)
+    with _channels_lock:
+        if key not in _channels:
+            _channels[key] = SSHCommandChannel(address, user, password, port=port)
+        return _channels[key]
+
+
+def close_command_channels():
+    """
+    @summary: Close all opened command channels.
+    """
+    with _channels_lock:
+        for channel in _channels.values():
+            channel.close()
+        _channels.clear()
@@ -7,6 +7,7 @@ modules, we have no other choice, at least for interacting with SONiC, localhost
 
 We can consider using netmiko for interacting with the VMs used in testing.
 """
+import functools
 import json
 import logging
 import os
@@ -15,6 +16,10 @@ from datetime import datetime
 
 from errors import RunAnsibleModuleFail
 from errors import UnsupportedAnsibleModule
+from command_channel import get_command_channel
+
+# Modules which can be executed through the persistent command channel
+COMMAND_CHANNEL_MODULES = ("command", "shell")
 
 class AnsibleHostBase(object):
     """
@@ -31,30 +36,45 @@ class AnsibleHostBase(object):
         else:
             self.host = ansible_adhoc(become=True)[hostname]
         self.hostname = hostname
+        self.command_channel = None
+
+    def enable_command_channel(self, address, user, password):
+        """
+        @summary: Run plain 'command' and 'shell' module calls through a persistent SSH connection to the host
+            instead of ansible. Calls with extra module arguments (chdir, creates, etc.) still use ansible.
+        @param address: IP address of the host.
+        @param user: SSH user name.
+        @param password: SSH user password.
+        """
+        self.command_channel = get_command_channel(address, user, password)
 
     def __getattr__(self, item):
         if self.host.has_module(item):
-            self.module_name = item
-            self.module = getattr(self.host, item)
-
-            return self._run
+            # Module is bound to the returned function instead of being stored in the object, so modules can be run
+            # from several threads at the same time
+            return functools.partial(self._run, item)
         else:
             raise UnsupportedAnsibleModule("Unsupported module")
 
-    def _run(self, *module_args, **complex_args):
+    def _run(self, module_name, *module_args, **complex_args):
+        module = getattr(self.host, module_name)
         module_ignore_errors = complex_args.pop('module_ignore_errors', False)
         module_async = complex_args.pop('module_async', False)
 
         if module_async:
             def run_module(module_args, complex_args):
-                return self.module(*module_args, **complex_args)[self.hostname]
+                return module(*module_args, **complex_args)[self.hostname]
             pool = ThreadPool()
             result = pool.apply_async(run_module, (module_args, complex_args))
             return pool, result
 
-        res = self.module(*module_args, **complex_args)[self.hostname]
+        if self.command_channel is not None and module_name in COMMAND_CHANNEL_MODULES \
+                and len(module_args) == 1 and not complex_args:
+            res = self.command_channel.run(module_name, module_args[0])
+        else:
+            res = module(*module_args, **complex_args)[self.hostname]
         if res.is_failed and not module_ignore_errors:
-            raise RunAnsibleModuleFail("run module {} failed, errmsg {}".format(self.module_name, res))
+            raise RunAnsibleModuleFail("run module {} failed, errmsg {}".format(module_name, res))
 
         return res
 
@@ -184,12 +204,54 @@ class SonicHost(AnsibleHostBase):
         except:
             return False
 
-    def critical_services_status(self):
-        result = {}
-        for service in self.CRITICAL_SERVICES:
-            result[service] = self.is_service_fully_started(service)
+    def get_services_status(self, services):
+        """
+        @summary: Get status of several SONiC specific services in one remote command. For each service the
+            ActiveState and SubState of the systemd service and the state of the Docker container with the same
+            name are collected.
+        @param services: List of service names.
+        @return: Returns a dictionary keyed by service name, for example:
+            {
+                "swss": {"ActiveState": "active", "SubState": "running", "container_running": True},
+                "syncd": {"ActiveState": "activating", "SubState": "start", "container_running": False}
+            }
+        """
+        separator = "---docker---"
+        names = " ".join(services)
+        cmd = "systemctl show -p Id -p ActiveState -p SubState %s; echo %s; " \
+              "docker inspect -f \{\{.Name\}\}=\{\{.State.Running\}\} %s 2>/dev/null; true" % (names, separator, names)
+        systemd_output, _, docker_output = self.shell(cmd)["stdout"].partition(separator)
+
+        result = dict([(service, {"ActiveState": None, "SubState": None, "container_running": False})
+                       for service in services])
+        # Properties of each service are printed as a block of 'name=value' lines, blocks are separated by empty line
+        for block in systemd_output.strip().split("\n\n"):
+            props = dict([line.split("=", 1) for line in block.splitlines() if "=" in line])
+            service = props.pop("Id", "").rsplit(".service", 1)[0]
+            if service in result:
+                result[service].update(props)
+        # Name of a container is printed with leading '/', for example: '/swss=true'
+        for line in docker_output.splitlines():
+            name, _, running = line.strip().lstrip("/").partition("=")
+            if name in result:
+                result[name]["container_running"] = running == "true"
+
         return result
 
+    def critical_services_status(self):
+        """
+        @summary: Check whether each of the SONiC critical services is fully started. Status of all the services is
+            collected in one remote command.
+        @return: Returns a dictionary keyed by service name with True value for fully started services.
+        """
+        try:
+            services_status = self.get_services_status(self.CRITICAL_SERVICES)
+        except Exception as e:
+            logging.debug("Failed to get status of critical services: %s" % repr(e))
+            return dict([(service, False) for service in self.CRITICAL_SERVICES])
+
+        return dict([(service, status["container_running"]) for service, status in services_status.items()])
+
     def critical_services_fully_started(self):
         """
         @summary: Check whether all the SONiC critical services have started
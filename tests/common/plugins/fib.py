@@ -1,61 +1,189 @@
 import sys
 import time
 import math
+import json
+import logging
 import requests
 import pytest
 import ipaddr as ipaddress
 
-def announce_routes(ptfip, port, family, podset_number, tor_number, tor_subnet_number,
-                    spine_asn, leaf_asn_start, tor_asn_start,
-                    nexthop, nexthop_v6,
-                    tor_subnet_size = 128, max_tor_subnet_number = 16):
-    messages = []
-
-    # default route
-    if family in ["v4", "both"]:
-        messages.append("announce route 0.0.0.0/0 next-hop {} as-path [ {} ]".format(nexthop, spine_asn))
-    if family in ["v6", "both"]:
-        messages.append("announce route ::/0 next-hop {} as-path [ {} ]".format(nexthop_v6, spine_asn))
-
-    # NOTE: Using large enough values (e.g., podset_number = 200,
-    # us to overflow the 192.168.0.0/16 private address space here.
-    # This should be fine for internal use, but may pose an issue if used otherwise
-    for podset in range(0, podset_number):
-        for tor in range(0, tor_number):
-            for subnet in range(0, tor_subnet_number):
+logger = logging.getLogger(__name__)
+
+BULK_BATCH_SIZE = 1000
+
+def command_blocks(commands, block_size):
+    """
+    @summary: Join the commands into newline-terminated blocks of block_size commands
+    """
+    block = []
+    for command in commands:
+        block.append(command + "\n")
+        if len(block) >= block_size:
+            yield "".join(block)
+            block = []
+    if block:
+        yield "".join(block)
+
+def send_bulk_body(ptfip, port, blocks, batch_size=BULK_BATCH_SIZE, rate=0):
+    """
+    @summary: Send announce/withdraw commands to the exabgp http api bulk endpoint.
+        The blocks of commands are streamed as chunked line-delimited body, the api writes them
+        to exabgp in batches of batch_size commands, at most rate commands per second (0 - no limit),
+        and acknowledges every batch.
+    @param blocks: iterable of newline-terminated blocks of exabgp commands
+    @return: number of routes announced through the api
+    """
+    url = "http://%s:%d/bulk" % (ptfip, port)
+    sent = {"commands": 0}
+
+    def body():
+        for block in blocks:
+            sent["commands"] += block.count("\n")
+            yield block
+
+    r = requests.post(url, data=body(),
+                      params={"batch": batch_size, "rate": rate}, stream=True)
+    assert r.status_code == 200
+
+    ack = {}
+    for line in r.iter_lines():
+        if not line:
+            continue
+        ack = json.loads(line)
+        logger.debug("exabgp %s:%d acknowledged %s" % (ptfip, port, ack))
+    assert ack.get("done"), "exabgp %s:%d didn't acknowledge all batches" % (ptfip, port)
+    assert ack["commands"] == sent["commands"], \
+        "exabgp %s:%d accepted %d of %d commands" % (ptfip, port, ack["commands"], sent["commands"])
+    logger.info("exabgp %s:%d accepted %d commands in %d batches, %d routes announced" %
+                (ptfip, port, ack["commands"], ack["batches"], ack["routes"]))
+
+    return ack["routes"]
+
+def send_bulk_commands(ptfip, port, commands, batch_size=BULK_BATCH_SIZE, rate=0):
+    """
+    @summary: Send announce/withdraw commands to the exabgp http api bulk endpoint, see send_bulk_body()
+    @param commands: iterable of exabgp commands, e.g. generator
+    @return: number of routes announced through the api
+    """
+    return send_bulk_body(ptfip, port, command_blocks(commands, batch_size), batch_size, rate)
+
+class RouteSet(object):
+    """
+    @summary: Routes announced to the DUT by the fib fixtures: the default route and the subnets
+        of all tors of all podsets with their AS paths.
+        The prefixes are generated lazily on the first iteration and kept after that. The blocks of
+        exabgp commands are kept too, so the same route set is streamed to many peers without
+        repeating the prefix arithmetic and the command formatting.
+    """
+    def __init__(self, podset_number, tor_number, tor_subnet_number,
+                 spine_asn, leaf_asn_start, tor_asn_start,
+                 tor_subnet_size = 128, max_tor_subnet_number = 16):
+        self.podset_number = podset_number
+        self.tor_number = tor_number
+        self.tor_subnet_number = tor_subnet_number
+        self.spine_asn = spine_asn
+        self.leaf_asn_start = leaf_asn_start
+        self.tor_asn_start = tor_asn_start
+        self.tor_subnet_size = tor_subnet_size
+        self.max_tor_subnet_number = max_tor_subnet_number
+        self._routes = None
+        self._blocks = {}
+
+    def _generate(self):
+        """
+        @summary: Generate (prefix_v4, prefix_v6, aspath) of every route
+        """
+        # default route
+        yield "0.0.0.0/0", "::/0", "{}".format(self.spine_asn)
+
+        prefixlen_v4 = (32 - int(math.log(self.tor_subnet_size, 2)))
+        # NOTE: Using large enough values (e.g., podset_number = 200,
+        # us to overflow the 192.168.0.0/16 private address space here.
+        # This should be fine for internal use, but may pose an issue if used otherwise
+        for podset in range(0, self.podset_number):
+            leaf_asn = self.leaf_asn_start + podset
+            for tor in range(0, self.tor_number):
                 # Skip tor 0 podset 0
                 if podset == 0 and tor == 0:
                     continue
-                suffix = ( (podset * tor_number * max_tor_subnet_number * tor_subnet_size) + \
-                      (tor * max_tor_subnet_number * tor_subnet_size) + \
-                      (subnet * tor_subnet_size) )
-                octet2 = (168 + (suffix / (256 ** 2)))
-                octet1 = (192 + (octet2 / 256))
-                octet2 = (octet2 % 256)
-                octet3 = ((suffix / 256) % 256)
-                octet4 = (suffix % 256)
-                prefixlen_v4 = (32 - int(math.log(tor_subnet_size, 2)))
-
-                prefix = "{}.{}.{}.{}/{}".format(octet1, octet2, octet3, octet4, prefixlen_v4)
-                prefix_v6 = "20%02X:%02X%02X:0:%02X::/64" % (octet1, octet2, octet3, octet4)
-
-                leaf_asn = leaf_asn_start + podset
-                tor_asn  = tor_asn_start + tor
+                tor_asn = self.tor_asn_start + tor
                 if podset == 0:
                     aspath = "{}".format(tor_asn)
                 else:
-                    aspath = "{} {} {}".format(spine_asn, leaf_asn, tor_asn)
-
-                if family in ["v4", "both"]:
-                    messages.append("announce route {} next-hop {} as-path [ {} ]".format(prefix, nexthop, aspath))
-                if family in ["v6", "both"]:
-                    messages.append("announce route {} next-hop {} as-path [ {} ]".format(prefix_v6, nexthop_v6, aspath))
-
-    url = "http://%s:%d" % (ptfip, port)
-    data = { "commands": ";".join(messages) }
-    r = requests.post(url, data=data)
-    print r
-    assert r.status_code == 200
+                    aspath = "{} {} {}".format(self.spine_asn, leaf_asn, tor_asn)
+
+                for subnet in range(0, self.tor_subnet_number):
+                    suffix = ( (podset * self.tor_number * self.max_tor_subnet_number * self.tor_subnet_size) + \
+                          (tor * self.max_tor_subnet_number * self.tor_subnet_size) + \
+                          (subnet * self.tor_subnet_size) )
+                    octet2 = (168 + (suffix / (256 ** 2)))
+                    octet1 = (192 + (octet2 / 256))
+                    octet2 = (octet2 % 256)
+                    octet3 = ((suffix / 256) % 256)
+                    octet4 = (suffix % 256)
+
+                    prefix = "{}.{}.{}.{}/{}".format(octet1, octet2, octet3, octet4, prefixlen_v4)
+                    prefix_v6 = "20%02X:%02X%02X:0:%02X::/64" % (octet1, octet2, octet3, octet4)
+
+                    yield prefix, prefix_v6, aspath
+
+    def __iter__(self):
+        """
+        @summary: Iterate (prefix_v4, prefix_v6, aspath) of every route.
+            The first complete iteration keeps the routes, the next iterations reuse them.
+        """
+        if self._routes is not None:
+            for route in self._routes:
+                yield route
+            return
+
+        routes = []
+        for route in self._generate():
+            routes.append(route)
+            yield route
+        self._routes = routes
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def commands(self, family, nexthop, nexthop_v6, action = "announce"):
+        """
+        @summary: Iterate exabgp commands announcing/withdrawing the routes of the address family
+        @param action: "announce" or "withdraw"
+        """
+        for prefix, prefix_v6, aspath in self:
+            if family in ["v4", "both"]:
+                yield "{} route {} next-hop {} as-path [ {} ]".format(action, prefix, nexthop, aspath)
+            if family in ["v6", "both"]:
+                yield "{} route {} next-hop {} as-path [ {} ]".format(action, prefix_v6, nexthop_v6, aspath)
+
+    def command_blocks(self, family, nexthop, nexthop_v6, action = "announce", block_size = BULK_BATCH_SIZE):
+        """
+        @summary: Iterate newline-terminated blocks of the exabgp commands of commands().
+            The first complete iteration keeps the blocks, the next iterations with the same
+            arguments reuse them.
+        """
+        key = (family, str(nexthop), str(nexthop_v6), action, block_size)
+        if key in self._blocks:
+            for block in self._blocks[key]:
+                yield block
+            return
+
+        blocks = []
+        for block in command_blocks(self.commands(family, nexthop, nexthop_v6, action), block_size):
+            blocks.append(block)
+            yield block
+        self._blocks[key] = blocks
+
+def announce_routes(ptfip, port, family, route_set, nexthop, nexthop_v6,
+                    action = "announce", batch_size = BULK_BATCH_SIZE, rate = 0):
+    """
+    @summary: Announce/withdraw the routes of the route set to the exabgp instance listening on the port
+    @param route_set: RouteSet to announce, it is shared by all peers
+    @return: number of routes announced through the api
+    """
+    return send_bulk_body(ptfip, port, route_set.command_blocks(family, nexthop, nexthop_v6, action, batch_size),
+                          batch_size, rate)
 
 @pytest.fixture(scope='module')
 def fib_t0(ptfhost, testbed):
@@ -70,6 +198,10 @@ def fib_t0(ptfhost, testbed):
     leaf_asn_start  = 64600
     tor_asn_start   = 65500
 
+    route_set = RouteSet(podset_number, tor_number, tor_subnet_number,
+                         spine_asn, leaf_asn_start, tor_asn_start,
+                         tor_subnet_size, max_tor_subnet_number)
+
     topo = testbed['topo']['properties']
     ptf_hostname = testbed['ptf']
     ptfip = ptfhost.host.options['inventory_manager'].get_host(ptf_hostname).vars['ansible_host']
@@ -107,10 +239,8 @@ def fib_t0(ptfhost, testbed):
         port = 5000 + vm_offset
         port6 = 6000 + vm_offset
 
-        announce_routes(ptfip, port, "v4", podset_number, tor_number, tor_subnet_number,
-                        spine_asn, leaf_asn_start, tor_asn_start,
-                        local_ip, local_ipv6)
+        announce_routes(ptfip, port, "v4", route_set, local_ip, local_ipv6)
+
+        announce_routes(ptfip, port6, "v6", route_set, local_ip, local_ipv6)
 
-        announce_routes(ptfip, port6, "v6", podset_number, tor_number, tor_subnet_number,
-                        spine_asn, leaf_asn_start, tor_asn_start,
-                        local_ip, local_ipv6)
+    return route_set
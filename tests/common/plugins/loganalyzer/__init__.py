@@ -7,11 +7,15 @@ from loganalyzer import LogAnalyzer
 def pytest_addoption(parser):
     parser.addoption("--disable_loganalyzer", action="store_true", default=False,
                      help="disable loganalyzer analysis for 'loganalyzer' fixture")
+    parser.addoption("--loganalyzer_on_dut", action="store_true", default=False,
+                     help="analyze syslog on the DUT and download only the analysis summary, "
+                          "syslog is downloaded only if analysis failed")
 
 
 @pytest.fixture(autouse=True)
 def loganalyzer(duthost, request):
-    loganalyzer = LogAnalyzer(ansible_host=duthost, marker_prefix=request.node.name)
+    loganalyzer = LogAnalyzer(ansible_host=duthost, marker_prefix=request.node.name,
+                              analyze_on_dut=request.config.getoption("--loganalyzer_on_dut"))
     logging.info("Add start marker into DUT syslog")
     marker = loganalyzer.init()
     yield loganalyzer
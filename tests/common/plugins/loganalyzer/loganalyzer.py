@@ -2,12 +2,17 @@ import sys
 import logging
 import os
 import re
+import csv
+import json
+import shutil
+import tempfile
 import time
 import pprint
 
 import system_msg_handler
 
 from system_msg_handler import AnsibleLogAnalyzer as ansible_loganalyzer
+from system_msg_handler import get_msg_matcher, build_summary
 from os.path import join, split
 from os.path import normpath
 
@@ -16,6 +21,7 @@ COMMON_MATCH = join(split(__file__)[0], "loganalyzer_common_match.txt")
 COMMON_IGNORE = join(split(__file__)[0], "loganalyzer_common_ignore.txt")
 COMMON_EXPECT = join(split(__file__)[0], "loganalyzer_common_expect.txt")
 SYSLOG_TMP_FOLDER = "/tmp/pytest-run/syslog"
+REGEXP_DIR_NAME = "loganalyzer_regexp"
 
 
 class LogAnalyzerError(Exception):
@@ -25,9 +31,10 @@ class LogAnalyzerError(Exception):
 
 
 class LogAnalyzer:
-    def __init__(self, ansible_host, marker_prefix, dut_run_dir="/tmp"):
+    def __init__(self, ansible_host, marker_prefix, dut_run_dir="/tmp", analyze_on_dut=False):
         self.ansible_host = ansible_host
         self.dut_run_dir = dut_run_dir
+        self.analyze_on_dut = analyze_on_dut
         self.extracted_syslog = os.path.join(self.dut_run_dir, "syslog")
         self.marker_prefix = marker_prefix
         self.ansible_loganalyzer = ansible_loganalyzer(self.marker_prefix, False)
@@ -36,6 +43,7 @@ class LogAnalyzer:
         self.expect_regex = []
         self.ignore_regex = []
         self._markers = []
+        self._log_positions = {}
 
     def _add_end_marker(self, marker):
         """
@@ -62,6 +70,18 @@ class LogAnalyzer:
         """
         self.analyze(self._markers.pop())
 
+    def _is_log_failed(self, result):
+        """
+        Check summary counters: total match or expected missing match is not zero, or expected_match is zero
+        when there is configured expected regexp in self.expect_regex list
+        """
+        total = result["total"]
+        if total["match"] != 0 or total["expected_missing_match"] != 0:
+            return True
+
+        # Check for negative case
+        return bool(self.expect_regex) and total["expected_match"] == 0
+
     def _verify_log(self, result):
         """
         Verify that total match and expected missing match equals to zero or raise exception otherwise.
@@ -69,11 +89,7 @@ class LogAnalyzer:
         """
         if not result:
             raise LogAnalyzerError("Log analyzer failed - no result.")
-        if result["total"]["match"] != 0 or result["total"]["expected_missing_match"] != 0:
-            raise LogAnalyzerError(result)
-
-        # Check for negative case
-        if self.expect_regex and result["total"]["expected_match"] == 0:
+        if self._is_log_failed(result):
             raise LogAnalyzerError(result)
 
     def update_marker_prefix(self, marker_prefix):
@@ -132,7 +148,10 @@ class LogAnalyzer:
         cmd = "python {run_dir}/loganalyzer.py --action init --run_id {start_marker}".format(run_dir=self.dut_run_dir, start_marker=start_marker)
 
         logging.debug("Adding start marker '{}'".format(start_marker))
-        self.ansible_host.command(cmd)
+        position = self.ansible_host.command(cmd)["stdout"].strip()
+        # Syslog position (inode:offset) taken before adding start marker is used to extract syslog in "analyze"
+        if re.match(r"^\d+:\d+$", position):
+            self._log_positions[start_marker] = position
         return start_marker
 
     def analyze(self, marker, fail=True):
@@ -145,18 +164,49 @@ class LogAnalyzer:
         @return: If "fail" is False - return dictionary of parsed syslog summary, if dictionary can't be parsed - return empty dictionary. If "fail" is True and if found match messages - raise exception.
         """
         logging.debug("Loganalyzer analyze")
-        analyzer_summary = {"total": {"match": 0, "expected_match": 0, "expected_missing_match": 0},
-                            "match_files": {},
-                            "match_messages": {},
-                            "expect_messages": {},
-                            "unused_expected_regexp": []
-                            }
         tmp_folder = ".".join((SYSLOG_TMP_FOLDER, time.strftime("%Y-%m-%d-%H:%M:%S", time.gmtime())))
         self.ansible_loganalyzer.run_id = marker
 
         # Add end marker into DUT syslog
         self._add_end_marker(marker)
 
+        # On DUT extract syslog files from /var/log/ and create one file by location - /tmp/syslog
+        if not self._extract_from_position(marker):
+            self._extract_by_marker(marker)
+
+        if self.analyze_on_dut:
+            analyzer_summary = self._analyze_on_dut(marker)
+            if not analyzer_summary or self._is_log_failed(analyzer_summary):
+                # Download extracted logs only when they are needed to debug the failure
+                self.save_extracted_log(dest=tmp_folder)
+                logging.info("Extracted syslog is saved to {}".format(tmp_folder))
+        else:
+            # Download extracted logs from the DUT to the temporal folder defined in SYSLOG_TMP_FOLDER
+            self.save_extracted_log(dest=tmp_folder)
+
+            match_messages_regex = get_msg_matcher(self.match_regex)
+            ignore_messages_regex = get_msg_matcher(self.ignore_regex)
+            expect_messages_regex = get_msg_matcher(self.expect_regex)
+
+            analyzer_parse_result = self.ansible_loganalyzer.analyze_file_list([tmp_folder], match_messages_regex, ignore_messages_regex, expect_messages_regex)
+            # Print syslog file content and remove the file
+            with open(tmp_folder) as fo:
+                logging.debug("Syslog content:\n\n{}".format(fo.read()))
+            os.remove(tmp_folder)
+
+            analyzer_summary = build_summary(analyzer_parse_result, expect_messages_regex)
+
+        if fail:
+            self._verify_log(analyzer_summary)
+        else:
+            return analyzer_summary
+
+    def _extract_by_marker(self, marker):
+        """
+        @summary: Extract syslog on the DUT starting from the start marker. Logrotate is disabled during extraction.
+
+        @param marker: Marker obtained from "init" method.
+        """
         try:
             # Disable logrotate cron task
             self.ansible_host.command("sed -i 's/^/#/g' /etc/cron.d/logrotate")
@@ -182,47 +232,66 @@ class LogAnalyzer:
             # Enable logrotate cron task back
             self.ansible_host.command("sed -i 's/^#//g' /etc/cron.d/logrotate")
 
-        # Download extracted logs from the DUT to the temporal folder defined in SYSLOG_TMP_FOLDER
-        self.save_extracted_log(dest=tmp_folder)
-
-        match_messages_regex = re.compile('|'.join(self.match_regex)) if len(self.match_regex) else None
-        ignore_messages_regex = re.compile('|'.join(self.ignore_regex)) if len(self.ignore_regex) else None
-        expect_messages_regex = re.compile('|'.join(self.expect_regex)) if len(self.expect_regex) else None
-
-        analyzer_parse_result = self.ansible_loganalyzer.analyze_file_list([tmp_folder], match_messages_regex, ignore_messages_regex, expect_messages_regex)
-        # Print syslog file content and remove the file
-        with open(tmp_folder) as fo:
-            logging.debug("Syslog content:\n\n{}".format(fo.read()))
-        os.remove(tmp_folder)
-
-        total_match_cnt = 0
-        total_expect_cnt = 0
-        expected_lines_total = []
-        unused_regex_messages = []
-
-        for key, value in analyzer_parse_result.iteritems():
-            matching_lines, expecting_lines = value
-            analyzer_summary["total"]["match"] += len(matching_lines)
-            analyzer_summary["total"]["expected_match"] += len(expecting_lines)
-            analyzer_summary["match_files"][key] = {"match": len(matching_lines), "expected_match": len(expecting_lines)}
-            analyzer_summary["match_messages"][key] = matching_lines
-            analyzer_summary["expect_messages"][key] = expecting_lines
-            expected_lines_total.extend(expecting_lines)
-
-        # Find unused regex matches
-        for regex in self.expect_regex:
-            for line in expected_lines_total:
-                if re.search(regex, line):
-                    break
-            else:
-                unused_regex_messages.append(regex)
-        analyzer_summary["total"]["expected_missing_match"] = len(unused_regex_messages)
-        analyzer_summary["unused_expected_regexp"] = unused_regex_messages
+    def _extract_from_position(self, marker):
+        """
+        @summary: Extract syslog on the DUT starting from the position taken in "init" method.
+                  Rotated syslog is followed by inode, so logrotate needn't be disabled and start marker needn't be searched.
 
-        if fail:
-            self._verify_log(analyzer_summary)
-        else:
-            return analyzer_summary
+        @param marker: Marker obtained from "init" method.
+
+        @return: True if syslog was extracted, False if position is unknown or log file with the position doesn't exist anymore.
+        """
+        position = self._log_positions.pop(marker, None)
+        if position is None:
+            return False
+
+        cmd = "python {run_dir}/loganalyzer.py --action extract --run_id {marker} --position {position} --target_file {target}".format(
+            run_dir=self.dut_run_dir, marker=marker, position=position, target=self.extracted_syslog)
+        res = self.ansible_host.command(cmd, module_ignore_errors=True)
+        if res["rc"] != 0:
+            logging.debug("Failed to extract syslog from position {}: {}".format(position, res["stdout"]))
+            return False
+
+        return True
+
+    def _copy_regexp_to_dut(self):
+        """
+        @summary: Save currently configured match, ignore and expect regular expressions into files
+                  in the format of legacy loganalyzer and copy them to the DUT.
+
+        @return: Path to the folder on the DUT with "match.txt", "ignore.txt" and "expect.txt" files.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        regexp_dir = os.path.join(tmp_dir, REGEXP_DIR_NAME)
+        os.mkdir(regexp_dir)
+        try:
+            for name, regexp_list in (("match", self.match_regex), ("ignore", self.ignore_regex), ("expect", self.expect_regex)):
+                with open(os.path.join(regexp_dir, "{}.txt".format(name)), "w") as fo:
+                    writer = csv.writer(fo, quoting=csv.QUOTE_ALL)
+                    for regexp in regexp_list:
+                        writer.writerow(["r", regexp])
+            self.ansible_host.copy(src=regexp_dir, dest=self.dut_run_dir)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        return os.path.join(self.dut_run_dir, REGEXP_DIR_NAME)
+
+    def _analyze_on_dut(self, marker):
+        """
+        @summary: Analyze extracted syslog on the DUT. Only the analysis summary is transferred from the DUT.
+
+        @param marker: Marker obtained from "init" method.
+
+        @return: Dictionary of parsed syslog summary.
+        """
+        regexp_dir = self._copy_regexp_to_dut()
+        cmd = "python {run_dir}/loganalyzer.py --action summary --run_id {marker} --logs {log} " \
+              "--match_files_in {regexp_dir}/match.txt --ignore_files_in {regexp_dir}/ignore.txt " \
+              "--expect_files_in {regexp_dir}/expect.txt".format(run_dir=self.dut_run_dir, marker=marker,
+                                                                 log=self.extracted_syslog, regexp_dir=regexp_dir)
+
+        logging.debug("Analyzing syslog on the DUT")
+        return json.loads(self.ansible_host.command(cmd)["stdout"])
 
     def save_extracted_log(self, dest):
         """
@@ -1,43 +1,63 @@
 import json
 import logging
 import time
+from multiprocessing.pool import ThreadPool
 
 from common.utilities import wait
 
 logger = logging.getLogger(__name__)
 SYSTEM_STABILIZE_MAX_TIME = 300
+CHECK_MIN_INTERVAL = 5      # Interval between the first retries of a failed check
+CHECK_MAX_INTERVAL = 20     # Interval is doubled after each retry up to this value
 
 
-def check_services(dut):
-    logger.info("Checking services status...")
-
+def _get_stabilize_timeout(dut):
+    """
+    @summary: Get how long a failed check should be retried. Checks are retried until the networking service is
+        up for SYSTEM_STABILIZE_MAX_TIME seconds.
+    """
     networking_uptime = dut.get_networking_uptime().seconds
     timeout = max((SYSTEM_STABILIZE_MAX_TIME - networking_uptime), 0)
-    interval = 20
-    logger.info("networking_uptime=%d seconds, timeout=%d seconds, interval=%d seconds" % \
-                (networking_uptime, timeout, interval))
-
-    check_result = {"failed": True, "check_item": "services"}
-    if timeout == 0:    # Check services status, do not retry.
-        services_status = dut.critical_services_status()
-        check_result["failed"] = False if all(services_status.values()) else True
-        check_result["services_status"] = services_status
-    else:               # Retry checking service status
-        start = time.time()
-        elapsed = 0
-        while elapsed < timeout:
-            services_status = dut.critical_services_status()
-            check_result["failed"] = False if all(services_status.values()) else True
-            check_result["services_status"] = services_status
-
-            if check_result["failed"]:
-                wait(interval, msg="Not all services are started, wait %d seconds to retry. Remaining time: %d %s" % \
-                     (interval, int(timeout - elapsed), str(check_result["services_status"])))
-                elapsed = time.time() - start
-            else:
-                break
-
-    logger.info("Done checking services status.")
+    logger.info("%s: networking_uptime=%d seconds, timeout=%d seconds" % (dut.hostname, networking_uptime, timeout))
+    return timeout
+
+
+def _retry_check(check, timeout, *args):
+    """
+    @summary: Run the check until it passes or until timeout. The poll interval starts from CHECK_MIN_INTERVAL
+        and is doubled after each failed attempt up to CHECK_MAX_INTERVAL, so the check returns soon after the
+        system gets stable.
+    @param check: Function performing the check once and returning check result.
+    @param timeout: Maximum time to retry the check. If it is 0, the check is performed once.
+    @param *args: Args of the 'check' function.
+    @return: Result of the last performed check.
+    """
+    start = time.time()
+    interval = CHECK_MIN_INTERVAL
+    while True:
+        check_result = check(*args)
+        remaining = timeout - (time.time() - start)
+        if not check_result["failed"] or remaining <= 0:
+            return check_result
+
+        wait_time = min(interval, remaining)
+        wait(wait_time, msg="Check '%s' failed, wait %d seconds to retry. Remaining time: %d, %s" % \
+             (check_result["check_item"], wait_time, int(remaining), str(check_result)))
+        interval = min(interval * 2, CHECK_MAX_INTERVAL)
+
+
+def _check_services_once(dut):
+    services_status = dut.critical_services_status()
+    return {"failed": not all(services_status.values()),
+            "check_item": "services",
+            "host": dut.hostname,
+            "services_status": services_status}
+
+
+def check_services(dut, timeout):
+    logger.info("Checking services status on %s..." % dut.hostname)
+    check_result = _retry_check(_check_services_once, timeout, dut)
+    logger.info("Done checking services status on %s." % dut.hostname)
     return check_result
 
 
@@ -54,14 +74,16 @@ def _find_down_ports(dut, interfaces):
     return down_ports
 
 
-def check_interfaces(dut):
-    logger.info("Checking interfaces status...")
+def _check_interfaces_once(dut, interfaces):
+    down_ports = _find_down_ports(dut, interfaces)
+    return {"failed": len(down_ports) > 0,
+            "check_item": "interfaces",
+            "host": dut.hostname,
+            "down_ports": down_ports}
 
-    networking_uptime = dut.get_networking_uptime().seconds
-    timeout = max((SYSTEM_STABILIZE_MAX_TIME - networking_uptime), 0)
-    interval = 20
-    logger.info("networking_uptime=%d seconds, timeout=%d seconds, interval=%d seconds" % \
-                (networking_uptime, timeout, interval))
+
+def check_interfaces(dut, timeout):
+    logger.info("Checking interfaces status on %s..." % dut.hostname)
 
     cfg_facts = dut.config_facts(host=dut.hostname, source="persistent")['ansible_facts']
     interfaces = [k for k,v in cfg_facts["PORT"].items() if "admin_status" in v and v["admin_status"] == "up"]
@@ -72,39 +94,41 @@ def check_interfaces(dut):
 
     logger.info(json.dumps(interfaces, indent=4))
 
-    check_result = {"failed": True, "check_item": "interfaces"}
-    if timeout == 0:    # Check interfaces status, do not retry.
-        down_ports = _find_down_ports(dut, interfaces)
-        check_result["failed"] = True if len(down_ports) > 0 else False
-        check_result["down_ports"] = down_ports
-    else:               # Retry checking interface status
-        start = time.time()
-        elapsed = 0
-        while elapsed < timeout:
-            down_ports = _find_down_ports(dut, interfaces)
-            check_result["failed"] = True if len(down_ports) > 0 else False
-            check_result["down_ports"] = down_ports
-
-            if check_result["failed"]:
-                wait(interval, msg="Found down ports, wait %d seconds to retry. Remaining time: %d, down_ports=%s" % \
-                     (interval, int(timeout - elapsed), str(check_result["down_ports"])))
-                elapsed = time.time() - start
-            else:
-                break
-
-    logger.info("Done checking interfaces status.")
+    check_result = _retry_check(_check_interfaces_once, timeout, dut, interfaces)
+    logger.info("Done checking interfaces status on %s." % dut.hostname)
     return check_result
 
 
-def do_checks(dut, check_items):
-    results = []
-    for item in check_items:
-        if item == "services":
-            results.append(check_services(dut))
-        elif item == "interfaces":
-            results.append(check_interfaces(dut))
-
-    return results
+CHECKS = {
+    "services": check_services,
+    "interfaces": check_interfaces
+}
+
+
+def do_checks(duts, check_items):
+    """
+    @summary: Perform sanity checks. Checks of all the DUTs and all the check items run concurrently, each check
+        returns as soon as it passes.
+    @param duts: DUT host object or list of DUT host objects.
+    @param check_items: Items to be checked.
+    @return: List of check results.
+    """
+    if not isinstance(duts, list):
+        duts = [duts]
+    check_items = [item for item in check_items if item in CHECKS]
+    if not check_items:
+        return []
+
+    pool = ThreadPool(len(duts) * len(check_items))
+    try:
+        # Retry timeout depends on the DUT only, so it is shared by all the checks of a DUT
+        timeouts = pool.map(_get_stabilize_timeout, duts)
+        tasks = [pool.apply_async(CHECKS[item], (dut, timeout))
+                 for dut, timeout in zip(duts, timeouts) for item in check_items]
+        return [task.get() for task in tasks]
+    finally:
+        pool.close()
+        pool.join()
 
 
 def print_logs(dut, print_logs):
@@ -13,6 +13,7 @@ import ipaddr as ipaddress
 from ansible_host import AnsibleHost
 from collections import defaultdict
 from common.devices import SonicHost, Localhost, PTFHost
+from common.command_channel import close_command_channels
 
 logger = logging.getLogger(__name__)
 
@@ -69,6 +70,8 @@ class TestbedInfo(object):
 def pytest_addoption(parser):
     parser.addoption("--testbed", action="store", default=None, help="testbed name")
     parser.addoption("--testbed_file", action="store", default=None, help="testbed file name")
+    parser.addoption("--persistent_ssh", action="store_true", default=False,
+                     help="run plain 'command' and 'shell' calls on DUT through a persistent SSH connection instead of ansible")
 
     # test_vrf options
     parser.addoption("--vrf_capacity", action="store", default=None, type=int, help="vrf capacity of dut (4-1000)")
@@ -100,19 +103,27 @@ def testbed(request):
 
 
 @pytest.fixture(scope="module")
-def testbed_devices(ansible_adhoc, testbed):
+def testbed_devices(ansible_adhoc, testbed, creds, request):
     """
     @summary: Fixture for creating dut, localhost and other necessary objects for testing. These objects provide
         interfaces for interacting with the devices used in testing.
     @param ansible_adhoc: Fixture provided by the pytest-ansible package. Source of the various device objects. It is
         mandatory argument for the class constructors.
     @param testbed: Fixture for parsing testbed configuration file.
+    @param creds: Fixture for reading lab credentials, used for the DUT persistent SSH connection.
     @return: Return the created device objects in a dictionary
     """
 
+    dut = SonicHost(ansible_adhoc, testbed["dut"])
+    if request.config.getoption("--persistent_ssh"):
+        dut_vars = dut.host.options["inventory_manager"].get_host(dut.hostname).get_vars()
+        dut.enable_command_channel(dut_vars.get("ansible_host", dut.hostname),
+                                   creds["sonicadmin_user"], creds["sonicadmin_password"])
+    dut.gather_facts()
+
     devices = {
         "localhost": Localhost(ansible_adhoc),
-        "dut": SonicHost(ansible_adhoc, testbed["dut"], gather_facts=True)}
+        "dut": dut}
 
     if "ptf" in testbed:
         devices["ptf"] = PTFHost(ansible_adhoc, testbed["ptf"])
@@ -217,6 +228,11 @@ def pytest_runtest_makereport(item, call):
 
     setattr(item, "rep_" + rep.when, rep)
 
+
+def pytest_sessionfinish(session, exitstatus):
+    # close the persistent SSH connections opened by --persistent_ssh
+    close_command_channels()
+
 def fetch_dbs(duthost, testname):
     dbs = [[0, "appdb"], [1, "asicdb"], [2, "counterdb"], [4, "configdb"]]
     for db in dbs:
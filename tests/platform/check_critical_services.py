@@ -11,12 +11,13 @@ from common.utilities import wait_until
 
 def _all_critical_services_fully_started(dut):
     logging.info("Check critical service status")
-    if not dut.critical_services_fully_started():
+    services_status = dut.get_services_status(dut.CRITICAL_SERVICES)
+    if not all([status["container_running"] for status in services_status.values()]):
         logging.info("dut.critical_services_fully_started is False")
         return False
 
     for service in dut.CRITICAL_SERVICES:
-        status = dut.get_service_props(service)
+        status = services_status[service]
         if status["ActiveState"] != "active":
             logging.info("ActiveState of %s is %s, expected: active" % (service, status["ActiveState"]))
             return False